@@ -0,0 +1,31 @@
+# coding: utf-8
+
+
+"""add database size
+
+Revision ID: 4e8b6a0d3f91
+Revises: d93a41c7e250
+Create Date: 2026-10-18 14:21:09.873456
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = '4e8b6a0d3f91'
+down_revision = 'd93a41c7e250'
+
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    op.add_column('databases', sa.Column('size', sa.Integer(), nullable=True))
+    op.execute('UPDATE databases SET size = octet_length(content)')
+    op.alter_column('databases', 'size', nullable=False)
+
+
+def downgrade():
+    op.drop_column('databases', 'size')
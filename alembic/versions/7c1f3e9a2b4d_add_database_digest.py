@@ -0,0 +1,63 @@
+# coding: utf-8
+
+
+"""add database digest
+
+Revision ID: 7c1f3e9a2b4d
+Revises: 02124ca8871d
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = '7c1f3e9a2b4d'
+down_revision = '02124ca8871d'
+
+
+import hashlib
+
+import sqlalchemy as sa
+from alembic import op
+
+
+databases = sa.table(
+    'databases',
+    sa.column('id', sa.Integer),
+    sa.column('content', sa.Binary),
+    sa.column('digest', sa.String)
+)
+
+
+def upgrade():
+    op.add_column('databases', sa.Column('digest', sa.String(), nullable=True))
+
+    backfill_digests()
+
+    op.alter_column('databases', 'digest', nullable=False)
+
+
+def backfill_digests():
+    connection = op.get_bind()
+    ids = [
+        x.id for x in connection.execute(sa.select([databases.c.id]))
+    ]
+
+    # Fetch contents one by one to avoid holding every blob in memory
+    for database_id in ids:
+        content = connection.execute(
+            sa.select([databases.c.content])
+            .where(databases.c.id == database_id)
+        ).scalar()
+
+        connection.execute(
+            databases.update()
+            .where(databases.c.id == database_id)
+            .values(digest=hashlib.sha256(content).hexdigest())
+        )
+
+
+def downgrade():
+    op.drop_column('databases', 'digest')
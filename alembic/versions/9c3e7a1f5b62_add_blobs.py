@@ -0,0 +1,111 @@
+# coding: utf-8
+
+
+"""add blobs shared by content digest
+
+Revision ID: 9c3e7a1f5b62
+Revises: f2a9c8e1d734
+Create Date: 2026-10-18 19:42:51.318205
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = '9c3e7a1f5b62'
+down_revision = 'f2a9c8e1d734'
+
+
+import sqlalchemy as sa
+from alembic import op
+
+
+CONTENT_TABLES = ['databases', 'database_variants', 'database_revisions']
+
+
+blobs = sa.table(
+    'blobs',
+    sa.column('digest', sa.String),
+    sa.column('content', sa.Binary)
+)
+
+
+def make_content_table(name):
+    return sa.table(
+        name,
+        sa.column('id', sa.Integer),
+        sa.column('content', sa.Binary),
+        sa.column('digest', sa.String)
+    )
+
+
+def make_foreign_key_name(table):
+    return '{0}_digest_fkey'.format(table)
+
+
+def upgrade():
+    op.create_table(
+        'blobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('digest', sa.String(), nullable=False),
+        sa.Column('content', sa.Binary(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('digest')
+    )
+
+    backfill_blobs()
+
+    for table in CONTENT_TABLES:
+        op.drop_column(table, 'content')
+        op.create_foreign_key(
+            make_foreign_key_name(table), table, 'blobs',
+            ['digest'], ['digest']
+        )
+
+
+def backfill_blobs():
+    connection = op.get_bind()
+    digests = set()
+
+    for table in CONTENT_TABLES:
+        content_table = make_content_table(table)
+        rows = connection.execute(
+            sa.select([content_table.c.id, content_table.c.digest])
+        ).fetchall()
+
+        # Fetch contents one by one to avoid holding every blob in memory
+        for row in rows:
+            if row.digest in digests:
+                continue
+
+            content = connection.execute(
+                sa.select([content_table.c.content])
+                .where(content_table.c.id == row.id)
+            ).scalar()
+
+            connection.execute(
+                blobs.insert().values(digest=row.digest, content=content)
+            )
+            digests.add(row.digest)
+
+
+def downgrade():
+    for table in CONTENT_TABLES:
+        op.drop_constraint(
+            make_foreign_key_name(table), table, type_='foreignkey'
+        )
+        op.add_column(
+            table, sa.Column('content', sa.Binary(), nullable=True)
+        )
+
+        content_table = make_content_table(table)
+        op.execute(
+            content_table.update().values(
+                content=sa.select([blobs.c.content])
+                .where(blobs.c.digest == content_table.c.digest)
+                .as_scalar()
+            )
+        )
+
+    op.drop_table('blobs')
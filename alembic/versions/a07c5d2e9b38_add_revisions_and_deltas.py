@@ -0,0 +1,51 @@
+# coding: utf-8
+
+
+"""add database revisions and deltas
+
+Revision ID: a07c5d2e9b38
+Revises: 4e8b6a0d3f91
+Create Date: 2026-10-18 15:48:22.604519
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = 'a07c5d2e9b38'
+down_revision = '4e8b6a0d3f91'
+
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    op.create_table(
+        'database_revisions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('schema_version', sa.Integer(), nullable=False),
+        sa.Column('version', sa.String(), nullable=False),
+        sa.Column('content', sa.Binary(), nullable=False),
+        sa.Column('digest', sa.String(), nullable=False),
+        sa.Column('published_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('schema_version', 'version')
+    )
+
+    op.create_table(
+        'database_deltas',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('schema_version', sa.Integer(), nullable=False),
+        sa.Column('from_version', sa.String(), nullable=False),
+        sa.Column('to_digest', sa.String(), nullable=False),
+        sa.Column('content', sa.Binary(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('schema_version', 'from_version')
+    )
+
+
+def downgrade():
+    op.drop_table('database_deltas')
+    op.drop_table('database_revisions')
@@ -0,0 +1,83 @@
+# coding: utf-8
+
+
+"""add database variants
+
+Revision ID: b5d02e6f8a17
+Revises: 7c1f3e9a2b4d
+Create Date: 2026-10-18 11:40:05.118735
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = 'b5d02e6f8a17'
+down_revision = '7c1f3e9a2b4d'
+
+
+import zlib
+
+import sqlalchemy as sa
+from alembic import op
+
+
+GZIP_ENCODING = 'gzip'
+GZIP_COMPRESSION_LEVEL = 9
+GZIP_WINDOW_BITS = 16 + zlib.MAX_WBITS
+
+
+databases = sa.table(
+    'databases',
+    sa.column('id', sa.Integer),
+    sa.column('content', sa.Binary)
+)
+
+
+def upgrade():
+    variants = op.create_table(
+        'database_variants',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('database_id', sa.Integer(), nullable=False),
+        sa.Column('encoding', sa.String(), nullable=False),
+        sa.Column('content', sa.Binary(), nullable=False),
+        sa.ForeignKeyConstraint(['database_id'], ['databases.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('database_id', 'encoding')
+    )
+
+    backfill_gzip_variants(variants)
+
+
+def backfill_gzip_variants(variants):
+    # Only gzip is backfilled since it needs no optional packages, other
+    # variants appear with the next publication
+    connection = op.get_bind()
+    ids = [
+        x.id for x in connection.execute(sa.select([databases.c.id]))
+    ]
+
+    for database_id in ids:
+        content = connection.execute(
+            sa.select([databases.c.content])
+            .where(databases.c.id == database_id)
+        ).scalar()
+
+        connection.execute(variants.insert().values(
+            database_id=database_id,
+            encoding=GZIP_ENCODING,
+            content=gzip(content)
+        ))
+
+
+def gzip(binary):
+    compressor = zlib.compressobj(
+        GZIP_COMPRESSION_LEVEL, zlib.DEFLATED, GZIP_WINDOW_BITS
+    )
+    return compressor.compress(binary) + compressor.flush()
+
+
+def downgrade():
+    op.drop_table('database_variants')
@@ -0,0 +1,31 @@
+# coding: utf-8
+
+
+"""add blob released at
+
+Revision ID: c48e2b7d1f93
+Revises: 9c3e7a1f5b62
+Create Date: 2026-10-18 21:07:36.524918
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = 'c48e2b7d1f93'
+down_revision = '9c3e7a1f5b62'
+
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    op.add_column(
+        'blobs', sa.Column('released_at', sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column('blobs', 'released_at')
@@ -0,0 +1,35 @@
+# coding: utf-8
+
+
+"""add database published_at
+
+Revision ID: d93a41c7e250
+Revises: b5d02e6f8a17
+Create Date: 2026-10-18 13:02:47.550291
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = 'd93a41c7e250'
+down_revision = 'b5d02e6f8a17'
+
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    # Existing rows are considered published at the moment of migration
+    op.add_column(
+        'databases',
+        sa.Column('published_at', sa.DateTime(), nullable=False,
+                  server_default=sa.text("timezone('utc', now())"))
+    )
+    op.alter_column('databases', 'published_at', server_default=None)
+
+
+def downgrade():
+    op.drop_column('databases', 'published_at')
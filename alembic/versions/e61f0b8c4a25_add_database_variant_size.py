@@ -0,0 +1,33 @@
+# coding: utf-8
+
+
+"""add database variant size
+
+Revision ID: e61f0b8c4a25
+Revises: a07c5d2e9b38
+Create Date: 2026-10-18 17:03:41.227964
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = 'e61f0b8c4a25'
+down_revision = 'a07c5d2e9b38'
+
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    op.add_column(
+        'database_variants', sa.Column('size', sa.Integer(), nullable=True)
+    )
+    op.execute('UPDATE database_variants SET size = octet_length(content)')
+    op.alter_column('database_variants', 'size', nullable=False)
+
+
+def downgrade():
+    op.drop_column('database_variants', 'size')
@@ -0,0 +1,73 @@
+# coding: utf-8
+
+
+"""allow content kept in blob store
+
+Revision ID: f2a9c8e1d734
+Revises: e61f0b8c4a25
+Create Date: 2026-10-18 18:26:13.950127
+
+"""
+
+
+from __future__ import absolute_import
+
+
+revision = 'f2a9c8e1d734'
+down_revision = 'e61f0b8c4a25'
+
+
+import hashlib
+
+import sqlalchemy as sa
+from alembic import op
+
+
+CONTENT_TABLES = ['databases', 'database_variants', 'database_revisions']
+
+
+database_variants = sa.table(
+    'database_variants',
+    sa.column('id', sa.Integer),
+    sa.column('content', sa.Binary),
+    sa.column('digest', sa.String)
+)
+
+
+def upgrade():
+    for table in CONTENT_TABLES:
+        op.alter_column(table, 'content', nullable=True)
+
+    op.add_column(
+        'database_variants', sa.Column('digest', sa.String(), nullable=True)
+    )
+    backfill_variant_digests()
+    op.alter_column('database_variants', 'digest', nullable=False)
+
+
+def backfill_variant_digests():
+    connection = op.get_bind()
+    ids = [
+        x.id for x in connection.execute(sa.select([database_variants.c.id]))
+    ]
+
+    # Fetch contents one by one to avoid holding every blob in memory
+    for variant_id in ids:
+        content = connection.execute(
+            sa.select([database_variants.c.content])
+            .where(database_variants.c.id == variant_id)
+        ).scalar()
+
+        connection.execute(
+            database_variants.update()
+            .where(database_variants.c.id == variant_id)
+            .values(digest=hashlib.sha256(content).hexdigest())
+        )
+
+
+def downgrade():
+    # Content moved to the blob store cannot be restored here
+    op.drop_column('database_variants', 'digest')
+
+    for table in CONTENT_TABLES:
+        op.alter_column(table, 'content', nullable=False)
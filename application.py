@@ -3,11 +3,16 @@
 
 import argparse
 
-from backend import server
+from backend import db, server
 
 
 def main():
-    run_server(parse_args())
+    args = parse_args()
+
+    if args.init_schema:
+        init_schema()
+    else:
+        run_server(args)
 
 
 def parse_args():
@@ -15,10 +20,16 @@ def parse_args():
 
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--use-reloader', action='store_true')
+    parser.add_argument('--init-schema', action='store_true')
 
     return parser.parse_args()
 
 
+def init_schema():
+    with db.Session(init_schema=True):
+        pass
+
+
 def run_server(args):
     server.app.run(debug=args.debug, use_reloader=args.use_reloader)
 
@@ -0,0 +1,360 @@
+# coding: utf-8
+
+
+import asyncio
+import concurrent.futures
+import io
+import json
+import sys
+from http import HTTPStatus
+
+import werkzeug.exceptions as http_exceptions
+import werkzeug.urls
+
+from backend import server, service, views
+
+
+class AsgiApplication:
+    # Threads are only taken for the application code, writing a response
+    # to a slow client or waiting for a publication does not occupy one
+    THREAD_COUNT = 64
+
+    LATIN1_ENCODING = 'latin-1'
+    UTF8_ENCODING = 'utf-8'
+
+    SCOPE_HTTP = 'http'
+    SCOPE_LIFESPAN = 'lifespan'
+
+    ENDPOINT_INFO = 'DatabasesView:info'
+    ENDPOINT_EVENTS = 'DatabasesView:events'
+
+    _END = object()
+
+    def __init__(self, wsgi_app, max_body_length=None):
+        self._wsgi_app = wsgi_app
+        self._max_body_length = max_body_length
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            self.THREAD_COUNT
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == self.SCOPE_LIFESPAN:
+            await self._serve_lifespan(receive, send)
+        elif scope['type'] == self.SCOPE_HTTP:
+            await self._serve_http(scope, receive, send)
+
+    async def _serve_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _serve_http(self, scope, receive, send):
+        body = AsgiInput(
+            receive, asyncio.get_event_loop(), self._max_body_length
+        )
+        environ = self._build_environ(scope, body)
+        endpoint, route_args = self._match_route(environ)
+        args = werkzeug.urls.url_decode(environ['QUERY_STRING'])
+
+        # Publication is waited for on the event loop, the application
+        # then checks the version only once
+        wait_version = args.get(views.DatabasesView.ARG_WAIT)
+        if endpoint == self.ENDPOINT_INFO and wait_version:
+            await self._wait_for_change(
+                route_args['schema_version'], wait_version,
+                views.DatabasesView.get_wait_timeout(args)
+            )
+            args[views.DatabasesView.ARG_TIMEOUT] = '0'
+            environ['QUERY_STRING'] = werkzeug.urls.url_encode(args)
+
+        response = AsgiResponse()
+        chunks = await self._run(
+            self._wsgi_app, environ, response.start_response
+        )
+
+        if body.is_too_large:
+            await self._close(chunks)
+            await self._send_error(
+                send, http_exceptions.RequestEntityTooLarge()
+            )
+            return
+
+        # Event streams never end on their own, so they are closed once
+        # the client disconnects
+        disconnected = asyncio.ensure_future(
+            self._wait_for_disconnect(receive)
+        )
+
+        if endpoint == self.ENDPOINT_EVENTS and (
+            response.status == HTTPStatus.OK
+        ):
+            # Events of the application wait on a thread, the same events
+            # are made here instead
+            await self._close(chunks)
+            body_chunks = self._iterate_version_events(
+                route_args['schema_version'],
+                environ.get('HTTP_LAST_EVENT_ID'),
+                disconnected
+            )
+        else:
+            body_chunks = self._iterate_chunks(chunks)
+
+        try:
+            chunk = await self._next_chunk(body_chunks)
+
+            await send({
+                'type': 'http.response.start',
+                'status': response.status,
+                'headers': response.headers
+            })
+
+            while chunk is not self._END and not disconnected.done():
+                if chunk:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True
+                    })
+                chunk = await self._next_chunk(body_chunks)
+
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            await body_chunks.aclose()
+
+    def _match_route(self, environ):
+        try:
+            return self._wsgi_app.url_map.bind_to_environ(environ).match()
+        except http_exceptions.HTTPException:
+            return None, {}
+
+    async def _wait_for_change(self, schema_version, known_version, timeout,
+                               disconnected=None):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        watcher = service.DatabaseVersionWatcher.get()
+        changed = asyncio.Event()
+
+        def on_change():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(changed.set)
+
+        watcher.subscribe(on_change)
+        try:
+            while True:
+                # Event is cleared before the check so that a publication
+                # made right after it still ends the wait
+                changed.clear()
+                version = await self._run(
+                    watcher.find_version, schema_version
+                )
+
+                remaining = deadline - loop.time()
+                if (version != known_version or remaining <= 0 or
+                        (disconnected and disconnected.done())):
+                    return version
+
+                waiters = [asyncio.ensure_future(changed.wait())]
+                if disconnected:
+                    waiters.append(disconnected)
+                await asyncio.wait(
+                    waiters, timeout=min(remaining, watcher.POLL_INTERVAL),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                waiters[0].cancel()
+        finally:
+            watcher.unsubscribe(on_change)
+
+    async def _iterate_version_events(self, schema_version, known_version,
+                                      disconnected):
+        while not disconnected.done():
+            version = await self._wait_for_change(
+                schema_version, known_version,
+                views.DatabasesView.EVENTS_KEEPALIVE_INTERVAL, disconnected
+            )
+
+            event = views.DatabasesView.make_version_event(
+                schema_version, known_version, version
+            )
+            yield event.encode(self.UTF8_ENCODING)
+            known_version = version
+
+    async def _iterate_chunks(self, chunks):
+        try:
+            iterator = iter(chunks)
+            while True:
+                chunk = await self._run(next, iterator, self._END)
+                if chunk is self._END:
+                    return
+                yield chunk
+        finally:
+            await self._close(chunks)
+
+    async def _next_chunk(self, body_chunks):
+        try:
+            return await body_chunks.__anext__()
+        except StopAsyncIteration:
+            return self._END
+
+    async def _close(self, chunks):
+        if hasattr(chunks, 'close'):
+            await self._run(chunks.close)
+
+    async def _send_error(self, send, exception):
+        body = json.dumps(dict(
+            status_code=exception.code,
+            name=exception.name,
+            description=exception.description
+        )).encode(self.UTF8_ENCODING)
+
+        await send({
+            'type': 'http.response.start',
+            'status': exception.code,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode())
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _wait_for_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    def _run(self, function, *args):
+        return asyncio.get_event_loop().run_in_executor(
+            self._executor, function, *args
+        )
+
+    def _build_environ(self, scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': self._to_wsgi_str(scope.get('root_path', '')),
+            'PATH_INFO': self._to_wsgi_str(scope['path']),
+            'QUERY_STRING': scope.get('query_string', b'').decode(
+                self.LATIN1_ENCODING
+            ),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': 'HTTP/{0}'.format(scope['http_version']),
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            # Body of unknown length is read up to its end
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            # Bodies are read on whatever thread is free between sends to
+            # the client, the pooled connection is not held meanwhile
+            server.ENVIRON_RELEASE_CONNECTIONS: True
+        }
+
+        for name, value in scope.get('headers', []):
+            self._add_header(
+                environ,
+                name.decode(self.LATIN1_ENCODING),
+                value.decode(self.LATIN1_ENCODING)
+            )
+
+        return environ
+
+    def _to_wsgi_str(self, path):
+        # WSGI strings carry raw bytes decoded as latin-1
+        return path.encode(self.UTF8_ENCODING).decode(self.LATIN1_ENCODING)
+
+    def _add_header(self, environ, name, value):
+        key = name.upper().replace('-', '_')
+        if key not in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+            key = 'HTTP_' + key
+
+        if key in environ:
+            value = environ[key] + ',' + value
+        environ[key] = value
+
+
+class AsgiInput(io.RawIOBase):
+    # Body is passed to the application as it is received, its length is
+    # checked on the way since it is not always declared up front
+    def __init__(self, receive, loop, max_length=None):
+        self._receive = receive
+        self._loop = loop
+        self._max_length = max_length
+        self._chunk = b''
+        self._position = 0
+        self._length = 0
+        self._is_complete = False
+        self.is_too_large = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._position >= len(self._chunk):
+            if self._is_complete:
+                return 0
+
+            self._chunk = self._receive_chunk()
+            self._position = 0
+
+        size = min(len(buffer), len(self._chunk) - self._position)
+        buffer[:size] = self._chunk[self._position:self._position + size]
+        self._position += size
+
+        return size
+
+    def _receive_chunk(self):
+        # Application reads on a thread of the executor while messages are
+        # received on the event loop
+        message = asyncio.run_coroutine_threadsafe(
+            self._receive(), self._loop
+        ).result()
+
+        if message['type'] == 'http.disconnect':
+            self._is_complete = True
+            raise http_exceptions.ClientDisconnected()
+
+        chunk = message.get('body', b'')
+        self._length += len(chunk)
+        self._is_complete = not message.get('more_body', False)
+
+        if self._max_length is not None and self._length > self._max_length:
+            self._is_complete = True
+            self.is_too_large = True
+            raise http_exceptions.RequestEntityTooLarge()
+
+        return chunk
+
+
+class AsgiResponse:
+    LATIN1_ENCODING = 'latin-1'
+
+    def __init__(self):
+        self.status = None
+        self.headers = None
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info and self.status is not None:
+            raise exc_info[1].with_traceback(exc_info[2])
+
+        self.status = int(status.split(' ', 1)[0])
+        self.headers = [
+            (name.lower().encode(self.LATIN1_ENCODING),
+             value.encode(self.LATIN1_ENCODING))
+            for name, value in headers
+        ]
+
+
+app = AsgiApplication(server.app, server.app.config['MAX_CONTENT_LENGTH'])
@@ -0,0 +1,227 @@
+# coding: utf-8
+
+
+import asyncio
+import json
+import time
+
+import sqlalchemy as sa
+
+from backend import asgi, db, server, service
+from backend.service_test import BaseDbAwareTest
+
+
+class TestAsgiApplication(BaseDbAwareTest):
+    def _request(self, path, method='GET', headers=(), body=b'',
+                 query_string=b'', chunks=None, app=None,
+                 is_disconnected=None, on_start=None):
+        messages = []
+        requests = [
+            {'type': 'http.request', 'body': x, 'more_body': True}
+            for x in (chunks or [body])
+        ]
+        requests[-1]['more_body'] = False
+
+        async def receive():
+            if requests:
+                return requests.pop(0)
+
+            # Client stays connected until the response is sent, unless
+            # it is told to go away
+            while not (is_disconnected and is_disconnected(messages)):
+                await asyncio.sleep(0.01)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'path': path,
+            'query_string': query_string,
+            'headers': [
+                (x.encode('latin-1'), y.encode('latin-1')) for x, y in headers
+            ]
+        }
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            if on_start:
+                on_start(loop)
+            loop.run_until_complete(
+                (app or asgi.AsgiApplication(server.app))(
+                    scope, receive, send
+                )
+            )
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+        return messages
+
+    def _get_body(self, messages):
+        return b''.join(x.get('body', b'') for x in messages[1:])
+
+    def _forbid_thread_wait(self, monkeypatch):
+        def wait_for_change(watcher, schema_version, known_version, timeout):
+            assert timeout == 0
+            return watcher.find_version(schema_version)
+
+        monkeypatch.setattr(
+            service.DatabaseVersionWatcher, 'wait_for_change',
+            wait_for_change
+        )
+
+    def test_info_is_served(self):
+        self.init_filled_database()
+        messages = self._request('/databases/1/')
+
+        assert messages[0]['status'] == 200
+        assert json.loads(messages[1]['body'].decode('utf-8'))[
+            'version'
+        ] == '1'
+        assert messages[-1] == {'type': 'http.response.body', 'body': b''}
+
+    def test_content_is_streamed(self):
+        self.init_filled_database()
+        messages = self._request('/databases/5/content/')
+
+        assert messages[0]['status'] == 200
+        assert (b'content-length', b'5') in messages[0]['headers']
+        assert b''.join(x.get('body', b'') for x in messages[1:]) == bytes(5)
+
+    def test_content_releases_connection_between_windows(self,
+                                                         monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        monkeypatch.setattr(service.ContentCache.get(), '_max_size', 0)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        checkouts = []
+
+        def on_checkout(*args):
+            checkouts.append(args)
+
+        engine = db.Engine.get()
+        sa.event.listen(engine, 'checkout', on_checkout)
+        try:
+            messages = self._request('/databases/1/content/')
+        finally:
+            sa.event.remove(engine, 'checkout', on_checkout)
+
+        assert self._get_body(messages) == b'0123456789'
+        assert len(checkouts) == 3
+
+    def test_missing_database_is_not_found(self):
+        self.init_filled_database()
+        messages = self._request('/databases/100/')
+
+        assert messages[0]['status'] == 404
+
+    def test_request_body_is_passed(self):
+        self.init_filled_database()
+        body = json.dumps(dict(schema_versions=[dict(schema_version=2)]))
+        messages = self._request(
+            '/databases/manifest/', method='POST',
+            headers=[('Content-Type', 'application/json')],
+            body=body.encode('utf-8')
+        )
+
+        assert messages[0]['status'] == 200
+        assert json.loads(messages[1]['body'].decode('utf-8'))[
+            'databases'
+        ][0]['schema_version'] == 2
+
+    def test_request_body_is_passed_in_chunks(self):
+        self.init_filled_database()
+        body = json.dumps(dict(schema_versions=[dict(schema_version=2)]))
+        binary = body.encode('utf-8')
+        messages = self._request(
+            '/databases/manifest/', method='POST',
+            headers=[('Content-Type', 'application/json')],
+            chunks=[binary[:5], binary[5:10], binary[10:]]
+        )
+
+        assert messages[0]['status'] == 200
+        assert json.loads(self._get_body(messages).decode('utf-8'))[
+            'databases'
+        ][0]['schema_version'] == 2
+
+    def test_too_large_body_fails(self, monkeypatch):
+        self.init_filled_database()
+        received_chunks = []
+        chunks = [b'{"schema_versions": ', b'[' * 8, b']' * 8, b'}']
+        receive_chunk = asgi.AsgiInput._receive_chunk
+
+        def record_chunk(body):
+            chunk = receive_chunk(body)
+            received_chunks.append(chunk)
+            return chunk
+
+        monkeypatch.setattr(asgi.AsgiInput, '_receive_chunk', record_chunk)
+        messages = self._request(
+            '/databases/manifest/', method='POST',
+            headers=[('Content-Type', 'application/json')],
+            chunks=chunks, app=asgi.AsgiApplication(server.app, 24)
+        )
+
+        assert messages[0]['status'] == 413
+        assert json.loads(self._get_body(messages).decode('utf-8'))[
+            'status_code'
+        ] == 413
+        assert received_chunks == chunks[:1]
+
+    def test_wait_is_done_on_event_loop(self, monkeypatch):
+        self.init_filled_database()
+        self._forbid_thread_wait(monkeypatch)
+        versions = ['1']
+        monkeypatch.setattr(
+            service.DatabaseVersionWatcher, 'find_version',
+            lambda watcher, schema_version: versions[0]
+        )
+
+        def publish():
+            versions[0] = '2'
+            service.DatabaseVersionWatcher.get().notify()
+
+        started_at = time.monotonic()
+        messages = self._request(
+            '/databases/1/', query_string=b'wait=1&timeout=30',
+            on_start=lambda loop: loop.call_later(0.2, publish)
+        )
+
+        assert messages[0]['status'] == 200
+        assert time.monotonic() - started_at < 10
+
+    def test_wait_ends_with_timeout(self, monkeypatch):
+        self.init_filled_database()
+        self._forbid_thread_wait(monkeypatch)
+
+        messages = self._request(
+            '/databases/1/', query_string=b'wait=1&timeout=1'
+        )
+
+        assert messages[0]['status'] == 200
+        assert json.loads(self._get_body(messages).decode('utf-8'))[
+            'version'
+        ] == '1'
+
+    def test_events_are_made_on_event_loop(self, monkeypatch):
+        self.init_filled_database()
+        self._forbid_thread_wait(monkeypatch)
+
+        messages = self._request(
+            '/databases/1/events/', headers=[('Last-Event-ID', '0')],
+            is_disconnected=lambda x: len(x) > 1
+        )
+
+        assert messages[0]['status'] == 200
+        assert (b'cache-control', b'no-cache') in messages[0]['headers']
+        assert messages[1]['body'].decode('utf-8') == (
+            'id: 1\nevent: version\n'
+            'data: {"schema_version": 1, "version": "1"}\n\n'
+        )
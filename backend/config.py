@@ -10,6 +10,27 @@ import os
 class Config(abc.ABC):
     PLATFORM_VARIABLE_HEROKU = 'DYNO'
 
+    DEFAULT_CONTENT_CACHE_SIZE = 64 * 1024 * 1024
+    DEFAULT_REVISION_COUNT = 5
+
+    DEFAULT_DB_POOL_SIZE = 5
+    DEFAULT_DB_MAX_OVERFLOW = 10
+    DEFAULT_DB_POOL_PRE_PING = False
+    # Negative recycle time keeps connections for good
+    DEFAULT_DB_POOL_RECYCLE = -1
+    DEFAULT_DB_POOL_TIMEOUT = 30
+    DEFAULT_DB_REPLICA_MAX_LAG = 10
+
+    DEFAULT_DB_SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+    DEFAULT_DB_SQLITE_CACHE_SIZE = 64 * 1024 * 1024
+    # Transactions committed in WAL mode only stay durable till power loss
+    DEFAULT_DB_SQLITE_SYNCHRONOUS = 'NORMAL'
+
+    BLOB_SENDFILE_WSGI = 'wsgi'
+    BLOB_SENDFILE_X_SENDFILE = 'x-sendfile'
+    BLOB_SENDFILE_X_ACCEL_REDIRECT = 'x-accel-redirect'
+    DEFAULT_BLOB_ACCEL_REDIRECT_PREFIX = '/'
+
     _config = None
 
     @property
@@ -22,6 +43,70 @@ class Config(abc.ABC):
     def key_binaries(self):
         pass
 
+    @property
+    def key_source(self):
+        return StaticKeyBinarySource(self.key_binaries or [])
+
+    @property
+    def content_cache_size(self):
+        return self.DEFAULT_CONTENT_CACHE_SIZE
+
+    @property
+    def revision_count(self):
+        return self.DEFAULT_REVISION_COUNT
+
+    @property
+    def db_pool_size(self):
+        return self.DEFAULT_DB_POOL_SIZE
+
+    @property
+    def db_max_overflow(self):
+        return self.DEFAULT_DB_MAX_OVERFLOW
+
+    @property
+    def db_pool_pre_ping(self):
+        return self.DEFAULT_DB_POOL_PRE_PING
+
+    @property
+    def db_pool_recycle(self):
+        return self.DEFAULT_DB_POOL_RECYCLE
+
+    @property
+    def db_pool_timeout(self):
+        return self.DEFAULT_DB_POOL_TIMEOUT
+
+    @property
+    def db_replica_urls(self):
+        return []
+
+    @property
+    def db_replica_max_lag(self):
+        return self.DEFAULT_DB_REPLICA_MAX_LAG
+
+    @property
+    def db_sqlite_mmap_size(self):
+        return self.DEFAULT_DB_SQLITE_MMAP_SIZE
+
+    @property
+    def db_sqlite_cache_size(self):
+        return self.DEFAULT_DB_SQLITE_CACHE_SIZE
+
+    @property
+    def db_sqlite_synchronous(self):
+        return self.DEFAULT_DB_SQLITE_SYNCHRONOUS
+
+    @property
+    def blob_dir(self):
+        return None
+
+    @property
+    def blob_sendfile(self):
+        return self.BLOB_SENDFILE_WSGI
+
+    @property
+    def blob_accel_redirect_prefix(self):
+        return self.DEFAULT_BLOB_ACCEL_REDIRECT_PREFIX
+
     @classmethod
     def get(cls):
         return cls._config
@@ -47,15 +132,126 @@ class Config(abc.ABC):
 
 class HerokuConfig(Config):
     ENV_DATABASE_URL = 'DATABASE_URL'
+    ENV_CONTENT_CACHE_SIZE = 'BUSTIME_CONTENT_CACHE_SIZE'
+    ENV_REVISION_COUNT = 'BUSTIME_REVISION_COUNT'
+    ENV_DB_POOL_SIZE = 'BUSTIME_DB_POOL_SIZE'
+    ENV_DB_MAX_OVERFLOW = 'BUSTIME_DB_MAX_OVERFLOW'
+    ENV_DB_POOL_PRE_PING = 'BUSTIME_DB_POOL_PRE_PING'
+    ENV_DB_POOL_RECYCLE = 'BUSTIME_DB_POOL_RECYCLE'
+    ENV_DB_POOL_TIMEOUT = 'BUSTIME_DB_POOL_TIMEOUT'
+    ENV_DB_REPLICA_URLS = 'BUSTIME_DB_REPLICA_URLS'
+    ENV_DB_REPLICA_MAX_LAG = 'BUSTIME_DB_REPLICA_MAX_LAG'
+    ENV_DB_SQLITE_MMAP_SIZE = 'BUSTIME_DB_SQLITE_MMAP_SIZE'
+    ENV_DB_SQLITE_CACHE_SIZE = 'BUSTIME_DB_SQLITE_CACHE_SIZE'
+    ENV_DB_SQLITE_SYNCHRONOUS = 'BUSTIME_DB_SQLITE_SYNCHRONOUS'
+    ENV_BLOB_DIR = 'BUSTIME_BLOB_DIR'
+    ENV_BLOB_SENDFILE = 'BUSTIME_BLOB_SENDFILE'
+    ENV_BLOB_ACCEL_REDIRECT_PREFIX = 'BUSTIME_BLOB_ACCEL_REDIRECT_PREFIX'
     KEY_DIR = '../config'
 
     @property
     def db_url(self):
         return os.environ[self.ENV_DATABASE_URL]
 
+    @property
+    def content_cache_size(self):
+        return int(os.environ.get(
+            self.ENV_CONTENT_CACHE_SIZE, super().content_cache_size
+        ))
+
+    @property
+    def revision_count(self):
+        return int(os.environ.get(
+            self.ENV_REVISION_COUNT, super().revision_count
+        ))
+
+    @property
+    def db_pool_size(self):
+        return int(os.environ.get(
+            self.ENV_DB_POOL_SIZE, super().db_pool_size
+        ))
+
+    @property
+    def db_max_overflow(self):
+        return int(os.environ.get(
+            self.ENV_DB_MAX_OVERFLOW, super().db_max_overflow
+        ))
+
+    @property
+    def db_pool_pre_ping(self):
+        value = os.environ.get(self.ENV_DB_POOL_PRE_PING)
+        if value is None:
+            return super().db_pool_pre_ping
+
+        # Same boolean values as in the configuration file are accepted
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+
+    @property
+    def db_pool_recycle(self):
+        return int(os.environ.get(
+            self.ENV_DB_POOL_RECYCLE, super().db_pool_recycle
+        ))
+
+    @property
+    def db_pool_timeout(self):
+        return int(os.environ.get(
+            self.ENV_DB_POOL_TIMEOUT, super().db_pool_timeout
+        ))
+
+    @property
+    def db_replica_urls(self):
+        value = os.environ.get(self.ENV_DB_REPLICA_URLS)
+        if value is None:
+            return super().db_replica_urls
+
+        return value.split()
+
+    @property
+    def db_replica_max_lag(self):
+        return int(os.environ.get(
+            self.ENV_DB_REPLICA_MAX_LAG, super().db_replica_max_lag
+        ))
+
+    @property
+    def db_sqlite_mmap_size(self):
+        return int(os.environ.get(
+            self.ENV_DB_SQLITE_MMAP_SIZE, super().db_sqlite_mmap_size
+        ))
+
+    @property
+    def db_sqlite_cache_size(self):
+        return int(os.environ.get(
+            self.ENV_DB_SQLITE_CACHE_SIZE, super().db_sqlite_cache_size
+        ))
+
+    @property
+    def db_sqlite_synchronous(self):
+        return os.environ.get(
+            self.ENV_DB_SQLITE_SYNCHRONOUS, super().db_sqlite_synchronous
+        )
+
+    @property
+    def blob_dir(self):
+        return os.environ.get(self.ENV_BLOB_DIR, super().blob_dir)
+
+    @property
+    def blob_sendfile(self):
+        return os.environ.get(self.ENV_BLOB_SENDFILE, super().blob_sendfile)
+
+    @property
+    def blob_accel_redirect_prefix(self):
+        return os.environ.get(
+            self.ENV_BLOB_ACCEL_REDIRECT_PREFIX,
+            super().blob_accel_redirect_prefix
+        )
+
     @property
     def key_binaries(self):
-        return EnvVariableKeyBinarySource(os.environ).get_key_binaries()
+        return self.key_source.get_key_binaries()
+
+    @property
+    def key_source(self):
+        return EnvVariableKeyBinarySource(os.environ)
 
 
 class FileConfig(Config):
@@ -66,6 +262,23 @@ class FileConfig(Config):
     PUBLIC_KEY_DIR = '~/.ssh'
 
     DB_URL_CONFIG_KEY = ConfigKey('db', 'url')
+    CONTENT_CACHE_SIZE_CONFIG_KEY = ConfigKey('cache', 'content_size')
+    REVISION_COUNT_CONFIG_KEY = ConfigKey('db', 'revision_count')
+    DB_POOL_SIZE_CONFIG_KEY = ConfigKey('db', 'pool_size')
+    DB_MAX_OVERFLOW_CONFIG_KEY = ConfigKey('db', 'max_overflow')
+    DB_POOL_PRE_PING_CONFIG_KEY = ConfigKey('db', 'pool_pre_ping')
+    DB_POOL_RECYCLE_CONFIG_KEY = ConfigKey('db', 'pool_recycle')
+    DB_POOL_TIMEOUT_CONFIG_KEY = ConfigKey('db', 'pool_timeout')
+    DB_REPLICA_URLS_CONFIG_KEY = ConfigKey('db', 'replica_urls')
+    DB_REPLICA_MAX_LAG_CONFIG_KEY = ConfigKey('db', 'replica_max_lag')
+    DB_SQLITE_MMAP_SIZE_CONFIG_KEY = ConfigKey('db', 'sqlite_mmap_size')
+    DB_SQLITE_CACHE_SIZE_CONFIG_KEY = ConfigKey('db', 'sqlite_cache_size')
+    DB_SQLITE_SYNCHRONOUS_CONFIG_KEY = ConfigKey('db', 'sqlite_synchronous')
+    BLOB_DIR_CONFIG_KEY = ConfigKey('storage', 'blob_dir')
+    BLOB_SENDFILE_CONFIG_KEY = ConfigKey('storage', 'sendfile')
+    BLOB_ACCEL_REDIRECT_PREFIX_CONFIG_KEY = ConfigKey(
+        'storage', 'accel_redirect_prefix'
+    )
 
     def __init__(self):
         self._config_parser = self._get_config_parser()
@@ -89,10 +302,138 @@ class FileConfig(Config):
             self.DB_URL_CONFIG_KEY.option
         )
 
+    @property
+    def content_cache_size(self):
+        return self._config_parser.getint(
+            self.CONTENT_CACHE_SIZE_CONFIG_KEY.section,
+            self.CONTENT_CACHE_SIZE_CONFIG_KEY.option,
+            fallback=super().content_cache_size
+        )
+
+    @property
+    def revision_count(self):
+        return self._config_parser.getint(
+            self.REVISION_COUNT_CONFIG_KEY.section,
+            self.REVISION_COUNT_CONFIG_KEY.option,
+            fallback=super().revision_count
+        )
+
+    @property
+    def db_pool_size(self):
+        return self._config_parser.getint(
+            self.DB_POOL_SIZE_CONFIG_KEY.section,
+            self.DB_POOL_SIZE_CONFIG_KEY.option,
+            fallback=super().db_pool_size
+        )
+
+    @property
+    def db_max_overflow(self):
+        return self._config_parser.getint(
+            self.DB_MAX_OVERFLOW_CONFIG_KEY.section,
+            self.DB_MAX_OVERFLOW_CONFIG_KEY.option,
+            fallback=super().db_max_overflow
+        )
+
+    @property
+    def db_pool_pre_ping(self):
+        return self._config_parser.getboolean(
+            self.DB_POOL_PRE_PING_CONFIG_KEY.section,
+            self.DB_POOL_PRE_PING_CONFIG_KEY.option,
+            fallback=super().db_pool_pre_ping
+        )
+
+    @property
+    def db_pool_recycle(self):
+        return self._config_parser.getint(
+            self.DB_POOL_RECYCLE_CONFIG_KEY.section,
+            self.DB_POOL_RECYCLE_CONFIG_KEY.option,
+            fallback=super().db_pool_recycle
+        )
+
+    @property
+    def db_pool_timeout(self):
+        return self._config_parser.getint(
+            self.DB_POOL_TIMEOUT_CONFIG_KEY.section,
+            self.DB_POOL_TIMEOUT_CONFIG_KEY.option,
+            fallback=super().db_pool_timeout
+        )
+
+    @property
+    def db_replica_urls(self):
+        value = self._config_parser.get(
+            self.DB_REPLICA_URLS_CONFIG_KEY.section,
+            self.DB_REPLICA_URLS_CONFIG_KEY.option,
+            fallback=None
+        )
+        if value is None:
+            return super().db_replica_urls
+
+        return value.split()
+
+    @property
+    def db_replica_max_lag(self):
+        return self._config_parser.getint(
+            self.DB_REPLICA_MAX_LAG_CONFIG_KEY.section,
+            self.DB_REPLICA_MAX_LAG_CONFIG_KEY.option,
+            fallback=super().db_replica_max_lag
+        )
+
+    @property
+    def db_sqlite_mmap_size(self):
+        return self._config_parser.getint(
+            self.DB_SQLITE_MMAP_SIZE_CONFIG_KEY.section,
+            self.DB_SQLITE_MMAP_SIZE_CONFIG_KEY.option,
+            fallback=super().db_sqlite_mmap_size
+        )
+
+    @property
+    def db_sqlite_cache_size(self):
+        return self._config_parser.getint(
+            self.DB_SQLITE_CACHE_SIZE_CONFIG_KEY.section,
+            self.DB_SQLITE_CACHE_SIZE_CONFIG_KEY.option,
+            fallback=super().db_sqlite_cache_size
+        )
+
+    @property
+    def db_sqlite_synchronous(self):
+        return self._config_parser.get(
+            self.DB_SQLITE_SYNCHRONOUS_CONFIG_KEY.section,
+            self.DB_SQLITE_SYNCHRONOUS_CONFIG_KEY.option,
+            fallback=super().db_sqlite_synchronous
+        )
+
+    @property
+    def blob_dir(self):
+        return self._config_parser.get(
+            self.BLOB_DIR_CONFIG_KEY.section,
+            self.BLOB_DIR_CONFIG_KEY.option,
+            fallback=super().blob_dir
+        )
+
+    @property
+    def blob_sendfile(self):
+        return self._config_parser.get(
+            self.BLOB_SENDFILE_CONFIG_KEY.section,
+            self.BLOB_SENDFILE_CONFIG_KEY.option,
+            fallback=super().blob_sendfile
+        )
+
+    @property
+    def blob_accel_redirect_prefix(self):
+        return self._config_parser.get(
+            self.BLOB_ACCEL_REDIRECT_PREFIX_CONFIG_KEY.section,
+            self.BLOB_ACCEL_REDIRECT_PREFIX_CONFIG_KEY.option,
+            fallback=super().blob_accel_redirect_prefix
+        )
+
     @property
     def key_binaries(self):
+        return self.key_source.get_key_binaries()
+
+    @property
+    def key_source(self):
         public_key_dir_path = os.path.expanduser(self.PUBLIC_KEY_DIR)
-        return DirectoryKeyBinarySource(public_key_dir_path).get_key_binaries()
+        return DirectoryKeyBinarySource(public_key_dir_path)
 
 
 class KeyBinarySource(abc.ABC):
@@ -100,6 +441,23 @@ class KeyBinarySource(abc.ABC):
     def get_key_binaries(self):
         pass
 
+    @abc.abstractmethod
+    def get_version(self):
+        # Version changes whenever key binaries may have changed, it is
+        # checked much cheaper than the keys are read
+        pass
+
+
+class StaticKeyBinarySource(KeyBinarySource):
+    def __init__(self, key_binaries):
+        self._key_binaries = key_binaries
+
+    def get_key_binaries(self):
+        return list(self._key_binaries)
+
+    def get_version(self):
+        return tuple(self._key_binaries)
+
 
 class EnvVariableKeyBinarySource(KeyBinarySource):
     PREFIX = 'BUSTIME_PUBLICATION_KEY_'
@@ -115,6 +473,12 @@ class EnvVariableKeyBinarySource(KeyBinarySource):
             if k.startswith(self.PREFIX)
         ]
 
+    def get_version(self):
+        return tuple(sorted(
+            (k, v) for k, v in self._env_variable_dict.items()
+            if k.startswith(self.PREFIX)
+        ))
+
 
 class DirectoryKeyBinarySource(KeyBinarySource):
     KEY_POSTFIX = '.pub'
@@ -130,6 +494,15 @@ class DirectoryKeyBinarySource(KeyBinarySource):
             if x.endswith(self.KEY_POSTFIX)
         ]
 
+    def get_version(self):
+        # Adding, removing or renaming a key changes directory mtime
+        try:
+            mtime = os.stat(self._directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        return self._directory, mtime
+
     def _safe_list_dir(self, directory):
         try:
             return os.listdir(directory)
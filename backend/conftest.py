@@ -0,0 +1,13 @@
+# coding: utf-8
+
+
+import tempfile
+
+import pytest
+
+
+@pytest.fixture
+def temp_dir():
+    # Built-in tmp_path fixture is not available in pinned pytest
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
@@ -1,39 +1,46 @@
 # coding: utf-8
 
 
+import itertools
+import logging
+import os
 import sqlalchemy as sa
 import threading
-from sqlalchemy import orm
+import time
+from sqlalchemy import orm, pool, util
 from sqlalchemy.ext import declarative
 
 from backend import config
 
+logger = logging.getLogger(__name__)
+
 Base = declarative.declarative_base()
 
 
 class Session:
     _session_class = None
+    _session_class_lock = threading.Lock()
 
     def __init__(self, init_schema=False):
         session_class = self._get_session_class()
-        self._session = session_class()
+        # Bound on creation since every process has an engine of its own
+        # and a scope has a connection of its own
+        scope = Scope.find()
+        self._session = session_class(
+            bind=scope.get_primary_connection() if scope else Engine.get()
+        )
 
         if init_schema:
             Base.metadata.create_all(self._session.get_bind())
 
     def _get_session_class(self):
         if not Session._session_class:
-            with threading.Lock():
+            with Session._session_class_lock:
                 if not Session._session_class:
-                    Session._session_class = orm.sessionmaker(
-                        bind=self._create_engine()
-                    )
+                    Session._session_class = orm.sessionmaker()
 
         return Session._session_class
 
-    def _create_engine(self):
-        return sa.create_engine(config.Config.get().db_url)
-
     def __enter__(self):
         return self._session
 
@@ -45,6 +52,309 @@ class Session:
         self._session.close()
 
 
+class Connection:
+    COMPILED_CACHE_SIZE = 100
+
+    # Read statements are compiled once and reused by every connection
+    _compiled_cache = util.LRUCache(COMPILED_CACHE_SIZE)
+
+    def __init__(self):
+        self._scope = Scope.find()
+        if self._scope:
+            self._connection = self._scope.get_connection()
+        else:
+            self._connection = self.connect()
+
+    @classmethod
+    def connect(cls):
+        # Connections are only used for reads, so replicas may serve them
+        return ReplicaSet.get().connect().execution_options(
+            compiled_cache=cls._compiled_cache
+        )
+
+    def __enter__(self):
+        return self._connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Scoped connection is kept for later queries of the scope
+        if not self._scope:
+            self._connection.close()
+
+
+class Scope:
+    # Queries made within a scope, e.g. a web request, share a single
+    # connection taken on first use and released when the scope ends
+    _local = threading.local()
+
+    def __init__(self, is_releasing=False):
+        self._connection = None
+        # Servers of many more clients than pooled connections, e.g. ASGI
+        # ones, have connections released between reads of a streamed body
+        self.is_releasing = is_releasing
+
+    @classmethod
+    def begin(cls, is_releasing=False):
+        cls.end()
+        cls._local.scope = Scope(is_releasing)
+
+    @classmethod
+    def end(cls, error=None):
+        scope = cls.find()
+        cls._local.scope = None
+
+        if scope:
+            scope._release()
+
+    @classmethod
+    def find(cls):
+        return getattr(cls._local, 'scope', None)
+
+    @classmethod
+    def release(cls):
+        # Connection is given back to the pool, e.g. while waiting, and is
+        # taken again by the next query of the scope
+        scope = cls.find()
+        if scope:
+            scope._release()
+
+    @classmethod
+    def detach(cls):
+        # Connection is handed over, e.g. to a streamed response body that
+        # outlives the scope, and is closed by its new owner
+        scope = cls.find()
+        if not scope:
+            return None
+
+        connection, scope._connection = scope._connection, None
+        return connection
+
+    def get_connection(self):
+        if self._connection is None:
+            self._connection = Connection.connect()
+
+        return self._connection
+
+    def get_primary_connection(self):
+        # Writes go to the primary, reads made there before are reused
+        if (self._connection is not None and
+                self._connection.engine is not Engine.get()):
+            self._release()
+
+        if self._connection is None:
+            self._connection = Engine.get().connect().execution_options(
+                compiled_cache=Connection._compiled_cache
+            )
+
+        return self._connection
+
+    def _release(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class Engine:
+    # Pooled connections must not be shared with a forked process, e.g.
+    # when gunicorn preloads the application, so engines are per process
+    _engines = {}
+    _engines_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, db_url=None):
+        key = (os.getpid(), db_url or config.Config.get().db_url)
+
+        engine = cls._engines.get(key)
+        if not engine:
+            with cls._engines_lock:
+                engine = cls._engines.get(key)
+                if not engine:
+                    engine = cls._create(key[1])
+                    # Engines inherited from a parent are kept referenced,
+                    # closing their connections would break the parent
+                    cls._engines[key] = engine
+
+        return engine
+
+    @classmethod
+    def _create(cls, db_url):
+        db_config = config.Config.get()
+        url = sa.engine.url.make_url(db_url)
+
+        sqlite_file = SqliteFile(db_config)
+
+        options = dict(
+            pool_pre_ping=db_config.db_pool_pre_ping,
+            pool_recycle=db_config.db_pool_recycle
+        )
+        if sqlite_file.is_applicable(url):
+            options.update(sqlite_file.get_engine_options())
+
+        # Sizing only applies to queue pools
+        pool_class = (options.get('poolclass') or
+                      url.get_dialect().get_pool_class(url))
+        if issubclass(pool_class, pool.QueuePool):
+            options.update(
+                pool_size=db_config.db_pool_size,
+                max_overflow=db_config.db_max_overflow,
+                pool_timeout=db_config.db_pool_timeout
+            )
+
+        engine = sa.create_engine(url, **options)
+        if sqlite_file.is_applicable(url):
+            sqlite_file.init(engine)
+
+        return engine
+
+
+class SqliteFile:
+    SQLITE_BACKEND = 'sqlite'
+    MEMORY_DATABASE = ':memory:'
+    SYNCHRONOUS_MODES = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
+    # Publications wait for each other instead of failing
+    BUSY_TIMEOUT = 30
+
+    def __init__(self, db_config):
+        self._db_config = db_config
+
+    def is_applicable(self, url):
+        return (url.get_backend_name() == self.SQLITE_BACKEND and
+                url.database not in [None, '', self.MEMORY_DATABASE])
+
+    def get_engine_options(self):
+        # Connections are pooled so that they keep their page cache and
+        # memory map, a connection is only used by one thread at a time
+        return dict(
+            poolclass=pool.QueuePool,
+            connect_args=dict(
+                check_same_thread=False, timeout=self.BUSY_TIMEOUT
+            )
+        )
+
+    def init(self, engine):
+        sa.event.listen(engine, 'connect', self._on_connect)
+        sa.event.listen(engine, 'begin', self._on_begin)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        # Driver does not begin transactions on its own, see _on_begin
+        dbapi_connection.isolation_level = None
+
+        # Readers of all processes go on while a single writer commits
+        pragmas = [
+            'journal_mode=WAL',
+            'synchronous={0}'.format(self._get_synchronous()),
+            'mmap_size={0:d}'.format(self._db_config.db_sqlite_mmap_size),
+            # Negative cache size is in kibibytes rather than pages
+            'cache_size=-{0:d}'.format(
+                self._db_config.db_sqlite_cache_size // 1024
+            ),
+            'foreign_keys=ON'
+        ]
+
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute('PRAGMA {0}'.format(pragma))
+        finally:
+            cursor.close()
+
+    def _on_begin(self, connection):
+        # Write lock is taken up front, so a publication never fails to
+        # upgrade a read lock while another one commits
+        connection.execute('BEGIN IMMEDIATE')
+
+    def _get_synchronous(self):
+        synchronous = self._db_config.db_sqlite_synchronous.upper()
+        if synchronous not in self.SYNCHRONOUS_MODES:
+            raise ValueError(
+                'Unknown SQLite synchronous mode {0}'.format(synchronous)
+            )
+
+        return synchronous
+
+
+class ReplicaSet:
+    # Replica failed to connect to is skipped for a while
+    RETRY_INTERVAL = 30
+
+    _replica_set = None
+    _replica_set_lock = threading.Lock()
+
+    def __init__(self, db_urls, max_lag):
+        self.db_urls = db_urls
+        self.max_lag = max_lag
+        self._counter = itertools.count()
+        self._failed_until = {}
+        self._pinned_until = 0
+
+    @classmethod
+    def get(cls):
+        db_config = config.Config.get()
+        db_urls = db_config.db_replica_urls
+        max_lag = db_config.db_replica_max_lag
+
+        if not cls._is_actual(cls._replica_set, db_urls, max_lag):
+            with cls._replica_set_lock:
+                if not cls._is_actual(cls._replica_set, db_urls, max_lag):
+                    cls._replica_set = ReplicaSet(db_urls, max_lag)
+
+        return cls._replica_set
+
+    @classmethod
+    def _is_actual(cls, replica_set, db_urls, max_lag):
+        return (replica_set is not None and
+                replica_set.db_urls == db_urls and
+                replica_set.max_lag == max_lag)
+
+    def pin_primary(self):
+        # Replicas may lag behind, so a fresh publication is read from
+        # the primary until they have caught up
+        self._pinned_until = time.monotonic() + self.max_lag
+
+    def connect(self):
+        for db_url in self._get_available_urls():
+            try:
+                return Engine.get(db_url).connect()
+            except sa.exc.DBAPIError:
+                logger.exception('Database replica is not available')
+                self._failed_until[db_url] = (
+                    time.monotonic() + self.RETRY_INTERVAL
+                )
+
+        return Engine.get().connect()
+
+    def _get_available_urls(self):
+        now = time.monotonic()
+        if not self.db_urls or now < self._pinned_until:
+            return []
+
+        # Replicas are taken in turn, the rest follow as a fallback
+        start = next(self._counter) % len(self.db_urls)
+        db_urls = self.db_urls[start:] + self.db_urls[:start]
+
+        return [x for x in db_urls if self._failed_until.get(x, 0) <= now]
+
+
+class Blob(Base):
+    __tablename__ = 'blobs'
+
+    __table_args__ = (
+        sa.UniqueConstraint('digest'),
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    digest = sa.Column(sa.String, nullable=False)
+    # Content is missing when it is kept in the blob store
+    content = orm.deferred(sa.Column(sa.Binary, nullable=True))
+    # Released blobs are kept for a while, downloads started before they
+    # were released still read them
+    released_at = sa.Column(sa.DateTime, nullable=True)
+
+    def __init__(self, digest=None, content=None, released_at=None):
+        self.digest = digest
+        self.content = content
+        self.released_at = released_at
+
+
 class Database(Base):
     __tablename__ = 'databases'
 
@@ -55,9 +365,98 @@ class Database(Base):
     id = sa.Column(sa.Integer, primary_key=True)
     schema_version = sa.Column(sa.Integer, nullable=False)
     version = sa.Column(sa.String, nullable=False)
-    content = orm.deferred(sa.Column(sa.Binary, nullable=False))
+    digest = sa.Column(
+        sa.String, sa.ForeignKey('blobs.digest'), nullable=False
+    )
+    size = sa.Column(sa.Integer, nullable=False)
+    published_at = sa.Column(sa.DateTime, nullable=False)
 
-    def __init__(self, schema_version=None, version=None, content=None):
+    blob = orm.relationship('Blob')
+    variants = orm.relationship(
+        'DatabaseVariant', cascade='all, delete-orphan'
+    )
+
+    def __init__(self, schema_version=None, version=None, blob=None,
+                 digest=None, size=None, published_at=None, variants=None):
         self.schema_version = schema_version
         self.version = version
+        self.blob = blob
+        self.digest = digest
+        self.size = size
+        self.published_at = published_at
+        self.variants = variants or []
+
+
+class DatabaseVariant(Base):
+    __tablename__ = 'database_variants'
+
+    __table_args__ = (
+        sa.UniqueConstraint('database_id', 'encoding'),
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    database_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('databases.id', ondelete='CASCADE'),
+        nullable=False
+    )
+    encoding = sa.Column(sa.String, nullable=False)
+    digest = sa.Column(
+        sa.String, sa.ForeignKey('blobs.digest'), nullable=False
+    )
+    size = sa.Column(sa.Integer, nullable=False)
+
+    blob = orm.relationship('Blob')
+
+    def __init__(self, encoding=None, blob=None, digest=None, size=None):
+        self.encoding = encoding
+        self.blob = blob
+        self.digest = digest
+        self.size = size
+
+
+class DatabaseRevision(Base):
+    __tablename__ = 'database_revisions'
+
+    __table_args__ = (
+        sa.UniqueConstraint('schema_version', 'version'),
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    schema_version = sa.Column(sa.Integer, nullable=False)
+    version = sa.Column(sa.String, nullable=False)
+    digest = sa.Column(
+        sa.String, sa.ForeignKey('blobs.digest'), nullable=False
+    )
+    published_at = sa.Column(sa.DateTime, nullable=False)
+
+    blob = orm.relationship('Blob')
+
+    def __init__(self, schema_version=None, version=None, blob=None,
+                 digest=None, published_at=None):
+        self.schema_version = schema_version
+        self.version = version
+        self.blob = blob
+        self.digest = digest
+        self.published_at = published_at
+
+
+class DatabaseDelta(Base):
+    __tablename__ = 'database_deltas'
+
+    __table_args__ = (
+        sa.UniqueConstraint('schema_version', 'from_version'),
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    schema_version = sa.Column(sa.Integer, nullable=False)
+    from_version = sa.Column(sa.String, nullable=False)
+    to_digest = sa.Column(sa.String, nullable=False)
+    content = orm.deferred(sa.Column(sa.Binary, nullable=False))
+
+    def __init__(self, schema_version=None, from_version=None, to_digest=None,
+                 content=None):
+        self.schema_version = schema_version
+        self.from_version = from_version
+        self.to_digest = to_digest
         self.content = content
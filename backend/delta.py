@@ -0,0 +1,120 @@
+# coding: utf-8
+
+
+import struct
+
+
+class InvalidDeltaError(RuntimeError):
+    def __init__(self, message):
+        self.message = message
+
+
+class PageDelta:
+    MAGIC = b'BTPD'
+    HEADER_FORMAT = '>4sIQ'
+    PAGE_INDEX_FORMAT = '>I'
+
+    SQLITE_HEADER = b'SQLite format 3\x00'
+    SQLITE_PAGE_SIZE_FORMAT = '>H'
+    SQLITE_PAGE_SIZE_OFFSET = 16
+    # Page size of 65536 does not fit into two bytes and is stored as 1
+    SQLITE_MAX_PAGE_SIZE_MARKER = 1
+    MIN_PAGE_SIZE = 512
+    MAX_PAGE_SIZE = 65536
+    DEFAULT_PAGE_SIZE = 4096
+
+    def make(self, source, target):
+        page_size = self._get_page_size(target)
+
+        chunks = [
+            struct.pack(self.HEADER_FORMAT, self.MAGIC, page_size, len(target))
+        ]
+
+        for index, offset in enumerate(range(0, len(target), page_size)):
+            page = target[offset:offset + page_size]
+            if page != source[offset:offset + page_size]:
+                chunks.append(struct.pack(self.PAGE_INDEX_FORMAT, index))
+                chunks.append(page)
+
+        return b''.join(chunks)
+
+    def _get_page_size(self, content):
+        if not content.startswith(self.SQLITE_HEADER):
+            return self.DEFAULT_PAGE_SIZE
+
+        offset = self.SQLITE_PAGE_SIZE_OFFSET
+        page_size_binary = content[offset:offset + 2]
+        if len(page_size_binary) < 2:
+            return self.DEFAULT_PAGE_SIZE
+
+        page_size, = struct.unpack(
+            self.SQLITE_PAGE_SIZE_FORMAT, page_size_binary
+        )
+        if page_size == self.SQLITE_MAX_PAGE_SIZE_MARKER:
+            return self.MAX_PAGE_SIZE
+
+        if not self._is_valid_page_size(page_size):
+            return self.DEFAULT_PAGE_SIZE
+
+        return page_size
+
+    def _is_valid_page_size(self, page_size):
+        is_power_of_two = page_size & (page_size - 1) == 0
+        return (
+            is_power_of_two and
+            self.MIN_PAGE_SIZE <= page_size <= self.MAX_PAGE_SIZE
+        )
+
+    def apply(self, source, delta, max_length=None):
+        header_size = struct.calcsize(self.HEADER_FORMAT)
+        if len(delta) < header_size:
+            raise InvalidDeltaError('Delta header is truncated')
+
+        magic, page_size, target_length = struct.unpack(
+            self.HEADER_FORMAT, delta[:header_size]
+        )
+        if magic != self.MAGIC:
+            raise InvalidDeltaError('Delta has unknown format')
+
+        if not self._is_valid_page_size(page_size):
+            raise InvalidDeltaError('Delta page size is invalid')
+
+        # Length comes from the delta itself and is checked before
+        # anything is allocated
+        if max_length is not None and target_length > max_length:
+            raise InvalidDeltaError('Delta content is too long')
+
+        target = bytearray(source[:target_length])
+        target.extend(bytes(target_length - len(target)))
+
+        offset = header_size
+        while offset < len(delta):
+            offset = self._apply_page(
+                target, page_size, target_length, delta, offset
+            )
+
+        return bytes(target)
+
+    def _apply_page(self, target, page_size, target_length, delta, offset):
+        index_size = struct.calcsize(self.PAGE_INDEX_FORMAT)
+        if len(delta) < offset + index_size:
+            raise InvalidDeltaError('Delta page index is truncated')
+
+        index, = struct.unpack(
+            self.PAGE_INDEX_FORMAT, delta[offset:offset + index_size]
+        )
+        offset += index_size
+
+        page_offset = index * page_size
+        if page_offset >= target_length:
+            raise InvalidDeltaError('Delta page is out of content bounds')
+
+        length = min(page_size, target_length - page_offset)
+        if len(delta) < offset + length:
+            raise InvalidDeltaError('Delta page is truncated')
+
+        target[page_offset:page_offset + length] = (
+            delta[offset:offset + length]
+        )
+
+        return offset + length
@@ -0,0 +1,89 @@
+# coding: utf-8
+
+
+import struct
+
+import pytest
+
+from backend import delta
+
+
+class TestPageDelta:
+    PAGE_SIZE = 512
+
+    def _make_sqlite_content(self, page_count, changed_pages=()):
+        header = (
+            delta.PageDelta.SQLITE_HEADER +
+            struct.pack('>H', self.PAGE_SIZE)
+        )
+        pages = [
+            bytes([x + 1 if x in changed_pages else x]) * self.PAGE_SIZE
+            for x in range(page_count)
+        ]
+        content = b''.join(pages)
+        return header + content[len(header):]
+
+    def test_round_trip_succeeds(self):
+        source = self._make_sqlite_content(8)
+        target = self._make_sqlite_content(8, changed_pages=[2, 5])
+
+        page_delta = delta.PageDelta().make(source, target)
+
+        assert delta.PageDelta().apply(source, page_delta) == target
+
+    def test_too_long_target_fails(self):
+        source = self._make_sqlite_content(8)
+        target = self._make_sqlite_content(16)
+        page_delta = delta.PageDelta().make(source, target)
+
+        with pytest.raises(delta.InvalidDeltaError) as ex_info:
+            delta.PageDelta().apply(source, page_delta, len(target) - 1)
+        assert 'Delta content is too long' in str(ex_info)
+
+    def test_only_changed_pages_are_stored(self):
+        source = self._make_sqlite_content(8)
+        target = self._make_sqlite_content(8, changed_pages=[2, 5])
+
+        page_delta = delta.PageDelta().make(source, target)
+
+        header_size = struct.calcsize(delta.PageDelta.HEADER_FORMAT)
+        page_record_size = 4 + self.PAGE_SIZE
+        assert len(page_delta) == header_size + 2 * page_record_size
+
+    def test_grown_content_round_trips(self):
+        source = self._make_sqlite_content(4)
+        target = self._make_sqlite_content(6, changed_pages=[1])
+
+        page_delta = delta.PageDelta().make(source, target)
+
+        assert delta.PageDelta().apply(source, page_delta) == target
+
+    def test_shrunk_content_round_trips(self):
+        source = self._make_sqlite_content(6)
+        target = self._make_sqlite_content(4)
+
+        page_delta = delta.PageDelta().make(source, target)
+
+        assert delta.PageDelta().apply(source, page_delta) == target
+
+    def test_non_sqlite_content_round_trips(self):
+        source = b'lorem ipsum' * 1000
+        target = b'lorem ipsum' * 500 + b'dolor sit' * 700
+
+        page_delta = delta.PageDelta().make(source, target)
+
+        assert delta.PageDelta().apply(source, page_delta) == target
+
+    def test_unknown_format_fails(self):
+        with pytest.raises(delta.InvalidDeltaError) as ex_info:
+            delta.PageDelta().apply(b'', b'XXXX' + bytes(12))
+        assert 'Delta has unknown format' in str(ex_info)
+
+    def test_truncated_delta_fails(self):
+        source = self._make_sqlite_content(4)
+        target = self._make_sqlite_content(4, changed_pages=[1])
+        page_delta = delta.PageDelta().make(source, target)
+
+        with pytest.raises(delta.InvalidDeltaError) as ex_info:
+            delta.PageDelta().apply(source, page_delta[:-1])
+        assert 'Delta page is truncated' in str(ex_info)
@@ -0,0 +1,250 @@
+# coding: utf-8
+
+
+import codecs
+import collections
+import json
+import re
+
+
+class InvalidJsonError(RuntimeError):
+    def __init__(self, message):
+        self.message = message
+
+
+JsonEvent = collections.namedtuple('JsonEvent', 'kind, value')
+
+
+class JsonEventReader:
+    UTF8_ENCODING = 'utf-8'
+
+    START_MAP = 'start_map'
+    END_MAP = 'end_map'
+    START_ARRAY = 'start_array'
+    END_ARRAY = 'end_array'
+    KEY = 'key'
+    STRING = 'string'
+    SCALAR = 'scalar'
+
+    MAX_DEPTH = 64
+
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+    STRING_CHARS = re.compile(r'[^"\\\x00-\x1f]+')
+    NUMBER_CHARS = re.compile(r'[-+.0-9eE]*')
+    NUMBER = re.compile(
+        r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?'
+    )
+    LITERALS = collections.OrderedDict([
+        ('true', True), ('false', False), ('null', None)
+    ])
+    ESCAPES = {
+        '"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n',
+        'r': '\r', 't': '\t'
+    }
+    UNICODE_ESCAPE_LENGTH = 6
+    HIGH_SURROGATES = range(0xd800, 0xdc00)
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(self.UTF8_ENCODING)()
+        self._buffer = ''
+        self._position = 0
+        self._is_exhausted = False
+
+    def read(self):
+        # String values are yielded as generators of their parts, so long
+        # strings are never held in full; a part that is not consumed is
+        # skipped before the next event
+        yield from self._read_value(0)
+
+        if self._peek() is not None:
+            raise InvalidJsonError('Extra data after JSON value')
+
+    def _read_value(self, depth):
+        if depth > self.MAX_DEPTH:
+            raise InvalidJsonError('JSON nesting is too deep')
+
+        char = self._peek()
+
+        if char == '{':
+            self._position += 1
+            yield from self._read_map(depth)
+        elif char == '[':
+            self._position += 1
+            yield from self._read_array(depth)
+        elif char == '"':
+            self._position += 1
+            parts = self._read_string_parts()
+            yield JsonEvent(self.STRING, parts)
+            for _ in parts:
+                pass
+        else:
+            yield JsonEvent(self.SCALAR, self._read_scalar())
+
+    def _read_map(self, depth):
+        yield JsonEvent(self.START_MAP, None)
+
+        if self._peek() == '}':
+            self._position += 1
+            yield JsonEvent(self.END_MAP, None)
+            return
+
+        while True:
+            self._expect('"')
+            yield JsonEvent(self.KEY, ''.join(self._read_string_parts()))
+            self._expect(':')
+            yield from self._read_value(depth + 1)
+
+            char = self._next_char()
+            if char == '}':
+                yield JsonEvent(self.END_MAP, None)
+                return
+            if char != ',':
+                raise InvalidJsonError('Map is not properly delimited')
+
+    def _read_array(self, depth):
+        yield JsonEvent(self.START_ARRAY, None)
+
+        if self._peek() == ']':
+            self._position += 1
+            yield JsonEvent(self.END_ARRAY, None)
+            return
+
+        while True:
+            yield from self._read_value(depth + 1)
+
+            char = self._next_char()
+            if char == ']':
+                yield JsonEvent(self.END_ARRAY, None)
+                return
+            if char != ',':
+                raise InvalidJsonError('Array is not properly delimited')
+
+    def _read_string_parts(self):
+        while True:
+            if not self._ensure(1):
+                raise InvalidJsonError('String is not terminated')
+
+            match = self.STRING_CHARS.match(self._buffer, self._position)
+            if match:
+                self._position = match.end()
+                yield match.group()
+                continue
+
+            char = self._buffer[self._position]
+            if char == '"':
+                self._position += 1
+                return
+            if char != '\\':
+                raise InvalidJsonError('String contains control characters')
+
+            yield self._read_escape()
+
+    def _read_escape(self):
+        if not self._ensure(2):
+            raise InvalidJsonError('String is not terminated')
+
+        escape = self._buffer[self._position + 1]
+        if escape in self.ESCAPES:
+            self._position += 2
+            return self.ESCAPES[escape]
+        if escape != 'u':
+            raise InvalidJsonError('String contains invalid escape')
+
+        length = self.UNICODE_ESCAPE_LENGTH
+        if not self._ensure(length):
+            raise InvalidJsonError('String is not terminated')
+
+        # Surrogate pair is decoded as a whole, when the second half
+        # is there
+        text = self._buffer[self._position:self._position + length]
+        if self._get_code_point(text) in self.HIGH_SURROGATES:
+            if self._ensure(2 * length):
+                pair = self._buffer[
+                    self._position:self._position + 2 * length
+                ]
+                if pair[length:length + 2] == '\\u':
+                    text = pair
+
+        self._position += len(text)
+        try:
+            return json.loads('"{0}"'.format(text))
+        except ValueError:
+            raise InvalidJsonError('String contains invalid escape')
+
+    def _get_code_point(self, text):
+        try:
+            return int(text[2:], 16)
+        except ValueError:
+            raise InvalidJsonError('String contains invalid escape')
+
+    def _read_scalar(self):
+        for literal, value in self.LITERALS.items():
+            self._ensure(len(literal))
+            if self._buffer.startswith(literal, self._position):
+                self._position += len(literal)
+                return value
+
+        # Number is complete only once anything else follows it
+        while True:
+            end = self.NUMBER_CHARS.match(self._buffer, self._position).end()
+            if end < len(self._buffer) or not self._fill():
+                break
+
+        match = self.NUMBER.match(self._buffer, self._position, end)
+        if not match or match.end() != end:
+            raise InvalidJsonError('Unexpected JSON value')
+
+        self._position = end
+        return json.loads(match.group())
+
+    def _expect(self, expected_char):
+        if self._next_char() != expected_char:
+            raise InvalidJsonError(
+                'Expected {0!r} is not found'.format(expected_char)
+            )
+
+    def _next_char(self):
+        char = self._peek()
+        if char is not None:
+            self._position += 1
+
+        return char
+
+    def _peek(self):
+        while True:
+            self._position = self.WHITESPACE.match(
+                self._buffer, self._position
+            ).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+
+            if not self._fill():
+                return None
+
+    def _ensure(self, length):
+        while len(self._buffer) - self._position < length:
+            if not self._fill():
+                return False
+
+        return True
+
+    def _fill(self):
+        if self._is_exhausted:
+            return False
+
+        chunk = next(self._chunks, None)
+        try:
+            if chunk is None:
+                self._is_exhausted = True
+                text = self._decoder.decode(b'', final=True)
+            else:
+                text = self._decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise InvalidJsonError('JSON is not valid UTF-8')
+
+        # Consumed text is dropped, so the buffer stays about a chunk long
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+
+        return True
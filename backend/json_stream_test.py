@@ -0,0 +1,74 @@
+# coding: utf-8
+
+
+import json
+
+import pytest
+
+from backend import json_stream
+
+
+class TestJsonEventReader:
+    def _read(self, text, chunk_size=1):
+        binary = text.encode('utf-8')
+        chunks = [
+            binary[x:x + chunk_size] for x in range(0, len(binary), chunk_size)
+        ]
+
+        return [
+            (x.kind, ''.join(x.value) if x.kind == 'string' else x.value)
+            for x in json_stream.JsonEventReader(chunks).read()
+        ]
+
+    def test_map_events_succeed(self):
+        events = self._read('{"a": [1, -2.5e1, true, null], "b": "c"}')
+
+        assert events == [
+            ('start_map', None),
+            ('key', 'a'),
+            ('start_array', None),
+            ('scalar', 1),
+            ('scalar', -25.0),
+            ('scalar', True),
+            ('scalar', None),
+            ('end_array', None),
+            ('key', 'b'),
+            ('string', 'c'),
+            ('end_map', None)
+        ]
+
+    def test_string_escapes_succeed(self):
+        value = 'quote " slash / tab \t unicode é \U0001f68c'
+
+        for text in [json.dumps(value), json.dumps(value, ensure_ascii=False)]:
+            assert self._read(text) == [('string', value)]
+
+    def test_long_string_is_read_in_parts(self):
+        chunks = [b'"', b'a' * 10, b'b' * 10, b'"']
+        event = next(json_stream.JsonEventReader(chunks).read())
+
+        assert list(event.value) == ['a' * 10, 'b' * 10]
+
+    def test_unconsumed_string_is_skipped(self):
+        reader = json_stream.JsonEventReader([b'["abc", 1]'])
+
+        assert [x.kind for x in reader.read()] == [
+            'start_array', 'string', 'scalar', 'end_array'
+        ]
+
+    def test_invalid_json_fails(self):
+        texts = [
+            '', '{', '{"a"}', '{"a": 1,}', '[1 2]', '"abc', '"\\x"', '01',
+            'tru', '-', '{"a": 1} 2', '"\x01"'
+        ]
+
+        for text in texts:
+            with pytest.raises(json_stream.InvalidJsonError):
+                self._read(text)
+
+    def test_deep_nesting_fails(self):
+        text = '[' * (json_stream.JsonEventReader.MAX_DEPTH + 2)
+
+        with pytest.raises(json_stream.InvalidJsonError) as ex_info:
+            self._read(text, chunk_size=1024)
+        assert 'JSON nesting is too deep' in str(ex_info)
@@ -0,0 +1,107 @@
+# coding: utf-8
+
+
+import logging
+import select
+import threading
+import time
+
+import sqlalchemy as sa
+from sqlalchemy import pool
+
+from backend import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseChangeChannel:
+    NAME = 'bustime_database_changes'
+    SEPARATOR = ','
+    POSTGRESQL_DIALECT = 'postgresql'
+
+    def is_supported(self, bind):
+        return bind.dialect.name == self.POSTGRESQL_DIALECT
+
+    def notify(self, session, schema_versions):
+        if not self.is_supported(session.get_bind()):
+            return
+
+        # Notifications are delivered on commit and never for a rolled
+        # back transaction
+        session.execute(sa.select([
+            sa.func.pg_notify(self.NAME, self.format(schema_versions))
+        ]))
+
+    def format(self, schema_versions):
+        return self.SEPARATOR.join(str(x) for x in sorted(schema_versions))
+
+    def parse(self, payload):
+        return [int(x) for x in payload.split(self.SEPARATOR) if x]
+
+
+class DatabaseChangeListener:
+    SELECT_TIMEOUT = 30
+    RECONNECT_INTERVAL = 5
+
+    def __init__(self, on_change, on_reset):
+        self._on_change = on_change
+        self._on_reset = on_reset
+        self._channel = DatabaseChangeChannel()
+        self._is_listening = False
+
+    @classmethod
+    def is_supported(cls):
+        engine = sa.create_engine(
+            config.Config.get().db_url, poolclass=pool.NullPool
+        )
+        return DatabaseChangeChannel().is_supported(engine)
+
+    @property
+    def is_listening(self):
+        return self._is_listening
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Database change listener failed')
+            finally:
+                # Changes may be missed from the moment the connection
+                # drops, later failed retries have nothing new to reset
+                if self._is_listening:
+                    self._is_listening = False
+                    self._on_reset()
+
+            time.sleep(self.RECONNECT_INTERVAL)
+
+    def _listen(self):
+        # Listening connection is held for good, so it is not taken
+        # from the pool used by requests
+        engine = sa.create_engine(
+            config.Config.get().db_url, poolclass=pool.NullPool
+        )
+        connection = engine.raw_connection().connection
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute('LISTEN {0}'.format(self._channel.NAME))
+
+            self._on_reset()
+            self._is_listening = True
+
+            while True:
+                select.select([connection], [], [], self.SELECT_TIMEOUT)
+                connection.poll()
+
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self._on_change(self._channel.parse(notify.payload))
+        finally:
+            connection.close()
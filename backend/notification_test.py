@@ -0,0 +1,67 @@
+# coding: utf-8
+
+
+import sqlalchemy as sa
+
+from backend import notification
+
+
+class TestDatabaseChangeChannel:
+    def test_format_succeeds(self):
+        payload = notification.DatabaseChangeChannel().format([3, 1, 2])
+
+        assert payload == '1,2,3'
+
+    def test_parse_succeeds(self):
+        schema_versions = notification.DatabaseChangeChannel().parse('1,2,3')
+
+        assert schema_versions == [1, 2, 3]
+
+    def test_empty_payload_yields_nothing(self):
+        assert notification.DatabaseChangeChannel().parse('') == []
+
+    def test_sqlite_is_not_supported(self):
+        engine = sa.create_engine('sqlite://')
+
+        assert not notification.DatabaseChangeChannel().is_supported(engine)
+
+
+class TestDatabaseChangeListener:
+    class Stopped(Exception):
+        pass
+
+    def run(self, monkeypatch, outcomes):
+        resets = []
+        listener = notification.DatabaseChangeListener(
+            lambda schema_versions: None, lambda: resets.append(None)
+        )
+        sleeps = iter(range(len(outcomes) - 1))
+
+        def listen():
+            if outcomes.pop(0):
+                listener._on_reset()
+                listener._is_listening = True
+
+            raise ConnectionError()
+
+        def sleep(seconds):
+            if next(sleeps, None) is None:
+                raise self.Stopped()
+
+        monkeypatch.setattr(listener, '_listen', listen)
+        monkeypatch.setattr(notification.time, 'sleep', sleep)
+        try:
+            listener._run()
+        except self.Stopped:
+            pass
+
+        return len(resets)
+
+    def test_failed_retries_do_not_reset(self, monkeypatch):
+        assert self.run(monkeypatch, [False, False, False]) == 0
+
+    def test_dropped_connection_resets_once(self, monkeypatch):
+        assert self.run(monkeypatch, [True, False, False]) == 2
+
+    def test_reestablished_connection_resets(self, monkeypatch):
+        assert self.run(monkeypatch, [True, False, True, False]) == 4
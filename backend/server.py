@@ -4,21 +4,38 @@
 import flask
 import flask_compress as compress
 
-from backend import config, web_util
+from backend import config, db, web_util
+
+
+# Set by servers which ask for connections to be released between reads
+# of streamed bodies
+ENVIRON_RELEASE_CONNECTIONS = 'backend.release_connections'
 
 
 def create_flask_app():
     flask_app = flask.Flask(__name__)
 
-    flask_app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
-    flask_app.config['COMPRESS_MIMETYPES'] = ['application/json',
-                                              'application/octet-stream']
+    # Largest body of any route, a binary database update; routes apply
+    # their own lower limits
+    flask_app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    # Database content is served from variants compressed at publish time
+    flask_app.config['COMPRESS_MIMETYPES'] = ['application/json']
 
     web_util.JsonHttpExceptionHandler().init(flask_app)
 
+    # Database queries of a request share a single pooled connection
+    flask_app.before_request(begin_db_scope)
+    flask_app.teardown_request(db.Scope.end)
+
     return flask_app
 
 
+def begin_db_scope():
+    db.Scope.begin(
+        flask.request.environ.get(ENVIRON_RELEASE_CONNECTIONS, False)
+    )
+
+
 app = create_flask_app()
 compressor = compress.Compress(app)
 
@@ -3,47 +3,868 @@
 
 import abc
 import base64
+import binascii
 import codecs
 import collections
+import datetime
 import json
-
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+import sqlalchemy as sa
 from cryptography import exceptions as crypto_exceptions
 from cryptography.hazmat.backends import default_backend as crypto_backend
 from cryptography.hazmat.primitives import hashes as crypto_hashes
 from cryptography.hazmat.primitives import serialization as crypto_serial
 from cryptography.hazmat.primitives.asymmetric import padding as crypto_padding
+from cryptography.hazmat.primitives.asymmetric import utils as crypto_utils
+
+from backend import db, config, delta, json_stream, notification, storage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-from backend import db, config
+try:
+    import gevent
+    import gevent.monkey
+except ImportError:
+    gevent = None
+
+
+logger = logging.getLogger(__name__)
 
 
 class DatabaseQuery:
+    # Reads skip the ORM, statements take their values as bound
+    # parameters so that they are compiled only once
+    STATE_STATEMENT = (
+        sa.select([
+            db.Database.schema_version,
+            db.Database.version,
+            db.Database.digest,
+            db.Database.size,
+            db.Database.published_at,
+            db.DatabaseVariant.encoding.label('variant_encoding'),
+            db.DatabaseVariant.digest.label('variant_digest'),
+            db.DatabaseVariant.size.label('variant_size')
+        ])
+        .select_from(sa.outerjoin(
+            db.Database.__table__, db.DatabaseVariant.__table__
+        ))
+        .where(db.Database.schema_version == sa.bindparam('schema_version'))
+        .order_by(db.DatabaseVariant.id)
+    )
+    REVISION_STATEMENT = (
+        sa.select([
+            db.DatabaseRevision.digest,
+            db.DatabaseRevision.published_at,
+            sa.func.length(db.Blob.content).label('size')
+        ])
+        .select_from(sa.join(
+            db.DatabaseRevision.__table__, db.Blob.__table__,
+            db.Blob.digest == db.DatabaseRevision.digest
+        ))
+        .where(db.DatabaseRevision.schema_version ==
+               sa.bindparam('schema_version'))
+        .where(db.DatabaseRevision.version == sa.bindparam('version'))
+        .limit(1)
+    )
+    MANIFEST_STATEMENT = (
+        sa.select([
+            db.Database.schema_version,
+            db.Database.version,
+            db.Database.digest,
+            db.Database.size
+        ])
+        .where(db.Database.schema_version.in_(
+            sa.bindparam('schema_versions', expanding=True)
+        ))
+    )
+    DELTA_STATEMENT = (
+        sa.select([db.DatabaseDelta.content])
+        .where(db.DatabaseDelta.schema_version ==
+               sa.bindparam('schema_version'))
+        .where(db.DatabaseDelta.from_version == sa.bindparam('from_version'))
+        .where(db.DatabaseDelta.to_digest == sa.bindparam('to_digest'))
+        .limit(1)
+    )
+    BLOB_CONTENT_STATEMENT = (
+        sa.select([db.Blob.content])
+        .where(db.Blob.digest == sa.bindparam('digest'))
+    )
+    # Accepted encodings are bound in order of preference, unused
+    # parameters are bound to NULL which never matches
+    ENCODING_PARAMS = ['encoding_0', 'encoding_1', 'encoding_2']
+    RANKED_VARIANTS = db.DatabaseVariant.__table__.alias('ranked_variants')
+    VARIANT_RANK = sa.case([
+        (RANKED_VARIANTS.c.encoding == sa.bindparam('encoding_0'), 0),
+        (RANKED_VARIANTS.c.encoding == sa.bindparam('encoding_1'), 1),
+        (RANKED_VARIANTS.c.encoding == sa.bindparam('encoding_2'), 2)
+    ])
+    # Expanding parameters can't be bound to an empty list, a digest
+    # that never matches stands in while nothing is cached
+    NO_DIGEST = ''
+    # State and the first window of the preferred variant are read in
+    # a single round trip, content already cached is not transferred
+    CONTENT_STATEMENT = (
+        sa.select([
+            db.Database.version,
+            db.Database.digest,
+            db.Database.size,
+            db.Database.published_at,
+            db.DatabaseVariant.encoding.label('variant_encoding'),
+            db.DatabaseVariant.digest.label('variant_digest'),
+            db.DatabaseVariant.size.label('variant_size'),
+            sa.type_coerce(
+                sa.case(
+                    [(db.Blob.digest.in_(
+                        sa.bindparam('cached_digests', expanding=True)
+                    ), sa.null())],
+                    else_=sa.func.substr(
+                        db.Blob.content, 1,
+                        sa.bindparam('length', type_=sa.Integer)
+                    )
+                ),
+                sa.Binary
+            ).label('first_chunk')
+        ])
+        .select_from(
+            sa.outerjoin(
+                db.Database.__table__, db.DatabaseVariant.__table__,
+                db.DatabaseVariant.id == (
+                    sa.select([RANKED_VARIANTS.c.id])
+                    .where(RANKED_VARIANTS.c.database_id == db.Database.id)
+                    .where(VARIANT_RANK.isnot(None))
+                    .order_by(VARIANT_RANK)
+                    .limit(1)
+                    .as_scalar()
+                )
+            )
+            .join(
+                db.Blob.__table__,
+                db.Blob.digest == sa.func.coalesce(
+                    db.DatabaseVariant.digest, db.Database.digest
+                )
+            )
+        )
+        .where(db.Database.schema_version == sa.bindparam('schema_version'))
+    )
+    CHUNK_STATEMENT = (
+        sa.select([
+            sa.func.substr(
+                db.Blob.content,
+                sa.bindparam('position', type_=sa.Integer),
+                sa.bindparam('length', type_=sa.Integer),
+                type_=sa.Binary
+            )
+        ])
+        .where(db.Blob.digest == sa.bindparam('digest'))
+    )
+
     def get_version(self, schema_version):
-        with db.Session() as session:
-            database = self._find_database(session, schema_version)
-            if not database:
-                raise NoDatabaseFound()
-            return database.version
-
-    def _find_database(self, session, schema_version):
-        return (session.query(db.Database)
-                .filter(db.Database.schema_version == schema_version)
-                .first())
+        return self._get_state(schema_version).version
 
-    def get_content(self, schema_version):
-        with db.Session() as session:
-            database = self._find_database(session, schema_version)
-            if not database:
-                raise NoDatabaseFound()
+    def get_info(self, schema_version, accepted_encodings=(), version=None):
+        state = self._get_state(schema_version)
+
+        if version is not None and version != state.version:
+            with db.Connection() as connection:
+                return self._get_revision_info(
+                    connection, schema_version, version
+                )
+
+        return self._make_info(
+            state, self._find_variant(state, accepted_encodings)
+        )
+
+    def _make_info(self, state, variant):
+        return DatabaseInfo(
+            schema_version=state.schema_version,
+            version=state.version,
+            digest=state.digest,
+            size=state.size,
+            published_at=state.published_at,
+            encoding=self._get_encoding(variant),
+            encoded_size=(variant or state).size,
+            encoded_digest=(variant or state).digest
+        )
+
+    def _get_state(self, schema_version):
+        cache = DatabaseStateCache.get()
+        generation = cache.generation
+
+        state = cache.find(schema_version)
+        if state is None:
+            state = self._load_state(schema_version)
+            cache.put(state, generation)
+
+        return state
+
+    def _load_state(self, schema_version):
+        with db.Connection() as connection:
+            rows = connection.execute(
+                self.STATE_STATEMENT, schema_version=schema_version
+            ).fetchall()
+
+        if not rows:
+            raise NoDatabaseFound()
+
+        # Database columns are repeated in a row of every variant
+        row = rows[0]
+
+        return DatabaseState(
+            schema_version=row.schema_version,
+            version=row.version,
+            digest=row.digest,
+            size=row.size,
+            published_at=row.published_at,
+            variants=tuple(
+                VariantState(
+                    encoding=x.variant_encoding,
+                    digest=x.variant_digest,
+                    size=x.variant_size
+                )
+                for x in rows
+                if x.variant_encoding is not None
+            )
+        )
+
+    def _get_revision_info(self, connection, schema_version, version):
+        # Replaced versions are only kept as is, without variants
+        row = connection.execute(
+            self.REVISION_STATEMENT,
+            schema_version=schema_version,
+            version=version
+        ).first()
+
+        if not row:
+            raise NoDatabaseFound()
+
+        size = row.size
+        if size is None:
+            size = storage.BlobStore.get().get_size(row.digest)
+
+        return DatabaseInfo(
+            schema_version=schema_version,
+            version=version,
+            digest=row.digest,
+            size=size,
+            published_at=row.published_at,
+            encoding=ContentEncoder.IDENTITY_ENCODING,
+            encoded_size=size,
+            encoded_digest=row.digest
+        )
+
+    def get_manifest(self, manifest_request):
+        schema_versions = [
+            x.schema_version for x in manifest_request.schema_versions
+        ]
+        if not schema_versions:
+            return []
+
+        # All requested schema versions are looked up in a single query
+        with db.Connection() as connection:
+            rows = connection.execute(
+                self.MANIFEST_STATEMENT, schema_versions=schema_versions
+            ).fetchall()
+
+        rows_by_schema_version = {x.schema_version: x for x in rows}
+
+        return [
+            self._make_manifest_entry(rows_by_schema_version[x.schema_version],
+                                      x.version)
+            for x in manifest_request.schema_versions
+            if x.schema_version in rows_by_schema_version
+        ]
+
+    def _make_manifest_entry(self, row, client_version):
+        return DatabaseManifestEntry(
+            schema_version=row.schema_version,
+            version=row.version,
+            digest=row.digest,
+            size=row.size,
+            is_update_needed=row.version != client_version
+        )
+
+    def get_content(self, schema_version, accepted_encodings=()):
+        state = DatabaseStateCache.get().find(schema_version)
+        if state is None:
+            return self._load_database_content(
+                schema_version, accepted_encodings
+            )
+
+        info = self._make_info(
+            state, self._find_variant(state, accepted_encodings)
+        )
+
+        return DatabaseContent(info=info, chunks=self.iterate_content(info))
+
+    def _load_database_content(self, schema_version, accepted_encodings):
+        encodings = list(accepted_encodings)[:len(self.ENCODING_PARAMS)]
+        encoding_params = {
+            x: encodings[i] if i < len(encodings) else None
+            for i, x in enumerate(self.ENCODING_PARAMS)
+        }
+
+        with db.Connection() as connection:
+            row = connection.execute(
+                self.CONTENT_STATEMENT,
+                schema_version=schema_version,
+                cached_digests=ContentCache.get().digests or [self.NO_DIGEST],
+                length=ContentChunks.CHUNK_SIZE,
+                **encoding_params
+            ).first()
+
+        if not row:
+            raise NoDatabaseFound()
+
+        variant = None
+        if row.variant_encoding is not None:
+            variant = VariantState(
+                encoding=row.variant_encoding,
+                digest=row.variant_digest,
+                size=row.variant_size
+            )
+
+        info = DatabaseInfo(
+            schema_version=schema_version,
+            version=row.version,
+            digest=row.digest,
+            size=row.size,
+            published_at=row.published_at,
+            encoding=self._get_encoding(variant),
+            encoded_size=(variant or row).size,
+            encoded_digest=(variant or row).digest
+        )
+
+        # Content that fits a single window is read whole right away
+        return DatabaseContent(
+            info=info, chunks=self.iterate_content(info, row.first_chunk)
+        )
+
+    def open_content_slices(self, info):
+        # Slices are read window by window as they are sent, so memory use
+        # does not depend on their size
+        content = ContentCache.get().find(info.digest)
+        if content is not None:
+            return ContentSlices(lambda start, stop: content[start:stop])
+
+        # Stored content never changes under its digest
+        f = self._open_blob(info.digest)
+        if f:
+            return ContentSlices(
+                lambda start, stop: self._read_file_slice(f, start, stop),
+                f.close
+            )
+
+        # Windows are cut by the digest from the same content as info
+        # describes, all with the same compiled statement
+        return ContentStream(info, self._read_slice)
+
+    def find_delta(self, info, from_version):
+        with db.Connection() as connection:
+            return connection.execute(
+                self.DELTA_STATEMENT,
+                schema_version=info.schema_version,
+                from_version=from_version,
+                to_digest=info.digest
+            ).scalar()
+
+    def iterate_content(self, info, first_chunk=None):
+        content = ContentCache.get().find(info.encoded_digest)
+        if content is not None:
+            return ContentChunks().split(content)
+
+        store = self._find_blob_store(info.encoded_digest)
+        if store:
+            return store.iterate(
+                info.encoded_digest, ContentChunks.CHUNK_SIZE
+            )
+
+        return ContentStream(info, self._read_slice, first_chunk)
+
+    def find_content_blob(self, info):
+        f = self._open_blob(info.encoded_digest)
+        if not f:
+            return None
+
+        store = storage.BlobStore.get()
+        return ContentBlob(
+            path=store.get_path(info.encoded_digest),
+            relative_path=store.get_relative_path(info.encoded_digest),
+            file=f
+        )
+
+    def _open_blob(self, digest):
+        store = self._find_blob_store(digest)
+        if not store:
+            return None
+
+        # Files are collected by other processes as well, so a file found
+        # may be gone already; once open it is readable to the end
+        try:
+            return store.open(digest)
+        except FileNotFoundError:
+            return None
+
+    def _find_blob_store(self, digest):
+        # Content published before the store was configured stays in
+        # the database and is still served from there
+        store = storage.BlobStore.get()
+        if store and store.exists(digest):
+            return store
+
+        return None
+
+    def _load_content(self, connection, digest):
+        store = self._find_blob_store(digest)
+        if store:
+            return store.read(digest)
+
+        return connection.execute(
+            self.BLOB_CONTENT_STATEMENT, digest=digest
+        ).scalar()
+
+    def _read_file_slice(self, f, start, stop):
+        f.seek(start)
+        return f.read(stop - start)
+
+    def _read_slice(self, connection, digest, start, stop):
+        # SQL substring positions are 1-based
+        return connection.execute(
+            self.CHUNK_STATEMENT,
+            digest=digest,
+            position=start + 1,
+            length=stop - start
+        ).scalar()
+
+    def _find_variant(self, state, accepted_encodings):
+        for encoding in accepted_encodings:
+            variant = next(
+                (x for x in state.variants if x.encoding == encoding), None
+            )
+            if variant:
+                return variant
+
+        return None
+
+    def _get_encoding(self, variant):
+        if variant:
+            return variant.encoding
+
+        return ContentEncoder.IDENTITY_ENCODING
+
+
+DatabaseInfo = collections.namedtuple(
+    'DatabaseInfo',
+    'schema_version, version, digest, size, published_at, encoding, '
+    'encoded_size, encoded_digest'
+)
+
+
+ContentBlob = collections.namedtuple(
+    'ContentBlob', 'path, relative_path, file'
+)
+
+
+DatabaseManifestEntry = collections.namedtuple(
+    'DatabaseManifestEntry',
+    'schema_version, version, digest, size, is_update_needed'
+)
+
+
+DatabaseContent = collections.namedtuple('DatabaseContent', 'info, chunks')
+
+
+DatabaseState = collections.namedtuple(
+    'DatabaseState',
+    'schema_version, version, digest, size, published_at, variants'
+)
+
+
+VariantState = collections.namedtuple('VariantState', 'encoding, digest, size')
+
+
+class DatabaseStateCache:
+    # States are only cached while changes made by other processes are
+    # listened to, otherwise they would never be refreshed
+    _cache = None
+    _cache_lock = threading.Lock()
+
+    def __init__(self):
+        self._states = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._pid = os.getpid()
+
+    @classmethod
+    def get(cls):
+        # Listener thread does not survive fork, so every worker process
+        # gets a cache and a listener of its own
+        if not cls._cache or cls._cache._pid != os.getpid():
+            with cls._cache_lock:
+                if not cls._cache or cls._cache._pid != os.getpid():
+                    cls._cache = DatabaseStateCache()
+                    cls._cache._start_listener()
+
+        return cls._cache
+
+    def _start_listener(self):
+        if not notification.DatabaseChangeListener.is_supported():
+            return
+
+        self._listener = notification.DatabaseChangeListener(
+            self._on_change, self._on_reset
+        )
+        self._listener.start()
+
+    def _on_change(self, schema_versions):
+        db.ReplicaSet.get().pin_primary()
+        self.invalidate(schema_versions)
+        DatabaseVersionWatcher.get().notify()
+
+    def _on_reset(self):
+        db.ReplicaSet.get().pin_primary()
+        self.clear()
+        DatabaseVersionWatcher.get().notify()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def find(self, schema_version):
+        if not self._is_enabled():
+            return None
+
+        with self._lock:
+            return self._states.get(schema_version)
+
+    def put(self, state, generation):
+        if not self._is_enabled():
+            return
+
+        with self._lock:
+            # State read before an invalidation may be stale already
+            if generation == self._generation:
+                self._states[state.schema_version] = state
+
+    def invalidate(self, schema_versions):
+        with self._lock:
+            self._generation += 1
+            for schema_version in schema_versions:
+                self._states.pop(schema_version, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._states.clear()
+
+    def _is_enabled(self):
+        return self._listener is not None and self._listener.is_listening
+
+
+class DatabaseVersionWatcher:
+    # Publications handled by other processes are only notified about
+    # when the database supports it, waiters check it that often anyway
+    POLL_INTERVAL = 15
+
+    _watcher = None
+    _watcher_lock = threading.Lock()
+
+    def __init__(self):
+        self._generation = 0
+        self._condition = threading.Condition()
+        self._callbacks = set()
 
-            return database.content
+    @classmethod
+    def get(cls):
+        if not cls._watcher:
+            with cls._watcher_lock:
+                if not cls._watcher:
+                    cls._watcher = DatabaseVersionWatcher()
+
+        return cls._watcher
+
+    def subscribe(self, callback):
+        # Callbacks are called on every change, e.g. to wake up waiters
+        # of an event loop, which do not wait on the condition
+        with self._condition:
+            self._callbacks.add(callback)
+
+    def unsubscribe(self, callback):
+        with self._condition:
+            self._callbacks.discard(callback)
+
+    def notify(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            callback()
+
+    def wait_for_change(self, schema_version, known_version, timeout):
+        deadline = time.monotonic() + timeout
+
+        while True:
+            # Generation is taken before the check so that a publication
+            # made right after it still wakes the waiter up
+            generation = self._generation
+            version = self.find_version(schema_version)
+
+            remaining = deadline - time.monotonic()
+            if version != known_version or remaining <= 0:
+                return version
+
+            # Pooled connection is not held while waiting
+            db.Scope.release()
+
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._generation != generation,
+                    min(remaining, self.POLL_INTERVAL)
+                )
+
+    def find_version(self, schema_version):
+        try:
+            return DatabaseQuery().get_version(schema_version)
+        except NoDatabaseFound:
+            return None
 
 
 class NoDatabaseFound(RuntimeError):
     pass
 
 
+class ContentChangedError(RuntimeError):
+    pass
+
+
+ContentCacheStats = collections.namedtuple(
+    'ContentCacheStats', 'hits, misses, evictions, size, count'
+)
+
+
+class ContentCache:
+    # Content is cached by its digest, it never changes under a digest and
+    # identical content of several schema versions is only kept once
+    _cache = None
+    _cache_lock = threading.Lock()
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._claimed_digests = set()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        if not cls._cache:
+            with cls._cache_lock:
+                if not cls._cache:
+                    cls._cache = ContentCache(
+                        config.Config.get().content_cache_size
+                    )
+
+        return cls._cache
+
+    def find(self, digest):
+        with self._lock:
+            content = self._entries.get(digest)
+            if content is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(digest)
+            self._hits += 1
+            return content
+
+    def accepts(self, size):
+        # Content bigger than the whole budget would only flush the cache
+        return size <= self._max_size
+
+    def claim(self, digest, size):
+        # Missing content is collected by a single reader at a time, other
+        # readers send it on without keeping a copy
+        if not self.accepts(size):
+            return False
+
+        with self._lock:
+            if digest in self._claimed_digests:
+                return False
+
+            self._claimed_digests.add(digest)
+            return True
+
+    def release(self, digest, content=None):
+        if content is not None:
+            self.put(digest, content)
+
+        with self._lock:
+            self._claimed_digests.discard(digest)
+
+    def put(self, digest, content):
+        if not self.accepts(len(content)):
+            return
+
+        with self._lock:
+            self._remove(digest)
+
+            self._entries[digest] = content
+            self._size += len(content)
+
+            while self._size > self._max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self._evictions += 1
+
+    @property
+    def digests(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, digest):
+        content = self._entries.pop(digest, None)
+        if content is not None:
+            self._size -= len(content)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return ContentCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                size=self._size,
+                count=len(self._entries)
+            )
+
+
+class ContentStream:
+    # Content is read window by window on a single connection, taken over
+    # from the request scope since the body is sent after the scope ends;
+    # it is only given back to the pool between windows once the client
+    # turns out to be slow or the scope asks for it, so a request checks
+    # out at most one otherwise
+    SLOW_CHUNK_INTERVAL = 0.5
+
+    def __init__(self, info, read_slice, first_chunk=None):
+        self._info = info
+        self._read_slice = read_slice
+        self._first_chunk = first_chunk
+        scope = db.Scope.find()
+        self._is_releasing = scope is not None and scope.is_releasing
+        self._connection = db.Scope.detach()
+
+    def __iter__(self):
+        cache = ContentCache.get()
+        digest = self._info.encoded_digest
+        # Chunks are only collected when the whole content is going to be
+        # cached and no other stream collects it already, otherwise memory
+        # use does not depend on content size or concurrent downloads
+        is_collecting = cache.claim(digest, self._info.encoded_size)
+        collected_chunks = []
+        content = None
+
+        try:
+            for chunk in self.iterate_range(0, self._info.encoded_size):
+                if is_collecting:
+                    collected_chunks.append(chunk)
+                yield chunk
+
+            if is_collecting:
+                content = b''.join(collected_chunks)
+        finally:
+            self.close()
+            if is_collecting:
+                cache.release(digest, content)
+
+    def iterate_range(self, start, stop):
+        for window_start, window_stop in ContentChunks().get_windows(
+            stop, start
+        ):
+            if window_start == 0 and self._first_chunk is not None:
+                chunk = self._first_chunk
+            else:
+                chunk = self._read_window(window_start, window_stop)
+
+            # Content is only gone long after a newer publication
+            # released it
+            if chunk is None:
+                raise ContentChangedError()
+
+            if self._is_releasing:
+                self._release()
+
+            sent_at = time.monotonic()
+            yield chunk
+            self._is_releasing = (
+                self._is_releasing or
+                time.monotonic() - sent_at > self.SLOW_CHUNK_INTERVAL
+            )
+
+    def _read_window(self, start, stop):
+        if self._connection is None:
+            self._connection = db.Connection.connect()
+
+        return self._read_slice(
+            self._connection, self._info.encoded_digest, start, stop
+        )
+
+    def close(self):
+        # Stream that is never iterated still holds the connection
+        self._release()
+
+    def _release(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class ContentSlices:
+    # Same as a content stream, for content already at hand or an open file
+    def __init__(self, read_slice, close=None):
+        self._read_slice = read_slice
+        self._close = close
+
+    def iterate_range(self, start, stop):
+        for window_start, window_stop in ContentChunks().get_windows(
+            stop, start
+        ):
+            yield self._read_slice(window_start, window_stop)
+
+    def close(self):
+        if self._close:
+            self._close()
+
+
 class Base64:
     ASCII_ENCODING = 'ascii'
+    GROUP_LENGTH = 4
+    NON_ALPHABET_CHARS = re.compile(r'[^A-Za-z0-9+/=]')
 
     @classmethod
     def binary_to_base64_str(cls, binary):
@@ -59,54 +880,251 @@ class Base64:
 
         return base64.b64decode(base64_str.encode(cls.ASCII_ENCODING))
 
+    @classmethod
+    def base64_chunks_to_binary_chunks(cls, base64_chunks):
+        # Chunks are decoded in whole groups of four characters, the rest
+        # is carried over to the next chunk
+        remainder = ''
+
+        for base64_chunk in base64_chunks:
+            base64_str = remainder + cls.NON_ALPHABET_CHARS.sub(
+                '', base64_chunk
+            )
+            length = len(base64_str) - len(base64_str) % cls.GROUP_LENGTH
+            remainder = base64_str[length:]
+
+            if length:
+                yield base64.b64decode(
+                    base64_str[:length].encode(cls.ASCII_ENCODING),
+                    validate=True
+                )
+
+        if remainder:
+            raise binascii.Error('Incorrect padding')
+
 
 class SignatureVerifier:
     UTF8_ENCODING = 'utf-8'
 
     def verify(self, public_key_binaries, text_to_verify, signature):
-        if not signature:
-            return False
+        public_keys = [
+            PublicKeyLoader().load(x) for x in public_key_binaries
+        ]
+
+        return self.find_signing_key(
+            public_keys, text_to_verify, signature
+        ) is not None
+
+    def find_signing_key(self, public_keys, text_to_verify, signature):
+        digest = SignatureDigest()
+        digest.update(text_to_verify.encode(self.UTF8_ENCODING))
 
-        binary_to_verify = text_to_verify.encode(self.UTF8_ENCODING)
+        return self.find_digest_signing_key(
+            public_keys, digest.finalize(), signature
+        )
 
-        for public_key_binary in public_key_binaries:
-            if self._verify_single(
-                public_key_binary, binary_to_verify, signature
-            ):
-                return True
+    def find_digest_signing_key(self, public_keys, digest, signature):
+        if not signature:
+            return None
 
-        return False
+        # Signed content is hashed once however many keys are tried
+        for public_key in public_keys:
+            if self._verify_single(public_key.key, digest, signature):
+                return public_key
 
-    def _verify_single(self, public_key_binary, binary_to_verify, signature):
-        verifier = self._build_verifier(public_key_binary, signature)
-        verifier.update(binary_to_verify)
+        return None
 
+    def _verify_single(self, public_key, digest, signature):
         try:
-            verifier.verify()
+            public_key.verify(
+                signature,
+                digest,
+                # Stay with PKCS1 v1.5 padding since PSS is not as widely
+                # spread and is not implemented in many libraries
+                crypto_padding.PKCS1v15(),
+                crypto_utils.Prehashed(SignatureDigest.HASH_ALGORITHM)
+            )
             return True
         except crypto_exceptions.InvalidSignature:
             return False
 
-    def _build_verifier(self, public_key_binary, signature):
-        return self._load_public_key(public_key_binary).verifier(
-            signature,
-            # Stay with PKCS1 v1.5 padding since PSS is not as widely spread
-            # and is not implemented in many libraries
-            crypto_padding.PKCS1v15(),
-            crypto_hashes.SHA512()
+
+class SignatureDigest:
+    HASH_ALGORITHM = crypto_hashes.SHA512()
+
+    def __init__(self):
+        self._hash = crypto_hashes.Hash(
+            self.HASH_ALGORITHM, backend=crypto_backend()
         )
 
-    def _load_public_key(self, public_key_binary):
-        return crypto_serial.load_ssh_public_key(
+    def update(self, binary):
+        self._hash.update(binary)
+
+    def update_chunks(self, chunks):
+        for chunk in chunks:
+            self._hash.update(chunk)
+            yield chunk
+
+    def finalize(self):
+        return self._hash.finalize()
+
+
+PublicKey = collections.namedtuple('PublicKey', 'fingerprint, key')
+
+
+class PublicKeyLoader:
+    ASCII_ENCODING = 'ascii'
+    FINGERPRINT_PREFIX = 'SHA256:'
+
+    def load(self, public_key_binary):
+        key = crypto_serial.load_ssh_public_key(
             public_key_binary, crypto_backend()
         )
 
+        return PublicKey(fingerprint=self.make_fingerprint(key), key=key)
+
+    def make_fingerprint(self, key):
+        # Same as the one shown by ssh-keygen -l
+        ssh_binary = key.public_bytes(
+            crypto_serial.Encoding.OpenSSH, crypto_serial.PublicFormat.OpenSSH
+        )
+        digest = crypto_hashes.Hash(
+            crypto_hashes.SHA256(), backend=crypto_backend()
+        )
+        digest.update(base64.b64decode(ssh_binary.split()[1]))
+
+        return self.FINGERPRINT_PREFIX + base64.b64encode(
+            digest.finalize()
+        ).decode(self.ASCII_ENCODING).rstrip('=')
+
+
+class KeyRing:
+    # Keys are parsed once and loaded again only when their source changes
+    _key_ring = None
+    _key_ring_lock = threading.Lock()
+
+    def __init__(self, source_version, public_keys):
+        self.source_version = source_version
+        self.public_keys = public_keys
+        self._public_keys_by_fingerprint = {
+            x.fingerprint: x for x in public_keys
+        }
+
+    @classmethod
+    def get(cls):
+        key_source = config.Config.get().key_source
+        source_version = key_source.get_version()
+
+        if not cls._is_actual(cls._key_ring, source_version):
+            with cls._key_ring_lock:
+                if not cls._is_actual(cls._key_ring, source_version):
+                    cls._key_ring = cls._load(key_source, source_version)
+
+        return cls._key_ring
+
+    @classmethod
+    def _is_actual(cls, key_ring, source_version):
+        return (key_ring is not None and
+                key_ring.source_version == source_version)
+
+    @classmethod
+    def _load(cls, key_source, source_version):
+        public_keys = []
+
+        for public_key_binary in key_source.get_key_binaries():
+            try:
+                public_keys.append(PublicKeyLoader().load(public_key_binary))
+            except (ValueError, crypto_exceptions.UnsupportedAlgorithm):
+                logger.exception('Publication key is not loaded')
+
+        logger.info(
+            'Publication keys loaded: %s',
+            ', '.join(x.fingerprint for x in public_keys)
+        )
+
+        return KeyRing(source_version, public_keys)
+
+    def find(self, fingerprint):
+        return self._public_keys_by_fingerprint.get(fingerprint)
+
 
 SchemaVersionContent = collections.namedtuple(
     'SchemaVersionContent', 'schema_version, content'
 )
 
 
+SchemaVersionDelta = collections.namedtuple(
+    'SchemaVersionDelta', 'schema_version, base_version, digest, delta'
+)
+
+
+class StoredContent:
+    # Content is written straight into the blob store as it is decoded
+    # and hashed on the way, it only appears under its digest when saved
+    def __init__(self, writer, digest):
+        self._writer = writer
+        self.digest = digest
+
+    @classmethod
+    def write(cls, store, chunks):
+        writer = store.create_writer()
+        try:
+            digest = Sha256().make_chunks_hash(
+                cls._write_chunks(writer, chunks)
+            )
+        except:
+            writer.abort()
+            raise
+
+        return cls(writer, digest)
+
+    @classmethod
+    def _write_chunks(cls, writer, chunks):
+        for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+
+    @property
+    def size(self):
+        return self._writer.size
+
+    def iterate(self):
+        with self._writer.open() as f:
+            for chunk in iter(lambda: f.read(ContentChunks.CHUNK_SIZE), b''):
+                yield chunk
+
+    def read(self):
+        with self._writer.open() as f:
+            return f.read()
+
+    def save(self, store):
+        self._writer.commit(self.digest)
+
+    def discard(self):
+        # Content which is saved already stays in the store
+        self._writer.abort()
+
+
+class BufferedContent:
+    # Same as stored content, for content which is at hand in full
+    def __init__(self, binary):
+        self._binary = binary
+        self.digest = Sha256().make_chunks_hash(self.iterate())
+        self.size = len(binary)
+
+    def iterate(self):
+        return ContentChunks().split(self._binary)
+
+    def read(self):
+        return self._binary
+
+    def save(self, store):
+        store.put(self.digest, self.iterate())
+
+    def discard(self):
+        pass
+
+
 class InvalidUpdateContentError(RuntimeError):
     def __init__(self, message):
         self.message = message
@@ -181,109 +1199,737 @@ class SchemaVersionValidator(DatabaseUpdateContentValidator):
 class ContentValidator(DatabaseUpdateContentValidator):
     def validate(self, update_content):
         for content_schema_version in update_content.schema_versions:
-            self._validate_content(content_schema_version.content)
+            if not isinstance(content_schema_version, SchemaVersionDelta):
+                self._validate_content(content_schema_version.content)
 
     def _validate_content(self, content):
-        if not isinstance(content, bytes):
+        if isinstance(content, StoredContent):
+            size = content.size
+        elif isinstance(content, bytes):
+            size = len(content)
+        else:
             raise InvalidUpdateContentError('Content is not a byte sequence')
 
-        if len(content) <= 0:
+        if size <= 0:
             raise InvalidUpdateContentError('Content is empty')
 
 
+class DeltaValidator(DatabaseUpdateContentValidator):
+    DIGEST_LENGTH = 64
+    ALLOWED_DIGEST_CHARS = '0123456789abcdef'
+
+    def validate(self, update_content):
+        for content_schema_version in update_content.schema_versions:
+            if isinstance(content_schema_version, SchemaVersionDelta):
+                self._validate_delta(content_schema_version)
+
+    def _validate_delta(self, schema_version_delta):
+        if not isinstance(schema_version_delta.base_version, str):
+            raise InvalidUpdateContentError('Base version is not a string')
+
+        digest = schema_version_delta.digest
+        if not isinstance(digest, str) or len(digest) != self.DIGEST_LENGTH:
+            raise InvalidUpdateContentError(
+                'Digest is not a SHA-256 hex string'
+            )
+
+        if any(x not in self.ALLOWED_DIGEST_CHARS for x in digest):
+            raise InvalidUpdateContentError(
+                'Digest contains invalid characters'
+            )
+
+        if not isinstance(schema_version_delta.delta, bytes):
+            raise InvalidUpdateContentError('Delta is not a byte sequence')
+
+        if len(schema_version_delta.delta) <= 0:
+            raise InvalidUpdateContentError('Delta is empty')
+
+
 class DatabaseUpdateContent:
-    def __init__(self, update_content_json):
+    CONTENT_TYPE = 'application/json'
+    INVALID_CONTENT_MESSAGE = 'Invalid content JSON'
+    UTF8_ENCODING = 'utf-8'
+    CONTENT_PATH = ('schema_versions', 'content')
+    DELTA_PATH = ('schema_versions', 'delta')
+
+    def __init__(self, update_content):
+        self._stored_contents = []
+
         try:
-            update_content_dict = json.loads(update_content_json)
+            self._parse(update_content)
+        except:
+            self.discard()
+            raise InvalidUpdateContentError(self.INVALID_CONTENT_MESSAGE)
 
-            self.version = update_content_dict['version']
-            self.schema_versions = self._parse_schema_versions(
-                update_content_dict['schema_versions']
-            )
+        try:
+            self._validate()
         except:
-            raise InvalidUpdateContentError('Invalid content JSON')
+            self.discard()
+            raise
+
+    def discard(self):
+        # Stored content is removed unless a publication saved it
+        for content in self._stored_contents:
+            content.discard()
+
+    def _parse(self, update_content):
+        # Content is either JSON text or binary chunks of it
+        if isinstance(update_content, str):
+            update_content = [update_content.encode(self.UTF8_ENCODING)]
+
+        events = json_stream.JsonEventReader(update_content).read()
+        update_content_dict = self._read_value(events, next(events), ())
+        # Reader checks nothing follows the root value only once it is
+        # exhausted
+        for _ in events:
+            pass
+
+        self.version = update_content_dict['version']
+        self.schema_versions = self._parse_schema_versions(
+            update_content_dict['schema_versions']
+        )
 
-        self._validate()
+    def _read_value(self, events, event, path):
+        reader = json_stream.JsonEventReader
+
+        if event.kind == reader.START_MAP:
+            value = {}
+            for key_event in events:
+                if key_event.kind == reader.END_MAP:
+                    return value
+                value[key_event.value] = self._read_value(
+                    events, next(events), path + (key_event.value,)
+                )
+
+        if event.kind == reader.START_ARRAY:
+            value = []
+            for item_event in events:
+                if item_event.kind == reader.END_ARRAY:
+                    return value
+                value.append(self._read_value(events, item_event, path))
+
+        if event.kind == reader.STRING:
+            # Content is decoded as it is read, so its Base64 text is never
+            # held in full
+            if path == self.CONTENT_PATH:
+                return self._read_content(
+                    Base64.base64_chunks_to_binary_chunks(event.value)
+                )
+            if path == self.DELTA_PATH:
+                return b''.join(
+                    Base64.base64_chunks_to_binary_chunks(event.value)
+                )
+            return ''.join(event.value)
+
+        return event.value
+
+    def _read_content(self, chunks):
+        store = storage.BlobStore.get()
+        if not store:
+            return b''.join(chunks)
+
+        content = StoredContent.write(store, chunks)
+        self._stored_contents.append(content)
+        return content
 
     def _parse_schema_versions(self, schema_version_list):
         return [self._parse_schema_version(x) for x in schema_version_list]
 
     def _parse_schema_version(self, schema_version_dict):
+        # Content is either sent in full or as a delta against the version
+        # published before
+        if 'base_version' in schema_version_dict:
+            return SchemaVersionDelta(
+                schema_version=schema_version_dict['schema_version'],
+                base_version=schema_version_dict['base_version'],
+                digest=schema_version_dict['digest'],
+                delta=schema_version_dict['delta']
+            )
+
         return SchemaVersionContent(
             schema_version=schema_version_dict['schema_version'],
-            content=Base64.base64_str_to_binary(schema_version_dict['content'])
+            content=schema_version_dict['content']
         )
 
     def _validate(self):
         validators = [
             VersionValidator(),
             SchemaVersionValidator(),
-            ContentValidator()
+            ContentValidator(),
+            DeltaValidator()
         ]
 
         for validator in validators:
             validator.validate(self)
 
 
+class BinaryDatabaseUpdateContent(DatabaseUpdateContent):
+    CONTENT_TYPE = 'application/vnd.bustime.database-update'
+    INVALID_CONTENT_MESSAGE = 'Invalid content binary'
+
+    MAGIC = b'BTPU'
+    HEADER_FORMAT = '>4sH'
+    SCHEMA_VERSION_FORMAT = '>IH'
+    DIGEST_LENGTH = 32
+    LENGTH_FORMAT = '>Q'
+    ASCII_ENCODING = 'ascii'
+
+    def _parse(self, update_content):
+        reader = BinaryChunkReader(update_content)
+
+        magic, version_length = reader.unpack(self.HEADER_FORMAT)
+        if magic != self.MAGIC:
+            raise ValueError('Invalid content magic')
+
+        self.version = reader.read(version_length).decode(self.UTF8_ENCODING)
+        self.schema_versions = []
+
+        while not reader.is_at_end():
+            self.schema_versions.append(self._read_schema_version(reader))
+
+    def _read_schema_version(self, reader):
+        schema_version, base_version_length = reader.unpack(
+            self.SCHEMA_VERSION_FORMAT
+        )
+
+        if not base_version_length:
+            length, = reader.unpack(self.LENGTH_FORMAT)
+            return SchemaVersionContent(
+                schema_version=schema_version,
+                content=self._read_content(reader.iterate(length))
+            )
+
+        base_version = reader.read(base_version_length).decode(
+            self.UTF8_ENCODING
+        )
+        digest = binascii.hexlify(reader.read(self.DIGEST_LENGTH)).decode(
+            self.ASCII_ENCODING
+        )
+        length, = reader.unpack(self.LENGTH_FORMAT)
+
+        return SchemaVersionDelta(
+            schema_version=schema_version,
+            base_version=base_version,
+            digest=digest,
+            delta=reader.read(length)
+        )
+
+
+class BinaryChunkReader:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b''
+        self._position = 0
+
+    def unpack(self, struct_format):
+        return struct.unpack(
+            struct_format, self.read(struct.calcsize(struct_format))
+        )
+
+    def read(self, length):
+        return b''.join(self.iterate(length))
+
+    def iterate(self, length):
+        # Parts are passed on as they come, so a bogus length does not
+        # allocate anything beyond what is actually sent
+        remaining = length
+
+        while remaining > 0:
+            if not self._fill():
+                raise EOFError('Unexpected end of content')
+
+            end = min(self._position + remaining, len(self._chunk))
+            part = self._chunk[self._position:end]
+            self._position = end
+            remaining -= len(part)
+            yield part
+
+    def is_at_end(self):
+        return not self._fill()
+
+    def _fill(self):
+        while self._position >= len(self._chunk):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+
+            self._chunk = chunk
+            self._position = 0
+
+        return True
+
+
+ManifestSchemaVersion = collections.namedtuple(
+    'ManifestSchemaVersion', 'schema_version, version'
+)
+
+
+class InvalidManifestRequestError(RuntimeError):
+    def __init__(self, message):
+        self.message = message
+
+
+class DatabaseManifestRequest:
+    MAX_SCHEMA_VERSION_COUNT = 256
+
+    def __init__(self, manifest_request_json):
+        try:
+            manifest_request_dict = json.loads(manifest_request_json)
+
+            self.schema_versions = self._parse_schema_versions(
+                manifest_request_dict['schema_versions']
+            )
+        except:
+            raise InvalidManifestRequestError('Invalid manifest JSON')
+
+        self._validate()
+
+    def _parse_schema_versions(self, schema_version_list):
+        return [self._parse_schema_version(x) for x in schema_version_list]
+
+    def _parse_schema_version(self, schema_version_dict):
+        return ManifestSchemaVersion(
+            schema_version=schema_version_dict['schema_version'],
+            version=schema_version_dict.get('version')
+        )
+
+    def _validate(self):
+        if len(self.schema_versions) > self.MAX_SCHEMA_VERSION_COUNT:
+            raise InvalidManifestRequestError('Too many schema versions')
+
+        for manifest_schema_version in self.schema_versions:
+            version = manifest_schema_version.version
+            if version is not None and not isinstance(version, str):
+                raise InvalidManifestRequestError('Version is not a string')
+
+        try:
+            SchemaVersionValidator().validate(self)
+        except InvalidUpdateContentError as e:
+            raise InvalidManifestRequestError(e.message)
+
+
 class InvalidSignatureError(RuntimeError):
     pass
 
 
+class OutdatedBaseVersionError(RuntimeError):
+    def __init__(self, schema_version):
+        self.schema_version = schema_version
+
+
 class DatabaseUpdate:
-    def get_update_content(self, update_content_json, signature_text):
-        if not self._is_signature_valid(update_content_json, signature_text):
+    # Delta may only grow content up to that, whatever its header says
+    MAX_DELTA_CONTENT_LENGTH = 256 * 1024 * 1024
+    # Same as files of the blob store, released content outlives any
+    # download or cached state which may still refer to it
+    RELEASED_BLOB_GRACE_PERIOD = datetime.timedelta(
+        seconds=storage.FileBlobStore.GARBAGE_GRACE_PERIOD
+    )
+
+    def get_update_content(self, update_content_chunks, signature_text,
+                           key_id=None,
+                           update_content_class=DatabaseUpdateContent):
+        # Body is read once, it is hashed for the signature while content
+        # is being parsed
+        digest = SignatureDigest()
+        signed_chunks = digest.update_chunks(update_content_chunks)
+        try:
+            update_content = update_content_class(signed_chunks)
+            content_error = None
+        except InvalidUpdateContentError as e:
+            update_content = None
+            content_error = e
+
+        # Signature is checked first, so the rest of invalid content is
+        # read anyway
+        for _ in signed_chunks:
+            pass
+
+        if not self._is_signature_valid(
+            digest.finalize(), signature_text, key_id
+        ):
+            if update_content:
+                update_content.discard()
             raise InvalidSignatureError()
 
-        return DatabaseUpdateContent(update_content_json)
+        if content_error:
+            raise content_error
+
+        return update_content
 
-    def _is_signature_valid(self, update_content_json, signature_text):
-        return SignatureVerifier().verify(
-            config.Config.get().key_binaries,
-            update_content_json,
+    def _is_signature_valid(self, digest, signature_text, key_id):
+        signing_key = SignatureVerifier().find_digest_signing_key(
+            self._get_candidate_keys(key_id),
+            digest,
             Base64.base64_str_to_binary(signature_text)
         )
+        if not signing_key:
+            return False
+
+        logger.info('Publication signed with key %s', signing_key.fingerprint)
+        return True
+
+    def _get_candidate_keys(self, key_id):
+        key_ring = KeyRing.get()
+        if key_id is None:
+            return key_ring.public_keys
+
+        # Named key is the only one checked, so a wrong signature costs
+        # a single verification however many keys are configured
+        public_key = key_ring.find(key_id)
+        return [public_key] if public_key else []
 
     def apply_update(self, update_content):
+        try:
+            self._apply_update(update_content)
+        finally:
+            update_content.discard()
+
+    def _apply_update(self, update_content):
         with db.Session() as session:
             existing_databases = self._fetch_existing_databases(
                 session, update_content
             )
-
-            for schema_version_content in update_content.schema_versions:
-                self._single_apply_update(
+            published_at = datetime.datetime.utcnow()
+            released_digests = set()
+            schema_version_contents = [
+                self._resolve_content(existing_databases, x)
+                for x in update_content.schema_versions
+            ]
+
+            for schema_version_content in schema_version_contents:
+                released_digests.update(self._single_apply_update(
                     session,
                     existing_databases,
                     schema_version_content,
-                    update_content.version
-                )
+                    update_content.version,
+                    published_at
+                ))
+
+            self._release_blobs(session, released_digests, published_at)
+
+            schema_versions = [
+                x.schema_version for x in update_content.schema_versions
+            ]
+            notification.DatabaseChangeChannel().notify(
+                session, schema_versions
+            )
 
         session.commit()
 
+        db.ReplicaSet.get().pin_primary()
+        DatabaseStateCache.get().invalidate(schema_versions)
+        DatabaseVersionWatcher.get().notify()
+        self._collect_garbage()
+
+    def _resolve_content(self, existing_databases, schema_version_content):
+        if not isinstance(schema_version_content, SchemaVersionDelta):
+            content = schema_version_content.content
+            if not isinstance(content, StoredContent):
+                content = BufferedContent(content)
+
+            return schema_version_content._replace(content=content)
+
+        schema_version = schema_version_content.schema_version
+        existing_database = self._find_existing_database(
+            existing_databases, schema_version
+        )
+        if (not existing_database or existing_database.version !=
+                schema_version_content.base_version):
+            raise OutdatedBaseVersionError(schema_version)
+
+        try:
+            content = CpuWork.run(
+                delta.PageDelta().apply,
+                self._load_blob_content(existing_database.blob),
+                schema_version_content.delta,
+                self.MAX_DELTA_CONTENT_LENGTH
+            )
+        except delta.InvalidDeltaError as e:
+            raise InvalidUpdateContentError(e.message)
+
+        content = BufferedContent(content)
+        if content.digest != schema_version_content.digest:
+            raise InvalidUpdateContentError(
+                'Delta result does not match its digest'
+            )
+
+        return SchemaVersionContent(
+            schema_version=schema_version, content=content
+        )
+
+    def _collect_garbage(self):
+        store = storage.BlobStore.get()
+        if not store:
+            return
+
+        # Publication is committed already and must not fail because of
+        # files left behind, those are collected next time
+        try:
+            self._collect_store_garbage(store)
+        except Exception:
+            logger.exception('Blob garbage collection failed')
+
+    def _collect_store_garbage(self, store):
+        with db.Session() as session:
+            referenced_digests = set(
+                x.digest for x in session.query(db.Blob.digest)
+            )
+
+        store.collect_garbage(referenced_digests)
+
     def _fetch_existing_databases(self, session, update_content):
         schema_versions = [
             x.schema_version for x in update_content.schema_versions
         ]
 
+        # Rows stay locked until commit, so a concurrent publication based
+        # on the same version waits and then sees it is outdated
         return (session
             .query(db.Database)
             .filter(db.Database.schema_version.in_(schema_versions))
+            .with_for_update()
             .all()
         )
 
     def _single_apply_update(self, session, existing_databases,
-                             schema_version_content, version):
+                             schema_version_content, version, published_at):
         existing_database = self._find_existing_database(
             existing_databases, schema_version_content.schema_version
         )
 
+        content = schema_version_content.content
+        digest = content.digest
+
+        if existing_database and existing_database.digest == digest:
+            # Unchanged content keeps its blobs, variants and deltas
+            existing_database.version = version
+            existing_database.published_at = published_at
+            return []
+
+        released_digests = []
+
         if existing_database:
+            # Replaced content is kept to build deltas against
+            released_digests.extend(
+                self._archive_database(session, existing_database)
+            )
+            released_digests.extend(
+                x.digest for x in existing_database.variants
+            )
+            variants = self._build_variants(session, digest, content)
+
             existing_database.version = version
-            existing_database.content = schema_version_content.content
+            existing_database.blob = self._get_blob(session, digest, content)
+            existing_database.digest = digest
+            existing_database.size = content.size
+            existing_database.published_at = published_at
+            self._replace_variants(session, existing_database, variants)
         else:
             self._create_new_database(
-                session, schema_version_content, version
+                session, schema_version_content, version, digest,
+                published_at
+            )
+
+        released_digests.extend(
+            self._prune_revisions(
+                session, schema_version_content.schema_version
+            )
+        )
+        self._rebuild_deltas(session, schema_version_content, digest)
+
+        return released_digests
+
+    def _get_blob(self, session, digest, content):
+        # Identical content is stored once whatever references it
+        blob = (session.query(db.Blob)
+                .filter(db.Blob.digest == digest)
+                .first())
+        if blob:
+            blob.released_at = None
+            return blob
+
+        blob = db.Blob(
+            digest=digest, content=self._store_content(digest, content)
+        )
+        session.add(blob)
+        return blob
+
+    def _store_content(self, digest, content):
+        store = storage.BlobStore.get()
+        if not store:
+            return content.read()
+
+        # Only metadata is left in the database when the store is used
+        content.save(store)
+        return None
+
+    def _release_blobs(self, session, digests, released_at):
+        session.flush()
+
+        # Blobs are only released once nothing references them anymore
+        # and removed when the grace period of an earlier release is over
+        query = session.query(db.Blob)
+        for model in [db.Database, db.DatabaseVariant, db.DatabaseRevision]:
+            query = query.filter(
+                ~sa.exists().where(model.digest == db.Blob.digest)
             )
 
+        if digests:
+            (query
+                .filter(db.Blob.digest.in_(digests))
+                .update({db.Blob.released_at: released_at},
+                        synchronize_session=False))
+
+        (query
+            .filter(db.Blob.released_at <
+                    released_at - self.RELEASED_BLOB_GRACE_PERIOD)
+            .delete(synchronize_session=False))
+
+    def _replace_variants(self, session, existing_database, variants):
+        # Flush orphan removal first, otherwise new variants are inserted
+        # before old ones are deleted and break the unique constraint
+        existing_database.variants = []
+        session.flush()
+
+        existing_database.variants = variants
+
+    def _archive_database(self, session, existing_database):
+        released_digests = self._delete_revisions(
+            session.query(db.DatabaseRevision)
+            .filter(db.DatabaseRevision.schema_version ==
+                    existing_database.schema_version)
+            .filter(db.DatabaseRevision.version == existing_database.version)
+        )
+
+        session.add(db.DatabaseRevision(
+            schema_version=existing_database.schema_version,
+            version=existing_database.version,
+            digest=existing_database.digest,
+            published_at=existing_database.published_at
+        ))
+
+        return released_digests
+
+    def _prune_revisions(self, session, schema_version):
+        revision_ids = (session.query(db.DatabaseRevision.id)
+            .filter(db.DatabaseRevision.schema_version == schema_version)
+            .order_by(db.DatabaseRevision.published_at.desc(),
+                      db.DatabaseRevision.id.desc())
+            .offset(config.Config.get().revision_count)
+            .all())
+
+        if not revision_ids:
+            return []
+
+        return self._delete_revisions(
+            session.query(db.DatabaseRevision)
+            .filter(db.DatabaseRevision.id.in_([x.id for x in revision_ids]))
+        )
+
+    def _delete_revisions(self, query):
+        released_digests = [
+            x.digest for x in query.with_entities(db.DatabaseRevision.digest)
+        ]
+        query.delete(synchronize_session=False)
+
+        return released_digests
+
+    def _rebuild_deltas(self, session, schema_version_content, digest):
+        schema_version = schema_version_content.schema_version
+
+        (session.query(db.DatabaseDelta)
+            .filter(db.DatabaseDelta.schema_version == schema_version)
+            .delete(synchronize_session=False))
+
+        revisions = (session.query(db.DatabaseRevision)
+            .filter(db.DatabaseRevision.schema_version == schema_version)
+            .filter(db.DatabaseRevision.digest != digest)
+            .all())
+        if not revisions:
+            return
+
+        # Deltas are built from content in full, it is only read for them
+        content = schema_version_content.content.read()
+
+        for revision in revisions:
+            delta_content = CpuWork.run(
+                delta.PageDelta().make,
+                self._load_blob_content(revision.blob),
+                content
+            )
+
+            # A delta not smaller than the content itself is of no use
+            if len(delta_content) < len(content):
+                session.add(db.DatabaseDelta(
+                    schema_version=schema_version,
+                    from_version=revision.version,
+                    to_digest=digest,
+                    content=delta_content
+                ))
+
+    def _load_blob_content(self, blob):
+        if blob.content is not None:
+            return blob.content
+
+        return storage.BlobStore.get().read(blob.digest)
+
+    def _build_variants(self, session, digest, content):
+        shared_variants = self._find_shared_variants(session, digest)
+        if shared_variants:
+            return shared_variants
+
+        variants = []
+
+        for encoder in ContentEncoders().get_available():
+            encoded_content = CpuWork.run(self._encode, encoder, content)
+
+            # Incompressible content is better served as is
+            if encoded_content.size < content.size:
+                variants.append(db.DatabaseVariant(
+                    encoding=encoder.ENCODING,
+                    blob=self._get_blob(
+                        session, encoded_content.digest, encoded_content
+                    ),
+                    digest=encoded_content.digest,
+                    size=encoded_content.size
+                ))
+            encoded_content.discard()
+
+        return variants
+
+    def _encode(self, encoder, content):
+        chunks = encoder.encode_chunks(content.iterate())
+
+        # Variants are encoded straight into the blob store as well
+        store = storage.BlobStore.get()
+        if store:
+            return StoredContent.write(store, chunks)
+
+        return BufferedContent(b''.join(chunks))
+
+    def _find_shared_variants(self, session, digest):
+        # Content already published for another schema version or earlier
+        # is not encoded again, its variants are referenced instead
+        existing_variants = (session.query(db.DatabaseVariant)
+            .join(db.Database,
+                  db.DatabaseVariant.database_id == db.Database.id)
+            .filter(db.Database.digest == digest)
+            .all())
+
+        variants_by_encoding = collections.OrderedDict(
+            (x.encoding, x) for x in existing_variants
+        )
+
+        return [
+            db.DatabaseVariant(
+                encoding=x.encoding,
+                digest=x.digest,
+                size=x.size
+            )
+            for x in variants_by_encoding.values()
+        ]
+
     def _find_existing_database(self, existing_databases, schema_version):
         return next(
             (x for x in existing_databases
@@ -291,25 +1937,144 @@ class DatabaseUpdate:
             None
         )
 
-    def _create_new_database(self, session, schema_version_content, version):
+    def _create_new_database(self, session, schema_version_content, version,
+                             digest, published_at):
+        content = schema_version_content.content
+
         new_database = db.Database(
             version=version,
             schema_version=schema_version_content.schema_version,
-            content=schema_version_content.content
+            blob=self._get_blob(session, digest, content),
+            digest=digest,
+            size=content.size,
+            published_at=published_at,
+            variants=self._build_variants(session, digest, content)
         )
         session.add(new_database)
 
 
+class CpuWork:
+    # Cooperative workers serve all their connections on a single thread,
+    # so encoding and deltas of a publication run on a native thread of
+    # the hub instead of stalling them for seconds
+    @classmethod
+    def run(cls, function, *args):
+        if gevent and gevent.monkey.is_module_patched('socket'):
+            return gevent.get_hub().threadpool.apply(function, args)
+
+        return function(*args)
+
+
 class Sha256:
     HEX_ENCODING = 'hex'
     ASCII_ENCODING = 'ascii'
 
     def make_hash(self, binary):
+        return self.make_chunks_hash([binary])
+
+    def make_chunks_hash(self, chunks):
         sha256 = crypto_hashes.Hash(
             crypto_hashes.SHA256(), backend=crypto_backend()
         )
-        sha256.update(binary)
+        for chunk in chunks:
+            sha256.update(chunk)
         digest_binary = sha256.finalize()
 
         hex_binary = codecs.encode(digest_binary, self.HEX_ENCODING)
         return hex_binary.decode(self.ASCII_ENCODING)
+
+
+class ContentChunks:
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, chunk_size=None):
+        self._chunk_size = chunk_size or self.CHUNK_SIZE
+
+    def split(self, binary):
+        for offset in range(0, len(binary), self._chunk_size):
+            yield binary[offset:offset + self._chunk_size]
+
+    def get_windows(self, stop, start=0):
+        for offset in range(start, stop, self._chunk_size):
+            yield offset, min(offset + self._chunk_size, stop)
+
+
+class ContentEncoder(abc.ABC):
+    IDENTITY_ENCODING = 'identity'
+
+    ENCODING = None
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def encode(self, binary):
+        return b''.join(self.encode_chunks([binary]))
+
+    @abc.abstractmethod
+    def encode_chunks(self, chunks):
+        pass
+
+
+class GzipContentEncoder(ContentEncoder):
+    ENCODING = 'gzip'
+    COMPRESSION_LEVEL = 9
+    # Adding 16 to window bits makes zlib write gzip header and trailer
+    GZIP_WINDOW_BITS = 16 + zlib.MAX_WBITS
+
+    def encode_chunks(self, chunks):
+        compressor = zlib.compressobj(
+            self.COMPRESSION_LEVEL, zlib.DEFLATED, self.GZIP_WINDOW_BITS
+        )
+
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+
+
+class BrotliContentEncoder(ContentEncoder):
+    ENCODING = 'br'
+    QUALITY = 9
+
+    @classmethod
+    def is_available(cls):
+        return brotli is not None
+
+    def encode_chunks(self, chunks):
+        compressor = brotli.Compressor(quality=self.QUALITY)
+
+        for chunk in chunks:
+            yield compressor.process(chunk)
+        yield compressor.finish()
+
+
+class ZstdContentEncoder(ContentEncoder):
+    ENCODING = 'zstd'
+    COMPRESSION_LEVEL = 19
+
+    @classmethod
+    def is_available(cls):
+        return zstandard is not None
+
+    def encode_chunks(self, chunks):
+        compressor = zstandard.ZstdCompressor(
+            level=self.COMPRESSION_LEVEL
+        ).compressobj()
+
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+
+
+class ContentEncoders:
+    # Ordered by preference, the best compression ratio goes first
+    ENCODER_CLASSES = [
+        BrotliContentEncoder,
+        ZstdContentEncoder,
+        GzipContentEncoder
+    ]
+
+    ENCODINGS = [x.ENCODING for x in ENCODER_CLASSES]
+
+    def get_available(self):
+        return [x() for x in self.ENCODER_CLASSES if x.is_available()]
@@ -3,8 +3,14 @@
 
 import base64
 import collections
+import datetime
+import gzip
 import json
+import os
+import struct
 import tempfile
+import threading
+import time
 
 import pytest
 from cryptography.hazmat.backends import default_backend as crypto_backend
@@ -12,8 +18,10 @@ from cryptography.hazmat.primitives import hashes as crypto_hashes
 from cryptography.hazmat.primitives import serialization as crypto_serial
 from cryptography.hazmat.primitives.asymmetric import padding as crypto_padding
 from cryptography.hazmat.primitives.asymmetric import rsa as crypto_rsa
+import sqlalchemy as sa
+from sqlalchemy import orm
 
-from backend import db, config, service
+from backend import db, config, delta, service, storage
 
 
 class SqliteDbConfig(config.Config):
@@ -41,7 +49,10 @@ class BaseDbAwareTest:
 
     def init_filled_database(self):
         databases = [
-            db.Database(schema_version=x, version=str(x), content=bytes(x))
+            db.Database(
+                schema_version=x, version=str(x),
+                blob=db.Blob(content=bytes(x))
+            )
             for x in range(self.MIN_VERSION, self.MAX_VERSION + 1)
         ]
         self.init_database(databases)
@@ -52,10 +63,29 @@ class BaseDbAwareTest:
             config.Config.init(SqliteDbConfig())
 
         with db.Session(init_schema=is_new_database) as session:
+            session.query(db.DatabaseVariant).delete()
+            session.query(db.DatabaseRevision).delete()
+            session.query(db.DatabaseDelta).delete()
             session.query(db.Database).delete()
+            session.query(db.Blob).delete()
             for x in databases:
+                self._fill_blob_fields(x)
+                for variant in x.variants:
+                    self._fill_blob_fields(variant)
+                if x.published_at is None:
+                    x.published_at = datetime.datetime.utcnow()
                 session.add(x)
 
+        service.ContentCache.get().clear()
+
+    def _fill_blob_fields(self, x):
+        if x.blob.digest is None:
+            x.blob.digest = service.Sha256().make_hash(x.blob.content)
+        if x.digest is None:
+            x.digest = x.blob.digest
+        if x.size is None:
+            x.size = len(x.blob.content)
+
 
 class TestDatabaseQuery(BaseDbAwareTest):
     def test_get_existing_version_info_succeeds(self):
@@ -71,10 +101,320 @@ class TestDatabaseQuery(BaseDbAwareTest):
                 self.MAX_VERSION + 1
             )
 
+    def test_get_version_compiles_statement_once(self):
+        self.init_filled_database()
+        query = service.DatabaseQuery()
+        query.get_version(self.MIN_VERSION)
+        query.get_version(self.MAX_VERSION)
+
+        compiled_statements = [
+            x for x in db.Connection._compiled_cache.keys()
+            if x[1] is service.DatabaseQuery.STATE_STATEMENT
+        ]
+        assert len(compiled_statements) == 1
+
+    def test_get_existing_info_succeeds(self):
+        self.init_filled_database()
+        info = service.DatabaseQuery().get_info(self.MIN_VERSION)
+
+        assert info.schema_version == self.MIN_VERSION
+        assert info.version == str(self.MIN_VERSION)
+        assert info.digest == service.Sha256().make_hash(
+            bytes(self.MIN_VERSION)
+        )
+        assert info.published_at is not None
+        assert info.encoding == service.ContentEncoder.IDENTITY_ENCODING
+
+    def test_get_non_existing_info_fails(self):
+        self.init_filled_database()
+
+        with pytest.raises(service.NoDatabaseFound):
+            service.DatabaseQuery().get_info(self.MAX_VERSION + 1)
+
+    def test_open_content_slices_reads_slices(self):
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        info = service.DatabaseQuery().get_info(1)
+
+        slices = service.DatabaseQuery().open_content_slices(info)
+
+        assert info.size == 10
+        assert list(slices.iterate_range(0, 2)) == [b'01']
+        assert list(slices.iterate_range(5, 10)) == [b'56789']
+        slices.close()
+
+    def test_open_content_slices_reads_windows(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        info = service.DatabaseQuery().get_info(1)
+
+        slices = service.DatabaseQuery().open_content_slices(info)
+
+        assert list(slices.iterate_range(1, 10)) == [
+            b'1234', b'5678', b'9'
+        ]
+        slices.close()
+
+    def test_open_content_slices_compiles_statement_once(self):
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        query = service.DatabaseQuery()
+        info = query.get_info(1)
+        slices = query.open_content_slices(info)
+        for start, stop in [(0, 2), (1, 3), (4, 6), (7, 9)]:
+            list(slices.iterate_range(start, stop))
+        slices.close()
+
+        known_statements = [
+            service.DatabaseQuery.CHUNK_STATEMENT,
+            service.DatabaseQuery.CONTENT_STATEMENT
+        ]
+        compiled_statements = [
+            x for x in db.Connection._compiled_cache.keys()
+            if all(x[1] is not y for y in known_statements) and
+            'substr' in str(x[1])
+        ]
+        assert compiled_statements == []
+
+    def test_open_content_slices_uses_cached_content(self):
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        b''.join(service.DatabaseQuery().get_content(1).chunks)
+        info = service.DatabaseQuery().get_info(1)
+        hits_before = service.ContentCache.get().stats.hits
+
+        slices = service.DatabaseQuery().open_content_slices(info)
+
+        assert list(slices.iterate_range(3, 4)) == [b'3']
+        assert service.ContentCache.get().stats.hits == hits_before + 1
+
+    def test_open_changed_content_slices_fails(self):
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        info = service.DatabaseQuery().get_info(1)._replace(
+            digest='0', encoded_digest='0'
+        )
+
+        slices = service.DatabaseQuery().open_content_slices(info)
+
+        with pytest.raises(service.ContentChangedError):
+            list(slices.iterate_range(0, 1))
+        slices.close()
+
+    def test_iterate_content_reads_chunks(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        monkeypatch.setattr(service.ContentCache.get(), '_max_size', 0)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+
+        query = service.DatabaseQuery()
+        chunks = list(query.iterate_content(query.get_info(1)))
+
+        assert chunks == [b'0123', b'4567', b'89']
+        assert service.ContentCache.get().stats.count == 0
+
+    def test_slow_iteration_releases_connection(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        monkeypatch.setattr(service.ContentStream, 'SLOW_CHUNK_INTERVAL', -1)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+
+        query = service.DatabaseQuery()
+        stream = query.iterate_content(query.get_info(1))
+        chunks = iter(stream)
+
+        assert next(chunks) == b'0123'
+        assert stream._connection is not None
+        assert next(chunks) == b'4567'
+        assert stream._connection is None
+        stream.close()
+
+    def test_releasing_scope_releases_connection(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+
+        db.Scope.begin(is_releasing=True)
+        try:
+            query = service.DatabaseQuery()
+            stream = query.iterate_content(query.get_info(1))
+        finally:
+            db.Scope.end()
+        chunks = iter(stream)
+
+        assert next(chunks) == b'0123'
+        assert stream._connection is None
+        assert b''.join(chunks) == b'456789'
+
+    def test_iterate_content_reads_variant_chunks(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        variants = [
+            db.DatabaseVariant(
+                encoding='gzip', blob=db.Blob(content=b'abcdef')
+            )
+        ]
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'identity'),
+                        variants=variants)
+        ])
+
+        query = service.DatabaseQuery()
+        info = query.get_info(1, ['gzip'])
+        chunks = list(query.iterate_content(info))
+
+        assert info.encoded_size == 6
+        assert chunks == [b'abcd', b'ef']
+
+    def test_iterate_content_caches_fitting_content(self):
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+
+        query = service.DatabaseQuery()
+        info = query.get_info(1)
+        list(query.iterate_content(info))
+        hits_before = service.ContentCache.get().stats.hits
+
+        content = b''.join(query.iterate_content(info))
+
+        assert content == b'0123456789'
+        assert service.ContentCache.get().stats.hits == hits_before + 1
+
+    def test_concurrent_iteration_collects_content_once(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        cache = service.ContentCache.get()
+        put_contents = []
+        monkeypatch.setattr(
+            cache, 'put', lambda digest, content: put_contents.append(content)
+        )
+
+        query = service.DatabaseQuery()
+        info = query.get_info(1)
+        first_chunks = iter(query.iterate_content(info))
+        second_chunks = iter(query.iterate_content(info))
+        next(first_chunks)
+        next(second_chunks)
+
+        assert b''.join(second_chunks) == b'456789'
+        assert b''.join(first_chunks) == b'456789'
+        assert put_contents == [b'0123456789']
+
+    def test_interrupted_iteration_releases_digest(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+
+        query = service.DatabaseQuery()
+        info = query.get_info(1)
+        chunks = iter(query.iterate_content(info))
+        next(chunks)
+        chunks.close()
+
+        assert service.ContentCache.get().find(info.encoded_digest) is None
+        assert b''.join(query.iterate_content(info)) == b'0123456789'
+        assert service.ContentCache.get().find(info.encoded_digest) == (
+            b'0123456789'
+        )
+
+    def test_iterate_changed_content_fails(self):
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        query = service.DatabaseQuery()
+        info = query.get_info(1)._replace(digest='0', encoded_digest='0')
+
+        with pytest.raises(service.ContentChangedError):
+            list(query.iterate_content(info))
+
     def test_get_existing_content_succeeds(self):
         self.init_filled_database()
         content = service.DatabaseQuery().get_content(self.MIN_VERSION)
-        assert content == bytes(self.MIN_VERSION)
+        assert content.info.version == str(self.MIN_VERSION)
+        assert b''.join(content.chunks) == bytes(self.MIN_VERSION)
+        assert content.info.digest == service.Sha256().make_hash(
+            bytes(self.MIN_VERSION)
+        )
+        assert content.info.size == self.MIN_VERSION
+        assert content.info.encoding == (
+            service.ContentEncoder.IDENTITY_ENCODING
+        )
+
+    def test_get_content_reads_first_window_with_state(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        statements = []
+
+        def on_execute(*args):
+            statements.append(args)
+
+        engine = db.Engine.get()
+        sa.event.listen(engine, 'before_cursor_execute', on_execute)
+        try:
+            chunks = iter(service.DatabaseQuery().get_content(1).chunks)
+            first_chunk = next(chunks)
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', on_execute)
+
+        assert first_chunk == b'0123'
+        assert len(statements) == 1
+        assert b''.join(chunks) == b'456789'
+
+    def test_get_content_without_variant_yields_identity(self):
+        self.init_filled_database()
+        content = service.DatabaseQuery().get_content(
+            self.MIN_VERSION, ['gzip']
+        )
+        assert content.info.encoding == (
+            service.ContentEncoder.IDENTITY_ENCODING
+        )
+        assert b''.join(content.chunks) == bytes(self.MIN_VERSION)
+
+    def test_get_content_prefers_first_accepted_variant(self):
+        variants = [
+            db.DatabaseVariant(encoding='gzip', blob=db.Blob(content=b'gzip')),
+            db.DatabaseVariant(encoding='br', blob=db.Blob(content=b'br'))
+        ]
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'identity'),
+                        variants=variants)
+        ])
+
+        content = service.DatabaseQuery().get_content(
+            1, ['zstd', 'gzip', 'br']
+        )
+        assert content.info.encoding == 'gzip'
+        assert content.info.encoded_size == 4
+        assert b''.join(content.chunks) == b'gzip'
 
     def test_get_non_existing_content_fails(self):
         self.init_filled_database()
@@ -82,6 +422,278 @@ class TestDatabaseQuery(BaseDbAwareTest):
         with pytest.raises(service.NoDatabaseFound):
             service.DatabaseQuery().get_content(self.MAX_VERSION + 1)
 
+    def test_repeated_content_is_cached(self):
+        self.init_filled_database()
+        stats_before = service.ContentCache.get().stats
+
+        b''.join(service.DatabaseQuery().get_content(self.MAX_VERSION).chunks)
+        content = service.DatabaseQuery().get_content(self.MAX_VERSION)
+
+        stats_after = service.ContentCache.get().stats
+        assert b''.join(content.chunks) == bytes(self.MAX_VERSION)
+        assert stats_after.misses - stats_before.misses == 1
+        assert stats_after.hits - stats_before.hits == 1
+
+    def test_get_manifest_flags_outdated_versions(self):
+        self.init_filled_database()
+        manifest_request = service.DatabaseManifestRequest(json.dumps(dict(
+            schema_versions=[
+                dict(schema_version=2, version='2'),
+                dict(schema_version=1, version='0'),
+                dict(schema_version=3)
+            ]
+        )))
+
+        entries = service.DatabaseQuery().get_manifest(manifest_request)
+
+        assert [x.schema_version for x in entries] == [2, 1, 3]
+        assert [x.is_update_needed for x in entries] == [False, True, True]
+        assert entries[0].version == '2'
+        assert entries[0].size == 2
+        assert entries[0].digest == service.Sha256().make_hash(bytes(2))
+
+    def test_get_manifest_skips_non_existing_schema_versions(self):
+        self.init_filled_database()
+        manifest_request = service.DatabaseManifestRequest(json.dumps(dict(
+            schema_versions=[
+                dict(schema_version=self.MAX_VERSION + 1),
+                dict(schema_version=self.MIN_VERSION)
+            ]
+        )))
+
+        entries = service.DatabaseQuery().get_manifest(manifest_request)
+
+        assert [x.schema_version for x in entries] == [self.MIN_VERSION]
+
+
+class ListeningListener:
+    is_listening = True
+
+
+class TestDatabaseStateCache(BaseDbAwareTest):
+    def test_state_is_not_cached_without_listener(self):
+        cache = service.DatabaseStateCache()
+        cache.put(self._make_state(1), cache.generation)
+
+        assert cache.find(1) is None
+
+    def _make_state(self, schema_version, version='1'):
+        return service.DatabaseState(
+            schema_version=schema_version,
+            version=version,
+            digest='digest',
+            size=1,
+            published_at=datetime.datetime.utcnow(),
+            variants=()
+        )
+
+    def test_put_state_is_found(self):
+        cache = self._make_listening_cache()
+        state = self._make_state(1)
+        cache.put(state, cache.generation)
+
+        assert cache.find(1) == state
+        assert cache.find(2) is None
+
+    def _make_listening_cache(self):
+        cache = service.DatabaseStateCache()
+        cache._listener = ListeningListener()
+        return cache
+
+    def test_invalidate_removes_schema_versions(self):
+        cache = self._make_listening_cache()
+        cache.put(self._make_state(1), cache.generation)
+        cache.put(self._make_state(2), cache.generation)
+
+        cache.invalidate([1])
+
+        assert cache.find(1) is None
+        assert cache.find(2) is not None
+
+    def test_state_read_before_invalidation_is_not_cached(self):
+        cache = self._make_listening_cache()
+        generation = cache.generation
+
+        cache.invalidate([1])
+        cache.put(self._make_state(1), generation)
+
+        assert cache.find(1) is None
+
+    def test_query_reads_cached_state(self, monkeypatch):
+        self.init_filled_database()
+        cache = self._make_listening_cache()
+        monkeypatch.setattr(
+            service.DatabaseStateCache, 'get', classmethod(lambda x: cache)
+        )
+        query = service.DatabaseQuery()
+        query.get_version(self.MIN_VERSION)
+
+        with db.Session() as session:
+            session.query(db.Database).filter(
+                db.Database.schema_version == self.MIN_VERSION
+            ).update(dict(version='0'))
+
+        assert query.get_version(self.MIN_VERSION) == str(self.MIN_VERSION)
+        cache.invalidate([self.MIN_VERSION])
+        assert query.get_version(self.MIN_VERSION) == '0'
+
+
+class TestDatabaseVersionWatcher(BaseDbAwareTest):
+    def test_changed_version_is_returned_at_once(self):
+        self.init_filled_database()
+
+        version = service.DatabaseVersionWatcher().wait_for_change(
+            self.MIN_VERSION, '0', 60
+        )
+
+        assert version == str(self.MIN_VERSION)
+
+    def test_unchanged_version_is_returned_on_timeout(self):
+        self.init_filled_database()
+
+        version = service.DatabaseVersionWatcher().wait_for_change(
+            self.MIN_VERSION, str(self.MIN_VERSION), 0.01
+        )
+
+        assert version == str(self.MIN_VERSION)
+
+    def test_notified_waiter_checks_version_again(self, monkeypatch):
+        self.init_filled_database()
+        monkeypatch.setattr(
+            service.DatabaseVersionWatcher, 'POLL_INTERVAL', 60
+        )
+        watcher = service.DatabaseVersionWatcher()
+
+        def publish():
+            with db.Session() as session:
+                session.query(db.Database).filter(
+                    db.Database.schema_version == self.MIN_VERSION
+                ).update(dict(version='0'))
+            watcher.notify()
+
+        timer = threading.Timer(0.05, publish)
+        timer.start()
+        started_at = time.monotonic()
+
+        version = watcher.wait_for_change(
+            self.MIN_VERSION, str(self.MIN_VERSION), 60
+        )
+        timer.join()
+
+        assert version == '0'
+        assert time.monotonic() - started_at < 30
+
+    def test_subscribed_callback_is_notified(self):
+        watcher = service.DatabaseVersionWatcher()
+        calls = []
+
+        def callback():
+            calls.append(True)
+
+        watcher.subscribe(callback)
+        watcher.notify()
+        watcher.unsubscribe(callback)
+        watcher.notify()
+
+        assert calls == [True]
+
+
+class TestDatabaseManifestRequest:
+    def test_simple_request_succeeds(self):
+        manifest_request = service.DatabaseManifestRequest(json.dumps(dict(
+            schema_versions=[
+                dict(schema_version=1, version='1'),
+                dict(schema_version=2)
+            ]
+        )))
+
+        assert manifest_request.schema_versions == [
+            service.ManifestSchemaVersion(schema_version=1, version='1'),
+            service.ManifestSchemaVersion(schema_version=2, version=None)
+        ]
+
+    def test_invalid_json_fails(self):
+        with pytest.raises(service.InvalidManifestRequestError) as ex_info:
+            service.DatabaseManifestRequest('{"schema_versions": 1}')
+        assert ex_info.value.message == 'Invalid manifest JSON'
+
+    def test_non_string_version_fails(self):
+        with pytest.raises(service.InvalidManifestRequestError) as ex_info:
+            service.DatabaseManifestRequest(json.dumps(dict(
+                schema_versions=[dict(schema_version=1, version=1)]
+            )))
+        assert ex_info.value.message == 'Version is not a string'
+
+    def test_non_unique_schema_versions_fails(self):
+        with pytest.raises(service.InvalidManifestRequestError) as ex_info:
+            service.DatabaseManifestRequest(json.dumps(dict(
+                schema_versions=[
+                    dict(schema_version=1), dict(schema_version=1)
+                ]
+            )))
+        assert ex_info.value.message == 'Schema versions are not unique'
+
+    def test_too_many_schema_versions_fails(self):
+        count = service.DatabaseManifestRequest.MAX_SCHEMA_VERSION_COUNT + 1
+
+        with pytest.raises(service.InvalidManifestRequestError) as ex_info:
+            service.DatabaseManifestRequest(json.dumps(dict(
+                schema_versions=[
+                    dict(schema_version=x) for x in range(1, count + 1)
+                ]
+            )))
+        assert ex_info.value.message == 'Too many schema versions'
+
+
+class TestContentCache:
+    def test_missing_key_yields_none(self):
+        cache = service.ContentCache(10)
+
+        assert cache.find('1') is None
+        assert cache.stats.misses == 1
+
+    def test_put_content_is_found(self):
+        cache = service.ContentCache(10)
+        cache.put('1', b'123')
+
+        assert cache.find('1') == b'123'
+        assert cache.stats.hits == 1
+        assert cache.stats.size == 3
+
+    def test_least_recently_used_is_evicted(self):
+        cache = service.ContentCache(10)
+        cache.put('1', b'1234')
+        cache.put('2', b'1234')
+        cache.find('1')
+        cache.put('3', b'1234')
+
+        assert cache.find('1') == b'1234'
+        assert cache.find('2') is None
+        assert cache.find('3') == b'1234'
+        assert cache.stats.evictions == 1
+        assert cache.stats.size == 8
+
+    def test_too_big_content_is_not_cached(self):
+        cache = service.ContentCache(10)
+        cache.put('1', b'1234')
+        cache.put('2', b'12345678901')
+
+        assert cache.find('1') == b'1234'
+        assert cache.find('2') is None
+        assert cache.stats.evictions == 0
+
+    def test_digest_is_claimed_once(self):
+        cache = service.ContentCache(10)
+
+        assert cache.claim('1', 4)
+        assert not cache.claim('1', 4)
+        assert not cache.claim('2', 11)
+
+        cache.release('1', b'1234')
+
+        assert cache.find('1') == b'1234'
+        assert cache.claim('1', 4)
+
 
 class TestBase64:
     def test_encode_succeeds(self):
@@ -166,6 +778,16 @@ class TestDatabaseUpdateContent:
             service.DatabaseUpdateContent(content_json)
         assert 'Invalid content JSON' in str(ex_info)
 
+    def test_trailing_data_fails(self):
+        content_json = self._build_content(
+            '0000000000000000000000000000000000000000', 1, 'MQ=='
+        )
+
+        for suffix in ['garbage', '}}}', '{}']:
+            with pytest.raises(service.InvalidUpdateContentError) as ex_info:
+                service.DatabaseUpdateContent(content_json + suffix)
+            assert 'Invalid content JSON' in str(ex_info)
+
     def test_null_version_fails(self):
         content_json = self._build_content(None, 1, 'MQ==')
 
@@ -274,6 +896,136 @@ class TestDatabaseUpdateContent:
             service.DatabaseUpdateContent(content_json)
         assert 'Content is empty' in str(ex_info)
 
+    def test_delta_succeeds(self):
+        digest = '0123456789abcdef' * 4
+        content_json = json.dumps(dict(
+            version='0000000000000000000000000000000000000000',
+            schema_versions=[dict(
+                schema_version=1, base_version='1' * 40, digest=digest,
+                delta='QlRQRA=='
+            )]
+        ))
+
+        content = service.DatabaseUpdateContent(content_json)
+
+        assert content.schema_versions == [
+            service.SchemaVersionDelta(
+                schema_version=1, base_version='1' * 40, digest=digest,
+                delta=b'BTPD'
+            )
+        ]
+
+    def test_delta_with_invalid_digest_fails(self):
+        content_json = json.dumps(dict(
+            version='0000000000000000000000000000000000000000',
+            schema_versions=[dict(
+                schema_version=1, base_version='1' * 40, digest='0',
+                delta='QlRQRA=='
+            )]
+        ))
+
+        with pytest.raises(service.InvalidUpdateContentError) as ex_info:
+            service.DatabaseUpdateContent(content_json)
+        assert 'Digest is not a SHA-256 hex string' in str(ex_info)
+
+    def test_chunked_content_succeeds(self):
+        content = bytes(range(256)) * 4
+        content_json = self._build_content(
+            '0000000000000000000000000000000000000000', 1,
+            base64.encodebytes(content).decode('ascii')
+        ).replace('/', '\\/')
+        chunks = service.ContentChunks(7).split(content_json.encode('ascii'))
+
+        update_content = service.DatabaseUpdateContent(chunks)
+
+        self._assert_schema_version(update_content, 0, 1, content)
+
+
+class TestBinaryDatabaseUpdateContent:
+    VERSION = '0000000000000000000000000000000000000000'
+
+    def _build_content(self, version, schema_versions, magic=b'BTPU'):
+        version_binary = version.encode('utf-8')
+        parts = [
+            struct.pack('>4sH', magic, len(version_binary)), version_binary
+        ]
+
+        for schema_version, content in schema_versions:
+            parts.append(struct.pack('>IH', schema_version, 0))
+            parts.append(struct.pack('>Q', len(content)))
+            parts.append(content)
+
+        return b''.join(parts)
+
+    def test_multiple_schema_versions_succeed(self):
+        binary = self._build_content(self.VERSION, [(1, b'1'), (2, b'22')])
+
+        content = service.BinaryDatabaseUpdateContent([binary])
+
+        assert content.version == self.VERSION
+        assert content.schema_versions == [
+            service.SchemaVersionContent(schema_version=1, content=b'1'),
+            service.SchemaVersionContent(schema_version=2, content=b'22')
+        ]
+
+    def test_delta_succeeds(self):
+        base_version = '1' * 40
+        digest = bytes(range(32))
+        binary = self._build_content(self.VERSION, []) + b''.join([
+            struct.pack('>IH', 1, len(base_version)),
+            base_version.encode('utf-8'),
+            digest,
+            struct.pack('>Q', 4),
+            b'BTPD'
+        ])
+
+        content = service.BinaryDatabaseUpdateContent([binary])
+
+        assert content.schema_versions == [
+            service.SchemaVersionDelta(
+                schema_version=1, base_version=base_version,
+                digest=digest.hex(), delta=b'BTPD'
+            )
+        ]
+
+    def test_chunked_content_succeeds(self):
+        content = bytes(range(256)) * 4
+        binary = self._build_content(self.VERSION, [(1, content)])
+
+        update_content = service.BinaryDatabaseUpdateContent(
+            service.ContentChunks(7).split(binary)
+        )
+
+        assert update_content.schema_versions[0].content == content
+
+    def test_invalid_magic_fails(self):
+        binary = self._build_content(self.VERSION, [(1, b'1')], b'BTPD')
+
+        with pytest.raises(service.InvalidUpdateContentError) as ex_info:
+            service.BinaryDatabaseUpdateContent([binary])
+        assert 'Invalid content binary' in str(ex_info)
+
+    def test_truncated_content_fails(self):
+        binary = self._build_content(self.VERSION, [(1, b'12345')])
+
+        with pytest.raises(service.InvalidUpdateContentError) as ex_info:
+            service.BinaryDatabaseUpdateContent([binary[:-1]])
+        assert 'Invalid content binary' in str(ex_info)
+
+    def test_invalid_version_fails(self):
+        binary = self._build_content('1', [(1, b'1')])
+
+        with pytest.raises(service.InvalidUpdateContentError) as ex_info:
+            service.BinaryDatabaseUpdateContent([binary])
+        assert 'Version length is not 40 characters' in str(ex_info)
+
+    def test_empty_content_fails(self):
+        binary = self._build_content(self.VERSION, [(1, b'')])
+
+        with pytest.raises(service.InvalidUpdateContentError) as ex_info:
+            service.BinaryDatabaseUpdateContent([binary])
+        assert 'Content is empty' in str(ex_info)
+
 
 class TestApplyUpdate(BaseDbAwareTest):
     HASH_SIZE = 40
@@ -301,12 +1053,12 @@ class TestApplyUpdate(BaseDbAwareTest):
             db.Database(
                 version=self._make_version(1),
                 schema_version=1,
-                content=self._make_content(1)
+                blob=db.Blob(content=self._make_content(1))
             ),
             db.Database(
                 version=self._make_version(1),
                 schema_version=2,
-                content=self._make_content(2)
+                blob=db.Blob(content=self._make_content(2))
             ),
         ]
 
@@ -352,7 +1104,8 @@ class TestApplyUpdate(BaseDbAwareTest):
         return (
             stored.version == expected.version and
             stored.schema_version == expected.schema_version and
-            stored.content == expected.content
+            stored.blob.content == expected.blob.content and
+            stored.digest == service.Sha256().make_hash(expected.blob.content)
         )
 
     def test_non_intersecting_db_update_succeeds(self):
@@ -360,12 +1113,12 @@ class TestApplyUpdate(BaseDbAwareTest):
             db.Database(
                 version=self._make_version(1),
                 schema_version=1,
-                content=self._make_content(1)
+                blob=db.Blob(content=self._make_content(1))
             ),
             db.Database(
                 version=self._make_version(2),
                 schema_version=2,
-                content=self._make_content(2)
+                blob=db.Blob(content=self._make_content(2))
             )
         ]
         self.init_database(existing_databases)
@@ -389,22 +1142,22 @@ class TestApplyUpdate(BaseDbAwareTest):
             db.Database(
                 version=self._make_version(1),
                 schema_version=1,
-                content=self._make_content(1)
+                blob=db.Blob(content=self._make_content(1))
             ),
             db.Database(
                 version=self._make_version(2),
                 schema_version=2,
-                content=self._make_content(2)
+                blob=db.Blob(content=self._make_content(2))
             ),
             db.Database(
                 version=self._make_version(3),
                 schema_version=3,
-                content=self._make_content(3)
+                blob=db.Blob(content=self._make_content(3))
             ),
             db.Database(
                 version=self._make_version(3),
                 schema_version=4,
-                content=self._make_content(4)
+                blob=db.Blob(content=self._make_content(4))
             ),
         ]
 
@@ -415,12 +1168,12 @@ class TestApplyUpdate(BaseDbAwareTest):
             db.Database(
                 version=self._make_version(1),
                 schema_version=1,
-                content=self._make_content(1)
+                blob=db.Blob(content=self._make_content(1))
             ),
             db.Database(
                 version=self._make_version(2),
                 schema_version=2,
-                content=self._make_content(2)
+                blob=db.Blob(content=self._make_content(2))
             )
         ]
         self.init_database(existing_databases)
@@ -444,75 +1197,624 @@ class TestApplyUpdate(BaseDbAwareTest):
             db.Database(
                 version=self._make_version(1),
                 schema_version=1,
-                content=self._make_content(1)
+                blob=db.Blob(content=self._make_content(1))
             ),
             db.Database(
                 version=self._make_version(3),
                 schema_version=2,
-                content=self._make_content(4)
+                blob=db.Blob(content=self._make_content(4))
             ),
             db.Database(
                 version=self._make_version(3),
                 schema_version=3,
-                content=self._make_content(6)
+                blob=db.Blob(content=self._make_content(6))
             )
         ]
 
         self._assert_databases(expected_databases)
 
+    def test_update_builds_compressed_variants(self):
+        self.init_database([])
+        content = b'0' * 1024
 
-KeyPair = collections.namedtuple('KeyPair', 'private, public')
+        content_dict = dict(
+            version=self._make_version(1),
+            schema_versions=[
+                dict(
+                    schema_version=1,
+                    content=service.Base64.binary_to_base64_str(content)
+                )
+            ]
+        )
+        self._apply_update(content_dict)
 
+        gzip_content = service.DatabaseQuery().get_content(1, ['gzip'])
+        assert gzip_content.info.encoding == 'gzip'
+        assert gzip.decompress(b''.join(gzip_content.chunks)) == content
 
-class PublicKeySshCodec:
-    BITS_PER_UINT = 32
-    BITS_PER_BYTE = 8
-    SSH_RSA_HEADER = b'ssh-rsa'
+    def test_update_runs_encoding_and_deltas_as_cpu_work(self,
+                                                         monkeypatch):
+        self.init_database([])
+        functions = []
 
-    def encode(self, public_key):
-        public_numbers = public_key.public_numbers()
+        def run(function, *args):
+            functions.append(function.__name__)
+            return function(*args)
 
-        sections = [
-            self.SSH_RSA_HEADER,
-            self._multi_precision_int_to_bytes(public_numbers.e),
-            self._multi_precision_int_to_bytes(public_numbers.n)
-        ]
+        monkeypatch.setattr(service.CpuWork, 'run', run)
+        self._apply_single_update(1, b'0' * 8192)
+        self._apply_single_update(2, b'0' * 4096 + b'1' * 4096)
 
-        binary_keystring = b''.join(
-            [self._get_len_prefix(x) + x for x in sections]
-        )
+        assert '_encode' in functions
+        assert 'make' in functions
 
-        return self.SSH_RSA_HEADER + b' ' + base64.b64encode(binary_keystring)
+    def test_update_skips_incompressible_variants(self):
+        self.init_database([])
 
-    def _multi_precision_int_to_bytes(self, int_value):
-        sequence = self._int_to_bytes(int_value, int_value.bit_length())
+        content_dict = dict(
+            version=self._make_version(1),
+            schema_versions=[
+                dict(
+                    schema_version=1,
+                    content=self._make_base64_content(1)
+                )
+            ]
+        )
+        self._apply_update(content_dict)
 
-        # If the leftmost bit of the first byte is 1 than it means encoded
-        # integer is negative. When leftmost bit of the first byte happens
-        # to be set for a positive integer, a zero byte should be prepended
-        # to the sequence.
-        #
-        # See section Data Type Representations Used in the SSH Protocols
-        # in RFC 4251 for more information
-        first_bit_char = 0b1000000
-        zero_char = 0b00000000
-        if sequence[0] & first_bit_char:
-            sequence = (
-                self._int_to_bytes(zero_char, self.BITS_PER_UINT) + sequence
-            )
+        with db.Session() as session:
+            assert session.query(db.DatabaseVariant).count() == 0
 
-        return sequence
+    def test_identical_content_is_stored_once(self):
+        self.init_database([])
+        content = service.Base64.binary_to_base64_str(b'0' * 1024)
 
-    def _int_to_bytes(self, int_value, bit_len):
-        if not bit_len:
-            bit_len = int_value.bit_length()
+        content_dict = dict(
+            version=self._make_version(1),
+            schema_versions=[
+                dict(schema_version=1, content=content),
+                dict(schema_version=2, content=content)
+            ]
+        )
+        self._apply_update(content_dict)
 
-        mod = bit_len % self.BITS_PER_BYTE
-        if mod > 0:
-            bit_len += self.BITS_PER_BYTE - mod
+        with db.Session() as session:
+            variant_count = session.query(db.DatabaseVariant).count()
 
-        byte_len = int(bit_len / self.BITS_PER_BYTE)
-        return int_value.to_bytes(byte_len, byteorder='big')
+            assert variant_count == 2 * len(
+                service.ContentEncoders().get_available()
+            )
+            assert session.query(db.Blob).count() == 1 + variant_count // 2
+
+    def test_unchanged_content_update_keeps_blobs(self):
+        self.init_database([])
+        self._apply_single_update(1, b'0' * 1024)
+        with db.Session() as session:
+            blob_ids = sorted(x.id for x in session.query(db.Blob.id))
+
+        self._apply_single_update(2, b'0' * 1024)
+
+        with db.Session() as session:
+            assert sorted(
+                x.id for x in session.query(db.Blob.id)
+            ) == blob_ids
+            assert session.query(db.DatabaseRevision).count() == 0
+            assert session.query(db.Database.version).scalar() == (
+                self._make_version(2)
+            )
+
+    def test_update_keeps_released_blobs_for_grace_period(self, monkeypatch):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'revision_count', property(lambda x: 0)
+        )
+        self._apply_single_update(1, b'0' * 1024)
+        self._apply_single_update(2, b'1' * 1024)
+
+        with db.Session() as session:
+            assert session.query(db.DatabaseRevision).count() == 0
+            released_blob = session.query(db.Blob).filter(
+                db.Blob.digest == service.Sha256().make_hash(b'0' * 1024)
+            ).one()
+            assert released_blob.released_at is not None
+            assert session.query(db.Blob).filter(
+                db.Blob.released_at.is_(None)
+            ).count() == 1 + session.query(db.DatabaseVariant).count()
+
+    def test_update_removes_blobs_after_grace_period(self, monkeypatch):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'revision_count', property(lambda x: 0)
+        )
+        # Grace period of a release is over as soon as it starts
+        monkeypatch.setattr(
+            service.DatabaseUpdate, 'RELEASED_BLOB_GRACE_PERIOD',
+            datetime.timedelta(seconds=-1)
+        )
+        self._apply_single_update(1, b'0' * 1024)
+        self._apply_single_update(2, b'1' * 1024)
+
+        with db.Session() as session:
+            assert session.query(db.Blob).filter(
+                db.Blob.digest == service.Sha256().make_hash(b'0' * 1024)
+            ).count() == 0
+            assert session.query(db.Blob).count() == (
+                1 + session.query(db.DatabaseVariant).count()
+            )
+
+    def test_republished_content_is_no_longer_released(self, monkeypatch):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'revision_count', property(lambda x: 0)
+        )
+        self._apply_single_update(1, b'0' * 1024)
+        self._apply_single_update(2, b'1' * 1024)
+        self._apply_single_update(3, b'0' * 1024)
+
+        with db.Session() as session:
+            assert session.query(db.Blob.released_at).filter(
+                db.Blob.digest == service.Sha256().make_hash(b'0' * 1024)
+            ).scalar() is None
+
+    def test_update_keeps_content_of_download_in_flight(self, monkeypatch):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'revision_count', property(lambda x: 0)
+        )
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 256)
+        self._apply_single_update(1, b'0' * 1024)
+
+        query = service.DatabaseQuery()
+        info = query.get_info(1)
+        chunks = iter(query.iterate_content(info))
+        first_chunk = next(chunks)
+
+        self._apply_single_update(2, b'1' * 1024)
+
+        assert first_chunk + b''.join(chunks) == b'0' * 1024
+
+    def test_update_keeps_replaced_revision(self):
+        self.init_database([])
+        self._apply_single_update(1, b'0' * 8192)
+        self._apply_single_update(2, b'0' * 4096 + b'1' * 4096)
+
+        with db.Session() as session:
+            revisions = session.query(db.DatabaseRevision).all()
+
+            assert len(revisions) == 1
+            assert revisions[0].version == self._make_version(1)
+            assert revisions[0].blob.content == b'0' * 8192
+
+    def _apply_single_update(self, version_index, content):
+        content_dict = dict(
+            version=self._make_version(version_index),
+            schema_versions=[
+                dict(
+                    schema_version=1,
+                    content=service.Base64.binary_to_base64_str(content)
+                )
+            ]
+        )
+        self._apply_update(content_dict)
+
+    def test_update_prunes_old_revisions(self):
+        self.init_database([])
+        revision_count = config.Config.get().revision_count
+
+        for i in range(1, revision_count + 3):
+            self._apply_single_update(i, str(i).encode() * 8192)
+
+        with db.Session() as session:
+            revisions = session.query(db.DatabaseRevision).all()
+
+            assert len(revisions) == revision_count
+            assert self._make_version(1) not in [x.version for x in revisions]
+
+    def test_update_builds_deltas_from_revisions(self):
+        self.init_database([])
+        first_content = b'0' * 8192
+        second_content = b'0' * 4096 + b'1' * 4096
+        self._apply_single_update(1, first_content)
+        self._apply_single_update(2, second_content)
+
+        query = service.DatabaseQuery()
+        delta_content = query.find_delta(
+            query.get_info(1), self._make_version(1)
+        )
+
+        assert len(delta_content) < len(second_content)
+        assert delta.PageDelta().apply(
+            first_content, delta_content
+        ) == second_content
+
+    def _apply_delta_update(self, version_index, base_version_index,
+                            delta_content, content):
+        content_dict = dict(
+            version=self._make_version(version_index),
+            schema_versions=[
+                dict(
+                    schema_version=1,
+                    base_version=self._make_version(base_version_index),
+                    digest=service.Sha256().make_hash(content),
+                    delta=service.Base64.binary_to_base64_str(delta_content)
+                )
+            ]
+        )
+        self._apply_update(content_dict)
+
+    def test_delta_update_succeeds(self):
+        self.init_database([])
+        first_content = b'0' * 8192
+        second_content = b'0' * 4096 + b'1' * 4096
+        self._apply_single_update(1, first_content)
+
+        self._apply_delta_update(
+            2, 1, delta.PageDelta().make(first_content, second_content),
+            second_content
+        )
+
+        self._assert_databases([
+            db.Database(
+                version=self._make_version(2),
+                schema_version=1,
+                blob=db.Blob(content=second_content)
+            )
+        ])
+
+    def test_delta_update_of_outdated_version_fails(self):
+        self.init_database([])
+        first_content = b'0' * 8192
+        second_content = b'0' * 4096 + b'1' * 4096
+        self._apply_single_update(1, first_content)
+        self._apply_single_update(2, first_content)
+
+        with pytest.raises(service.OutdatedBaseVersionError):
+            self._apply_delta_update(
+                3, 1, delta.PageDelta().make(first_content, second_content),
+                second_content
+            )
+
+    def test_update_locks_existing_databases(self):
+        self.init_database([])
+        locked_queries = []
+
+        def on_before_compile(query):
+            if query._for_update_arg is not None:
+                locked_queries.append(query.column_descriptions[0]['type'])
+
+        sa.event.listen(orm.Query, 'before_compile', on_before_compile)
+        try:
+            self._apply_single_update(1, b'0' * 8192)
+        finally:
+            sa.event.remove(orm.Query, 'before_compile', on_before_compile)
+
+        assert locked_queries == [db.Database]
+
+    def test_delta_update_of_missing_schema_version_fails(self):
+        self.init_database([])
+        content = b'0' * 8192
+
+        with pytest.raises(service.OutdatedBaseVersionError):
+            self._apply_delta_update(
+                1, 1, delta.PageDelta().make(b'', content), content
+            )
+
+    def test_delta_update_with_wrong_digest_fails(self):
+        self.init_database([])
+        first_content = b'0' * 8192
+        second_content = b'0' * 4096 + b'1' * 4096
+        self._apply_single_update(1, first_content)
+
+        with pytest.raises(service.InvalidUpdateContentError) as ex_info:
+            self._apply_delta_update(
+                2, 1, delta.PageDelta().make(first_content, second_content),
+                first_content
+            )
+        assert 'Delta result does not match its digest' in str(ex_info)
+
+    def test_invalid_delta_update_fails(self):
+        self.init_database([])
+        content = b'0' * 8192
+        self._apply_single_update(1, content)
+
+        with pytest.raises(service.InvalidUpdateContentError) as ex_info:
+            self._apply_delta_update(2, 1, b'BTPD', content)
+        assert 'Delta header is truncated' in str(ex_info)
+
+    def test_get_info_of_replaced_version_reads_revision(self):
+        self.init_database([])
+        first_content = b'0' * 8192
+        self._apply_single_update(1, first_content)
+        self._apply_single_update(2, b'1' * 8192)
+
+        query = service.DatabaseQuery()
+        info = query.get_info(1, ['gzip'], self._make_version(1))
+
+        assert info.version == self._make_version(1)
+        assert info.digest == service.Sha256().make_hash(first_content)
+        assert info.size == len(first_content)
+        assert info.encoding == service.ContentEncoder.IDENTITY_ENCODING
+        assert b''.join(query.iterate_content(info)) == first_content
+
+    def test_get_info_of_current_version_succeeds(self):
+        self.init_database([])
+        self._apply_single_update(1, b'0' * 8192)
+
+        info = service.DatabaseQuery().get_info(
+            1, ['gzip'], self._make_version(1)
+        )
+
+        assert info.version == self._make_version(1)
+        assert info.encoding == 'gzip'
+
+    def test_get_info_of_unknown_version_fails(self):
+        self.init_database([])
+        self._apply_single_update(1, b'0' * 8192)
+
+        with pytest.raises(service.NoDatabaseFound):
+            service.DatabaseQuery().get_info(1, (), self._make_version(2))
+
+    def test_unknown_delta_yields_none(self):
+        self.init_database([])
+        self._apply_single_update(1, b'0' * 8192)
+
+        query = service.DatabaseQuery()
+        assert query.find_delta(
+            query.get_info(1), self._make_version(2)
+        ) is None
+
+    def test_update_invalidates_cached_content(self):
+        existing_databases = [
+            db.Database(
+                version=self._make_version(1),
+                schema_version=1,
+                blob=db.Blob(content=self._make_content(1))
+            )
+        ]
+        self.init_database(existing_databases)
+        b''.join(service.DatabaseQuery().get_content(1).chunks)
+
+        content_dict = dict(
+            version=self._make_version(1),
+            schema_versions=[
+                dict(
+                    schema_version=1,
+                    content=self._make_base64_content(2)
+                )
+            ]
+        )
+        self._apply_update(content_dict)
+
+        content = service.DatabaseQuery().get_content(1)
+        assert b''.join(content.chunks) == self._make_content(2)
+        assert content.info.digest == service.Sha256().make_hash(
+            self._make_content(2)
+        )
+
+    def test_failed_garbage_collection_keeps_update(self, monkeypatch,
+                                                    temp_dir):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'blob_dir', property(lambda x: temp_dir)
+        )
+
+        def fail_collection(*args):
+            raise FileNotFoundError()
+
+        monkeypatch.setattr(
+            storage.FileBlobStore, 'collect_garbage', fail_collection
+        )
+        self._apply_single_update(1, b'0' * 8192)
+
+        assert b''.join(
+            service.DatabaseQuery().get_content(1).chunks
+        ) == b'0' * 8192
+
+    def test_update_with_blob_store_keeps_content_in_files(
+        self, monkeypatch, temp_dir
+    ):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'blob_dir', property(lambda x: temp_dir)
+        )
+        content = b'0' * 8192
+        self._apply_single_update(1, content)
+
+        with db.Session() as session:
+            assert session.query(db.Blob).count() > 0
+            assert session.query(db.Blob).filter(
+                db.Blob.content.isnot(None)
+            ).count() == 0
+
+        query = service.DatabaseQuery()
+        info = query.get_info(1, ['gzip'])
+
+        blob = query.find_content_blob(info)
+        blob.file.close()
+        assert blob.path.startswith(temp_dir)
+        assert b''.join(query.get_content(1).chunks) == content
+        assert gzip.decompress(
+            b''.join(query.iterate_content(info))
+        ) == content
+        slices = query.open_content_slices(query.get_info(1))
+        assert list(slices.iterate_range(0, 2)) == [b'00']
+        assert list(slices.iterate_range(8190, 8192)) == [b'00']
+        slices.close()
+
+    def test_content_blob_is_readable_once_found(self, monkeypatch,
+                                                 temp_dir):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'blob_dir', property(lambda x: temp_dir)
+        )
+        self._apply_single_update(1, b'0' * 8192)
+        query = service.DatabaseQuery()
+        info = query.get_info(1)
+
+        blob = query.find_content_blob(info)
+        os.unlink(blob.path)
+
+        with blob.file:
+            assert blob.file.read() == b'0' * 8192
+
+    def test_collected_content_blob_is_not_found(self, monkeypatch,
+                                                 temp_dir):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'blob_dir', property(lambda x: temp_dir)
+        )
+        self._apply_single_update(1, b'0' * 8192)
+        query = service.DatabaseQuery()
+        info = query.get_info(1)
+        store = storage.BlobStore.get()
+        os.unlink(store.get_path(info.encoded_digest))
+        # File is collected right after it is found
+        monkeypatch.setattr(store, 'exists', lambda digest: True)
+
+        assert query.find_content_blob(info) is None
+
+    def test_content_is_decoded_into_blob_store(self, monkeypatch,
+                                                temp_dir):
+        monkeypatch.setattr(
+            SqliteDbConfig, 'blob_dir', property(lambda x: temp_dir)
+        )
+        content = b'0' * 8192
+
+        update_content = service.DatabaseUpdateContent(json.dumps(dict(
+            version=self._make_version(1),
+            schema_versions=[dict(
+                schema_version=1,
+                content=service.Base64.binary_to_base64_str(content)
+            )]
+        )))
+        stored_content = update_content.schema_versions[0].content
+
+        assert isinstance(stored_content, service.StoredContent)
+        assert stored_content.size == len(content)
+        assert stored_content.digest == service.Sha256().make_hash(content)
+        assert stored_content.read() == content
+        assert not storage.BlobStore.get().exists(stored_content.digest)
+
+        update_content.discard()
+
+        assert os.listdir(temp_dir) == []
+
+    def test_update_with_blob_store_leaves_no_temp_files(self, monkeypatch,
+                                                         temp_dir):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'blob_dir', property(lambda x: temp_dir)
+        )
+        self._apply_single_update(1, b'0' * 8192)
+        self._apply_single_update(2, b'0' * 4096 + b'1' * 4096)
+        self._apply_single_update(3, b'0' * 8192)
+
+        file_names = [
+            x for _, _, file_names in os.walk(temp_dir) for x in file_names
+        ]
+        with db.Session() as session:
+            digests = set(x.digest for x in session.query(db.Blob.digest))
+
+        assert file_names
+        assert set(file_names) <= digests
+
+    def test_binary_update_with_blob_store_succeeds(self, monkeypatch,
+                                                    temp_dir):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'blob_dir', property(lambda x: temp_dir)
+        )
+        version = self._make_version(1).encode('ascii')
+        content = b'0' * 8192
+        binary = b''.join([
+            struct.pack('>4sH', b'BTPU', len(version)), version,
+            struct.pack('>IHQ', 1, 0, len(content)), content
+        ])
+
+        service.DatabaseUpdate().apply_update(
+            service.BinaryDatabaseUpdateContent(
+                service.ContentChunks(1000).split(binary)
+            )
+        )
+
+        assert b''.join(
+            service.DatabaseQuery().get_content(1).chunks
+        ) == content
+
+    def test_update_with_blob_store_builds_deltas_from_files(
+        self, monkeypatch, temp_dir
+    ):
+        self.init_database([])
+        monkeypatch.setattr(
+            SqliteDbConfig, 'blob_dir', property(lambda x: temp_dir)
+        )
+        first_content = b'0' * 8192
+        second_content = b'0' * 4096 + b'1' * 4096
+        self._apply_single_update(1, first_content)
+        self._apply_single_update(2, second_content)
+
+        query = service.DatabaseQuery()
+        delta_content = query.find_delta(
+            query.get_info(1), self._make_version(1)
+        )
+
+        assert delta.PageDelta().apply(
+            first_content, delta_content
+        ) == second_content
+
+
+KeyPair = collections.namedtuple('KeyPair', 'private, public')
+
+
+class PublicKeySshCodec:
+    BITS_PER_UINT = 32
+    BITS_PER_BYTE = 8
+    SSH_RSA_HEADER = b'ssh-rsa'
+
+    def encode(self, public_key):
+        public_numbers = public_key.public_numbers()
+
+        sections = [
+            self.SSH_RSA_HEADER,
+            self._multi_precision_int_to_bytes(public_numbers.e),
+            self._multi_precision_int_to_bytes(public_numbers.n)
+        ]
+
+        binary_keystring = b''.join(
+            [self._get_len_prefix(x) + x for x in sections]
+        )
+
+        return self.SSH_RSA_HEADER + b' ' + base64.b64encode(binary_keystring)
+
+    def _multi_precision_int_to_bytes(self, int_value):
+        sequence = self._int_to_bytes(int_value, int_value.bit_length())
+
+        # If the leftmost bit of the first byte is 1 than it means encoded
+        # integer is negative. When leftmost bit of the first byte happens
+        # to be set for a positive integer, a zero byte should be prepended
+        # to the sequence.
+        #
+        # See section Data Type Representations Used in the SSH Protocols
+        # in RFC 4251 for more information
+        first_bit_char = 0b1000000
+        zero_char = 0b00000000
+        if sequence[0] & first_bit_char:
+            sequence = (
+                self._int_to_bytes(zero_char, self.BITS_PER_UINT) + sequence
+            )
+
+        return sequence
+
+    def _int_to_bytes(self, int_value, bit_len):
+        if not bit_len:
+            bit_len = int_value.bit_length()
+
+        mod = bit_len % self.BITS_PER_BYTE
+        if mod > 0:
+            bit_len += self.BITS_PER_BYTE - mod
+
+        byte_len = int(bit_len / self.BITS_PER_BYTE)
+        return int_value.to_bytes(byte_len, byteorder='big')
 
     def _get_len_prefix(self, byte_sequence):
         return self._int_to_bytes(len(byte_sequence), self.BITS_PER_UINT)
@@ -523,9 +1825,30 @@ class TestSignatureVerifier:
     PUBLIC_EXPONENT = 65537
     KEY_SIZE = 2048
 
+    # Public key binary in OpenSSH format and its fingerprint reported
+    # by ssh-keygen
+    PREDEFINED_PUBLIC_KEY_BINARY = (
+        b'\x73\x73\x68\x2d\x72\x73\x61\x20\x41\x41\x41\x41\x42\x33\x4e\x7a'
+        b'\x61\x43\x31\x79\x63\x32\x45\x41\x41\x41\x41\x44\x41\x51\x41\x42'
+        b'\x41\x41\x41\x41\x67\x51\x43\x61\x72\x55\x65\x5a\x69\x6f\x72\x6f'
+        b'\x33\x53\x78\x47\x70\x77\x59\x2f\x45\x75\x2b\x55\x2b\x33\x53\x68'
+        b'\x31\x31\x39\x39\x64\x4b\x49\x49\x36\x54\x61\x51\x78\x73\x32\x64'
+        b'\x61\x54\x67\x34\x39\x6b\x76\x58\x39\x73\x53\x57\x73\x50\x5a\x76'
+        b'\x73\x74\x4d\x50\x35\x36\x2f\x64\x6b\x70\x5a\x53\x30\x2f\x7a\x30'
+        b'\x4c\x76\x53\x68\x73\x69\x38\x53\x51\x38\x2b\x35\x66\x58\x32\x6c'
+        b'\x78\x45\x53\x6f\x78\x5a\x72\x6a\x74\x4b\x77\x35\x34\x34\x36\x6e'
+        b'\x6c\x78\x4f\x54\x73\x2b\x46\x58\x6c\x4e\x35\x39\x45\x43\x5a\x37'
+        b'\x6c\x51\x4c\x50\x46\x4a\x7a\x4b\x76\x46\x47\x4f\x62\x65\x46\x6a'
+        b'\x36\x4f\x38\x5a\x41\x55\x47\x77\x73\x63\x6a\x38\x64\x42\x65\x49'
+        b'\x79\x36\x79\x63\x63\x64\x53\x4a\x63\x46\x66\x35\x32\x35\x4c\x31'
+        b'\x73\x77\x3d\x3d'
+    )
+    PREDEFINED_PUBLIC_KEY_FINGERPRINT = (
+        'SHA256:BrWhZTcE+Wl3VQG/4hLzUwW1FOdOfsHKjObLF88sv2Y'
+    )
+
     def test_predefined_signature(self):
-        # Externally (via Java) precalculated signature and corresponding
-        # public key binary in OpenSSH format
+        # Externally (via Java) precalculated signature
         signature = (
             b'\x46\xfc\x45\x23\x9f\x52\x76\xeb\xca\xf8\xf4\xbc\x0c\xb7\xf3\xa1'
             b'\xfa\xe2\xc2\xe9\xb6\xe2\x4c\x77\x12\xd6\x37\xe6\xb1\x35\xd4\x2a'
@@ -536,28 +1859,19 @@ class TestSignatureVerifier:
             b'\xd0\x97\x64\xc4\x9b\xa6\x00\x51\x69\x81\x05\x60\xad\xfe\x8d\x4b'
             b'\x2e\xf8\x5e\xa9\x65\x5f\xb7\x38\x76\xba\xf7\xbc\x6b\xa9\x1c\xb7'
         )
-        public_key_binary = (
-            b'\x73\x73\x68\x2d\x72\x73\x61\x20\x41\x41\x41\x41\x42\x33\x4e\x7a'
-            b'\x61\x43\x31\x79\x63\x32\x45\x41\x41\x41\x41\x44\x41\x51\x41\x42'
-            b'\x41\x41\x41\x41\x67\x51\x43\x61\x72\x55\x65\x5a\x69\x6f\x72\x6f'
-            b'\x33\x53\x78\x47\x70\x77\x59\x2f\x45\x75\x2b\x55\x2b\x33\x53\x68'
-            b'\x31\x31\x39\x39\x64\x4b\x49\x49\x36\x54\x61\x51\x78\x73\x32\x64'
-            b'\x61\x54\x67\x34\x39\x6b\x76\x58\x39\x73\x53\x57\x73\x50\x5a\x76'
-            b'\x73\x74\x4d\x50\x35\x36\x2f\x64\x6b\x70\x5a\x53\x30\x2f\x7a\x30'
-            b'\x4c\x76\x53\x68\x73\x69\x38\x53\x51\x38\x2b\x35\x66\x58\x32\x6c'
-            b'\x78\x45\x53\x6f\x78\x5a\x72\x6a\x74\x4b\x77\x35\x34\x34\x36\x6e'
-            b'\x6c\x78\x4f\x54\x73\x2b\x46\x58\x6c\x4e\x35\x39\x45\x43\x5a\x37'
-            b'\x6c\x51\x4c\x50\x46\x4a\x7a\x4b\x76\x46\x47\x4f\x62\x65\x46\x6a'
-            b'\x36\x4f\x38\x5a\x41\x55\x47\x77\x73\x63\x6a\x38\x64\x42\x65\x49'
-            b'\x79\x36\x79\x63\x63\x64\x53\x4a\x63\x46\x66\x35\x32\x35\x4c\x31'
-            b'\x73\x77\x3d\x3d'
-        )
         text = 'Hello world'
 
         assert service.SignatureVerifier().verify(
-            [public_key_binary], text, signature
+            [self.PREDEFINED_PUBLIC_KEY_BINARY], text, signature
         )
 
+    def test_predefined_key_fingerprint(self):
+        public_key = service.PublicKeyLoader().load(
+            self.PREDEFINED_PUBLIC_KEY_BINARY
+        )
+
+        assert public_key.fingerprint == self.PREDEFINED_PUBLIC_KEY_FINGERPRINT
+
     def test_single_key_succeeds(self):
         key = self._make_key_pair()
         text = 'lorem ipsum'
@@ -631,9 +1945,319 @@ class TestSignatureVerifier:
         )
 
 
+class DirectoryKeyConfig(config.Config):
+    def __init__(self, directory):
+        self._directory = directory
+
+    @property
+    def db_url(self):
+        return None
+
+    @property
+    def key_binaries(self):
+        return self.key_source.get_key_binaries()
+
+    @property
+    def key_source(self):
+        return config.DirectoryKeyBinarySource(self._directory)
+
+
+class BaseKeyAwareTest:
+    PUBLIC_EXPONENT = 65537
+    KEY_SIZE = 2048
+
+    def _write_key(self, directory, name):
+        private_key = crypto_rsa.generate_private_key(
+            self.PUBLIC_EXPONENT, self.KEY_SIZE, crypto_backend()
+        )
+
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(private_key.public_key().public_bytes(
+                crypto_serial.Encoding.OpenSSH,
+                crypto_serial.PublicFormat.OpenSSH
+            ))
+
+        return private_key
+
+
+class TestKeyRing(BaseKeyAwareTest):
+    def test_keys_are_loaded_once(self, monkeypatch, temp_dir):
+        self._write_key(temp_dir, 'first.pub')
+        monkeypatch.setattr(
+            config.Config, '_config', DirectoryKeyConfig(temp_dir)
+        )
+
+        key_ring = service.KeyRing.get()
+
+        assert service.KeyRing.get() is key_ring
+        assert len(key_ring.public_keys) == 1
+
+    def test_keys_are_reloaded_on_change(self, monkeypatch, temp_dir):
+        self._write_key(temp_dir, 'first.pub')
+        monkeypatch.setattr(
+            config.Config, '_config', DirectoryKeyConfig(temp_dir)
+        )
+        key_ring = service.KeyRing.get()
+
+        self._write_key(temp_dir, 'second.pub')
+        # Make sure directory mtime differs on coarse file systems
+        os.utime(temp_dir, ns=(0, 0))
+
+        assert service.KeyRing.get() is not key_ring
+        assert len(service.KeyRing.get().public_keys) == 2
+
+    def test_invalid_key_is_skipped(self, monkeypatch, temp_dir):
+        self._write_key(temp_dir, 'first.pub')
+        with open(os.path.join(temp_dir, 'invalid.pub'), 'wb') as f:
+            f.write(b'ssh-rsa invalid')
+        monkeypatch.setattr(
+            config.Config, '_config', DirectoryKeyConfig(temp_dir)
+        )
+
+        assert len(service.KeyRing.get().public_keys) == 1
+
+    def test_key_is_found_by_fingerprint(self, monkeypatch, temp_dir):
+        private_key = self._write_key(temp_dir, 'first.pub')
+        self._write_key(temp_dir, 'second.pub')
+        monkeypatch.setattr(
+            config.Config, '_config', DirectoryKeyConfig(temp_dir)
+        )
+        fingerprint = service.PublicKeyLoader().make_fingerprint(
+            private_key.public_key()
+        )
+
+        public_key = service.KeyRing.get().find(fingerprint)
+
+        assert public_key.fingerprint == fingerprint
+        assert service.KeyRing.get().find('SHA256:unknown') is None
+
+
+class TestDatabaseUpdate(BaseKeyAwareTest):
+    UTF8_ENCODING = 'utf-8'
+    CONTENT_JSON = '''
+    {
+        "version": "0000000000000000000000000000000000000000",
+        "schema_versions": [{"schema_version": 1, "content": "MQ=="}]
+    }
+    '''
+
+    def _init_keys(self, monkeypatch, temp_dir):
+        private_keys = [
+            self._write_key(temp_dir, x)
+            for x in ['first.pub', 'second.pub']
+        ]
+        monkeypatch.setattr(
+            config.Config, '_config', DirectoryKeyConfig(temp_dir)
+        )
+
+        return private_keys
+
+    def _sign(self, private_key):
+        signature = private_key.sign(
+            self.CONTENT_JSON.encode(self.UTF8_ENCODING),
+            crypto_padding.PKCS1v15(),
+            crypto_hashes.SHA512()
+        )
+
+        return base64.b64encode(signature).decode(self.UTF8_ENCODING)
+
+    def _get_chunks(self, chunk_size=None):
+        return list(service.ContentChunks(chunk_size).split(
+            self.CONTENT_JSON.encode(self.UTF8_ENCODING)
+        ))
+
+    def _make_key_id(self, private_key):
+        return service.PublicKeyLoader().make_fingerprint(
+            private_key.public_key()
+        )
+
+    def test_signature_without_key_id_succeeds(self, monkeypatch, temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+
+        update_content = service.DatabaseUpdate().get_update_content(
+            self._get_chunks(), self._sign(private_keys[1])
+        )
+
+        assert update_content.schema_versions[0].content == b'1'
+
+    def test_signature_with_key_id_succeeds(self, monkeypatch, temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+
+        update_content = service.DatabaseUpdate().get_update_content(
+            self._get_chunks(), self._sign(private_keys[1]),
+            self._make_key_id(private_keys[1])
+        )
+
+        assert update_content.schema_versions[0].content == b'1'
+
+    def test_signature_with_other_key_id_fails(self, monkeypatch, temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+
+        with pytest.raises(service.InvalidSignatureError):
+            service.DatabaseUpdate().get_update_content(
+                self._get_chunks(), self._sign(private_keys[1]),
+                self._make_key_id(private_keys[0])
+            )
+
+    def test_signature_with_unknown_key_id_fails(self, monkeypatch,
+                                                 temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+
+        with pytest.raises(service.InvalidSignatureError):
+            service.DatabaseUpdate().get_update_content(
+                self._get_chunks(), self._sign(private_keys[1]),
+                'SHA256:unknown'
+            )
+
+    def test_small_chunks_succeed(self, monkeypatch, temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+
+        update_content = service.DatabaseUpdate().get_update_content(
+            self._get_chunks(3), self._sign(private_keys[0])
+        )
+
+        assert update_content.schema_versions[0].content == b'1'
+
+    def test_binary_content_succeeds(self, monkeypatch, temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+        version = b'0000000000000000000000000000000000000000'
+        binary = b''.join([
+            struct.pack('>4sH', b'BTPU', len(version)), version,
+            struct.pack('>IHQ', 1, 0, 1), b'1'
+        ])
+        signature = private_keys[0].sign(
+            binary, crypto_padding.PKCS1v15(), crypto_hashes.SHA512()
+        )
+
+        update_content = service.DatabaseUpdate().get_update_content(
+            [binary], base64.b64encode(signature).decode('ascii'),
+            update_content_class=service.BinaryDatabaseUpdateContent
+        )
+
+        assert update_content.schema_versions[0].content == b'1'
+
+    def test_invalid_signature_discards_stored_content(self, monkeypatch,
+                                                       temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+        blob_dir = os.path.join(temp_dir, 'blobs')
+        monkeypatch.setattr(
+            DirectoryKeyConfig, 'blob_dir', property(lambda x: blob_dir)
+        )
+
+        with pytest.raises(service.InvalidSignatureError):
+            service.DatabaseUpdate().get_update_content(
+                self._get_chunks(), self._sign(private_keys[1]),
+                self._make_key_id(private_keys[0])
+            )
+        assert os.listdir(blob_dir) == []
+
+    def test_invalid_content_with_valid_signature_fails(self, monkeypatch,
+                                                        temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+        monkeypatch.setattr(self, 'CONTENT_JSON', '{"version": ')
+
+        with pytest.raises(service.InvalidUpdateContentError):
+            service.DatabaseUpdate().get_update_content(
+                self._get_chunks(), self._sign(private_keys[0])
+            )
+
+    def test_invalid_content_with_invalid_signature_fails(self, monkeypatch,
+                                                          temp_dir):
+        private_keys = self._init_keys(monkeypatch, temp_dir)
+        signature = self._sign(private_keys[0])
+        monkeypatch.setattr(self, 'CONTENT_JSON', '{"version": ')
+
+        with pytest.raises(service.InvalidSignatureError):
+            service.DatabaseUpdate().get_update_content(
+                self._get_chunks(), signature
+            )
+
+
+class TestCpuWork:
+    def test_work_runs_in_place_without_gevent(self, monkeypatch):
+        monkeypatch.setattr(service, 'gevent', None)
+
+        assert service.CpuWork.run(max, 1, 2) == 2
+
+    def test_work_runs_on_hub_threads_under_gevent(self, monkeypatch):
+        applied_calls = []
+
+        class ThreadPool:
+            def apply(self, function, args):
+                applied_calls.append((function, args))
+                return function(*args)
+
+        class Hub:
+            threadpool = ThreadPool()
+
+        class Monkey:
+            def is_module_patched(self, name):
+                return name == 'socket'
+
+        class Gevent:
+            monkey = Monkey()
+
+            def get_hub(self):
+                return Hub()
+
+        monkeypatch.setattr(service, 'gevent', Gevent())
+
+        assert service.CpuWork.run(max, 1, 2) == 2
+        assert applied_calls == [(max, (1, 2))]
+
+
 class TestSha256:
+    EXPECTED = ('5e2bf57d3f40c4b6df69daf1936cb766f832374b4fc0259a7cbff06e2'
+                'f70f269')
+
     def test(self):
         digest = service.Sha256().make_hash(b'lorem ipsum')
-        expected = ('5e2bf57d3f40c4b6df69daf1936cb766f832374b4fc0259a7cbff06e2'
-                    'f70f269')
-        assert digest == expected
+        assert digest == self.EXPECTED
+
+    def test_chunks(self):
+        digest = service.Sha256().make_chunks_hash([b'lorem', b' ipsum'])
+        assert digest == self.EXPECTED
+
+
+class TestContentChunks:
+    def test_split_succeeds(self):
+        chunks = list(service.ContentChunks(4).split(b'0123456789'))
+        assert chunks == [b'0123', b'4567', b'89']
+
+    def test_get_windows_succeeds(self):
+        windows = list(service.ContentChunks(4).get_windows(10))
+        assert windows == [(0, 4), (4, 8), (8, 10)]
+
+
+class TestContentEncoders:
+    CONTENT = b'lorem ipsum ' * 64
+
+    def test_chunks_encode_as_whole(self):
+        chunks = service.ContentChunks(7).split(self.CONTENT)
+        encoded = b''.join(
+            service.GzipContentEncoder().encode_chunks(chunks)
+        )
+        assert gzip.decompress(encoded) == self.CONTENT
+
+    def test_gzip_round_trips(self):
+        encoded = service.GzipContentEncoder().encode(self.CONTENT)
+        assert gzip.decompress(encoded) == self.CONTENT
+
+    def test_brotli_round_trips(self):
+        brotli = pytest.importorskip('brotli')
+
+        encoded = service.BrotliContentEncoder().encode(self.CONTENT)
+        assert brotli.decompress(encoded) == self.CONTENT
+
+    def test_zstd_round_trips(self):
+        zstandard = pytest.importorskip('zstandard')
+
+        encoded = service.ZstdContentEncoder().encode(self.CONTENT)
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        assert decompressor.decompress(encoded) == self.CONTENT
+
+    def test_available_encoders_include_gzip(self):
+        encodings = [
+            x.ENCODING for x in service.ContentEncoders().get_available()
+        ]
+        assert 'gzip' in encodings
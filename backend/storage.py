@@ -0,0 +1,193 @@
+# coding: utf-8
+
+
+import abc
+import os
+import tempfile
+import threading
+import time
+
+from backend import config
+
+
+class BlobStore(abc.ABC):
+    _store = None
+    _store_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        blob_dir = config.Config.get().blob_dir
+        if not blob_dir:
+            return None
+
+        if not cls._store or cls._store.directory != blob_dir:
+            with cls._store_lock:
+                if not cls._store or cls._store.directory != blob_dir:
+                    cls._store = FileBlobStore(blob_dir)
+
+        return cls._store
+
+    @abc.abstractmethod
+    def exists(self, digest):
+        pass
+
+    @abc.abstractmethod
+    def put(self, digest, chunks):
+        pass
+
+    @abc.abstractmethod
+    def create_writer(self):
+        pass
+
+    @abc.abstractmethod
+    def get_size(self, digest):
+        pass
+
+    @abc.abstractmethod
+    def read(self, digest):
+        pass
+
+    @abc.abstractmethod
+    def open(self, digest):
+        pass
+
+    @abc.abstractmethod
+    def iterate(self, digest, chunk_size):
+        pass
+
+    @abc.abstractmethod
+    def collect_garbage(self, referenced_digests):
+        pass
+
+
+class FileBlobStore(BlobStore):
+    READ_BINARY_MODE = 'rb'
+    TEMP_FILE_PREFIX = '.'
+    DIR_PREFIX_LENGTH = 2
+
+    # Files younger than that are never collected, they may belong to
+    # a publication which is not committed yet or be in the middle of
+    # being sent by a front server
+    GARBAGE_GRACE_PERIOD = 60 * 60
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, digest):
+        return os.path.join(self.directory, self.get_relative_path(digest))
+
+    def get_relative_path(self, digest):
+        return os.path.join(digest[:self.DIR_PREFIX_LENGTH], digest)
+
+    def exists(self, digest):
+        return os.path.isfile(self.get_path(digest))
+
+    def put(self, digest, chunks):
+        if self.refresh(digest):
+            return
+
+        writer = self.create_writer()
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except:
+            writer.abort()
+            raise
+
+        writer.commit(digest)
+
+    def create_writer(self):
+        return FileBlobWriter(self)
+
+    def refresh(self, digest):
+        path = self.get_path(digest)
+        if not os.path.isfile(path):
+            return False
+
+        # Refreshed modification time keeps garbage collection away
+        # until the publication referencing the file is committed
+        os.utime(path)
+        return True
+
+    def get_size(self, digest):
+        return os.path.getsize(self.get_path(digest))
+
+    def open(self, digest):
+        return open(self.get_path(digest), mode=self.READ_BINARY_MODE)
+
+    def read(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+    def iterate(self, digest, chunk_size):
+        with self.open(digest) as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+    def collect_garbage(self, referenced_digests):
+        expiration_time = time.time() - self.GARBAGE_GRACE_PERIOD
+
+        for directory, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if file_name in referenced_digests:
+                    continue
+
+                path = os.path.join(directory, file_name)
+                # File may be gone already, collected by another process
+                try:
+                    if os.path.getmtime(path) < expiration_time:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+
+class FileBlobWriter:
+    # Content is written before its digest is known, it appears under
+    # the digest atomically once committed, so that readers never see
+    # a partially written file
+    def __init__(self, store):
+        self._store = store
+        os.makedirs(store.directory, exist_ok=True)
+        fd, self._temp_path = tempfile.mkstemp(
+            dir=store.directory, prefix=store.TEMP_FILE_PREFIX
+        )
+        self._file = os.fdopen(fd, 'wb')
+        self.path = self._temp_path
+        self.size = 0
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def open(self):
+        # Content written so far is readable before it is committed
+        if self._file is not None:
+            self._file.flush()
+
+        return open(self.path, mode=self._store.READ_BINARY_MODE)
+
+    def commit(self, digest):
+        if self._file is None:
+            return
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+        if self._store.refresh(digest):
+            os.unlink(self._temp_path)
+        else:
+            path = self._store.get_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._temp_path, path)
+        self.path = self._store.get_path(digest)
+
+    def abort(self):
+        # Writer which is committed already keeps its file
+        if self._file is None:
+            return
+
+        self._file.close()
+        self._file = None
+        os.unlink(self._temp_path)
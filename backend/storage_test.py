@@ -0,0 +1,130 @@
+# coding: utf-8
+
+
+import os
+import time
+
+from backend import storage
+
+
+class TestFileBlobStore:
+    DIGEST = 'ab' + '0' * 62
+    OTHER_DIGEST = 'cd' + '0' * 62
+
+    def test_put_blob_is_read(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        store.put(self.DIGEST, [b'0123', b'4567'])
+
+        assert store.exists(self.DIGEST)
+        assert store.read(self.DIGEST) == b'01234567'
+        assert store.get_size(self.DIGEST) == 8
+        assert store.get_relative_path(self.DIGEST) == os.path.join(
+            'ab', self.DIGEST
+        )
+
+    def test_missing_blob_does_not_exist(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+
+        assert not store.exists(self.DIGEST)
+
+    def test_put_existing_blob_keeps_content(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        store.put(self.DIGEST, [b'0123'])
+        store.put(self.DIGEST, [b'4567'])
+
+        assert store.read(self.DIGEST) == b'0123'
+
+    def test_failed_put_leaves_no_files(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+
+        def failing_chunks():
+            yield b'0123'
+            raise ValueError()
+
+        try:
+            store.put(self.DIGEST, failing_chunks())
+        except ValueError:
+            pass
+
+        assert not store.exists(self.DIGEST)
+        assert os.listdir(temp_dir) == []
+
+    def test_writer_commits_content_under_digest(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        writer = store.create_writer()
+        writer.write(b'0123')
+        writer.write(b'4567')
+
+        with writer.open() as f:
+            assert f.read() == b'01234567'
+        assert not store.exists(self.DIGEST)
+
+        writer.commit(self.DIGEST)
+        writer.abort()
+
+        assert writer.size == 8
+        assert store.read(self.DIGEST) == b'01234567'
+        assert os.listdir(temp_dir) == ['ab']
+
+    def test_aborted_writer_leaves_no_files(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        writer = store.create_writer()
+        writer.write(b'0123')
+
+        writer.abort()
+
+        assert os.listdir(temp_dir) == []
+
+    def test_open_reads_content(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        store.put(self.DIGEST, [b'0123456789'])
+
+        with store.open(self.DIGEST) as f:
+            assert f.read() == b'0123456789'
+
+    def test_iterate_yields_chunks(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        store.put(self.DIGEST, [b'0123456789'])
+
+        assert list(store.iterate(self.DIGEST, 4)) == [
+            b'0123', b'4567', b'89'
+        ]
+
+    def test_collect_garbage_removes_old_unreferenced_blobs(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        store.put(self.DIGEST, [b'0123'])
+        store.put(self.OTHER_DIGEST, [b'4567'])
+
+        expired_time = time.time() - store.GARBAGE_GRACE_PERIOD - 1
+        for digest in [self.DIGEST, self.OTHER_DIGEST]:
+            os.utime(store.get_path(digest), (expired_time, expired_time))
+
+        store.collect_garbage({self.DIGEST})
+
+        assert store.exists(self.DIGEST)
+        assert not store.exists(self.OTHER_DIGEST)
+
+    def test_collect_garbage_keeps_recent_blobs(self, temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        store.put(self.DIGEST, [b'0123'])
+
+        store.collect_garbage(set())
+
+        assert store.exists(self.DIGEST)
+
+    def test_collect_garbage_skips_removed_blobs(self, monkeypatch,
+                                                 temp_dir):
+        store = storage.FileBlobStore(temp_dir)
+        store.put(self.DIGEST, [b'0123'])
+        get_mtime = os.path.getmtime
+
+        def get_removed_mtime(path):
+            # Another process collects the file first
+            os.unlink(path)
+            return get_mtime(path)
+
+        monkeypatch.setattr(os.path, 'getmtime', get_removed_mtime)
+
+        store.collect_garbage(set())
+
+        assert not store.exists(self.DIGEST)
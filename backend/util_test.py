@@ -76,3 +76,21 @@ class TestDirectoryKeyBinarySource:
         invalid_dir = '~/~'
         keys = config.DirectoryKeyBinarySource(invalid_dir).get_key_binaries()
         assert len(keys) == 0
+
+
+class TestHerokuConfig:
+    def test_pool_settings_default(self, monkeypatch):
+        monkeypatch.delenv('BUSTIME_DB_POOL_SIZE', raising=False)
+        monkeypatch.delenv('BUSTIME_DB_POOL_PRE_PING', raising=False)
+        heroku_config = config.HerokuConfig()
+
+        assert heroku_config.db_pool_size == config.Config.DEFAULT_DB_POOL_SIZE
+        assert not heroku_config.db_pool_pre_ping
+
+    def test_pool_settings_are_read(self, monkeypatch):
+        monkeypatch.setenv('BUSTIME_DB_POOL_SIZE', '2')
+        monkeypatch.setenv('BUSTIME_DB_POOL_PRE_PING', 'True')
+        heroku_config = config.HerokuConfig()
+
+        assert heroku_config.db_pool_size == 2
+        assert heroku_config.db_pool_pre_ping
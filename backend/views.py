@@ -1,48 +1,310 @@
 # coding: utf-8
 
 
+import json
+import os
 from http import HTTPStatus
 
 import flask
+import werkzeug.wsgi
 from flask_classy import FlaskView, route
 
-from backend import service
+from backend import config, service
 from backend.server import app, web_util
 
 
 class DatabasesView(FlaskView):
     HEADER_CONTENT_TYPE = 'Content-Type'
     HEADER_CONTENT_DISPOSITION = 'Content-Disposition'
+    HEADER_CONTENT_ENCODING = 'Content-Encoding'
+    HEADER_ACCEPT_RANGES = 'Accept-Ranges'
+    HEADER_VARY = 'Vary'
     HEADER_WWW_AUTHENTICATE = 'WWW-Authenticate'
     HEADER_X_CONTENT_SHA256 = 'X-Content-SHA256'
     HEADER_X_CONTENT_SIGNATURE = 'X-Content-Signature'
+    HEADER_X_CONTENT_KEY_ID = 'X-Content-Key-Id'
+    HEADER_X_CONTENT_DELTA_BASE = 'X-Content-Delta-Base'
+    HEADER_X_SENDFILE = 'X-Sendfile'
+    HEADER_X_ACCEL_REDIRECT = 'X-Accel-Redirect'
+    HEADER_LAST_EVENT_ID = 'Last-Event-ID'
+    HEADER_CACHE_CONTROL = 'Cache-Control'
 
     VALUE_WWW_AUTHENTICATE = ('RSASSA-PKCS1-v1_5 body signature with SHA512; '
                               'Base64 encoded; in X-Content-Signature header')
 
     CONTENT_TYPE_OCTET_STREAM = 'application/octet-stream'
     CONTENT_DISPOSITION_DB_FILE = 'attachment; filename=bus-time.db'
+    CONTENT_DISPOSITION_DELTA_FILE = 'attachment; filename=bus-time.db.delta'
+    VARY_ACCEPT_ENCODING = 'Accept-Encoding'
+    ACCEPT_RANGES_BYTES = 'bytes'
+    CACHE_CONTROL_IMMUTABLE = 'public, max-age=31536000, immutable'
+
+    ETAG_INFO = '{version}-{digest}'
+    ETAG_ENCODED_CONTENT = '{digest}-{encoding}'
+    ETAG_DELTA = '{digest}-delta-{from_version}'
+
+    ARG_FROM = 'from'
+    ARG_WAIT = 'wait'
+    ARG_TIMEOUT = 'timeout'
+
+    DEFAULT_WAIT_TIMEOUT = 30
+    MAX_WAIT_TIMEOUT = 60
+    # Idle connections are closed by Heroku router after 55 seconds
+    EVENTS_KEEPALIVE_INTERVAL = 25
+    EVENT_VERSION = 'version'
 
     MAX_UPDATE_CONTENT_LENGTH = 5 * 1024 * 1024
+    # Binary content is not inflated by Base64 and is parsed as it comes
+    MAX_BINARY_UPDATE_CONTENT_LENGTH = 16 * 1024 * 1024
+    MAX_MANIFEST_CONTENT_LENGTH = 64 * 1024
 
     @route('/<int:schema_version>/')
     def info(self, schema_version):
         try:
-            version = service.DatabaseQuery().get_version(schema_version)
-            return flask.jsonify(
-                dict(schema_version=schema_version, version=version)
-            )
+            wait_version = flask.request.args.get(self.ARG_WAIT)
+            if wait_version:
+                service.DatabaseVersionWatcher.get().wait_for_change(
+                    schema_version, wait_version,
+                    self.get_wait_timeout(flask.request.args)
+                )
+
+            info = service.DatabaseQuery().get_info(schema_version)
+
+            etag = self._make_info_etag(info)
+            if self._is_not_modified(etag, info):
+                return web_util.make_not_modified_response(
+                    etag, info.published_at
+                )
+
+            response = flask.jsonify(dict(
+                schema_version=schema_version,
+                version=info.version,
+                content_url=flask.url_for(
+                    'DatabasesView:version_content',
+                    schema_version=schema_version,
+                    version=info.version
+                )
+            ))
+            response.set_etag(etag)
+            response.last_modified = info.published_at
+            return response
         except service.NoDatabaseFound:
             web_util.abort(HTTPStatus.NOT_FOUND)
 
+    @classmethod
+    def get_wait_timeout(cls, args):
+        timeout = args.get(
+            cls.ARG_TIMEOUT, cls.DEFAULT_WAIT_TIMEOUT, type=int
+        )
+
+        return max(0, min(timeout, cls.MAX_WAIT_TIMEOUT))
+
+    @route('/<int:schema_version>/events/')
+    def events(self, schema_version):
+        known_version = flask.request.headers.get(self.HEADER_LAST_EVENT_ID)
+
+        return web_util.ServerSentEvents().make_response(
+            self._iterate_version_events(schema_version, known_version)
+        )
+
+    @classmethod
+    def _iterate_version_events(cls, schema_version, known_version):
+        watcher = service.DatabaseVersionWatcher.get()
+
+        while True:
+            version = watcher.wait_for_change(
+                schema_version, known_version, cls.EVENTS_KEEPALIVE_INTERVAL
+            )
+
+            yield cls.make_version_event(
+                schema_version, known_version, version
+            )
+            known_version = version
+
+    @classmethod
+    def make_version_event(cls, schema_version, known_version, version):
+        server_sent_events = web_util.ServerSentEvents()
+
+        if version is None or version == known_version:
+            return server_sent_events.KEEPALIVE
+
+        return server_sent_events.make_event(
+            cls.EVENT_VERSION,
+            json.dumps(dict(schema_version=schema_version, version=version)),
+            event_id=version
+        )
+
+    @classmethod
+    def _make_info_etag(cls, info):
+        return cls.ETAG_INFO.format(version=info.version, digest=info.digest)
+
+    @classmethod
+    def _is_not_modified(cls, etag, info):
+        return web_util.ConditionalRequest(flask.request).is_not_modified(
+            etag, info.published_at
+        )
+
+    @route('/manifest/', methods=['POST'])
+    def manifest(self):
+        if (flask.request.content_length or 0) > (
+            self.MAX_MANIFEST_CONTENT_LENGTH
+        ):
+            web_util.abort(HTTPStatus.BAD_REQUEST)
+            return
+
+        try:
+            manifest_request = service.DatabaseManifestRequest(
+                flask.request.get_data(as_text=True)
+            )
+        except service.InvalidManifestRequestError:
+            web_util.abort(HTTPStatus.BAD_REQUEST)
+            return
+
+        entries = service.DatabaseQuery().get_manifest(manifest_request)
+
+        return flask.jsonify(databases=[
+            dict(
+                schema_version=x.schema_version,
+                version=x.version,
+                digest=x.digest,
+                size=x.size,
+                update_needed=x.is_update_needed
+            )
+            for x in entries
+        ])
+
     @route('/<int:schema_version>/content/')
     def content(self, schema_version):
+        return self._make_content_response(schema_version)
+
+    @route('/<int:schema_version>/content/<version>/')
+    def version_content(self, schema_version, version):
+        response = self._make_content_response(schema_version, version)
+
+        # Content of a version never changes once published
+        response.headers[self.HEADER_CACHE_CONTROL] = (
+            self.CACHE_CONTROL_IMMUTABLE
+        )
+        return response
+
+    @classmethod
+    def _make_content_response(cls, schema_version, version=None):
         try:
-            content = service.DatabaseQuery().get_content(schema_version)
-            return self._build_database_contents_response(content)
+            query = service.DatabaseQuery()
+            range_request = web_util.RangeRequest(flask.request)
+
+            if cls._is_unconditional(version, range_request):
+                return cls._make_latest_content_response(
+                    query, schema_version
+                )
+
+            # Byte ranges always refer to the identity encoded content
+            accepted_encodings = (
+                [] if range_request.is_requested()
+                else cls._get_accepted_encodings()
+            )
+
+            # Conditional requests are resolved before the content is loaded
+            info = query.get_info(
+                schema_version, accepted_encodings, version
+            )
+
+            from_version = flask.request.args.get(cls.ARG_FROM)
+            if from_version:
+                delta_response = cls._find_delta_response(
+                    query, info, from_version
+                )
+                if delta_response:
+                    return delta_response
+
+            etag = cls._make_content_etag(info)
+            if cls._is_not_modified(etag, info):
+                return web_util.make_not_modified_response(
+                    etag, info.published_at, cls._build_vary_headers()
+                )
+
+            ranges = range_request.get_ranges(
+                info.size, etag, info.published_at
+            )
+            if ranges:
+                return cls._build_partial_content_response(
+                    info, ranges, query.open_content_slices(info)
+                )
+
+            return cls._build_whole_content_response(
+                query, info, query.iterate_content(info)
+            )
         except service.NoDatabaseFound:
             web_util.abort(HTTPStatus.NOT_FOUND)
 
+    @classmethod
+    def _is_unconditional(cls, version, range_request):
+        return (
+            version is None and
+            not flask.request.args.get(cls.ARG_FROM) and
+            not range_request.is_requested() and
+            not web_util.ConditionalRequest(flask.request).is_requested()
+        )
+
+    @classmethod
+    def _make_latest_content_response(cls, query, schema_version):
+        # Nothing is resolved before the content is sent, so it is started
+        # in the same round trip as the database state is read
+        content = query.get_content(
+            schema_version, cls._get_accepted_encodings()
+        )
+
+        return cls._build_whole_content_response(
+            query, content.info, content.chunks
+        )
+
+    @classmethod
+    def _build_whole_content_response(cls, query, info, chunks):
+        blob = query.find_content_blob(info)
+        if blob:
+            return cls._build_blob_response(info, blob)
+
+        return cls._build_database_contents_response(info, chunks)
+
+    @classmethod
+    def _find_delta_response(cls, query, info, from_version):
+        etag = cls.ETAG_DELTA.format(
+            digest=info.digest, from_version=from_version
+        )
+        if cls._is_not_modified(etag, info):
+            return web_util.make_not_modified_response(
+                etag, info.published_at, cls._build_vary_headers()
+            )
+
+        delta_content = query.find_delta(info, from_version)
+        if delta_content is None:
+            return None
+
+        response = flask.make_response(delta_content)
+        response.set_etag(etag)
+        response.last_modified = info.published_at
+
+        headers = {
+            cls.HEADER_CONTENT_TYPE: cls.CONTENT_TYPE_OCTET_STREAM,
+            cls.HEADER_CONTENT_DISPOSITION: cls.CONTENT_DISPOSITION_DELTA_FILE,
+            cls.HEADER_X_CONTENT_SHA256: info.digest,
+            cls.HEADER_X_CONTENT_DELTA_BASE: from_version
+        }
+        headers.update(cls._build_vary_headers())
+        for name, value in headers.items():
+            response.headers[name] = value
+
+        return response
+
+    @classmethod
+    def _make_content_etag(cls, info):
+        if info.encoding == service.ContentEncoder.IDENTITY_ENCODING:
+            return info.digest
+
+        return cls.ETAG_ENCODED_CONTENT.format(
+            digest=info.digest, encoding=info.encoding
+        )
+
     @route('/<int:schema_version>/contents/')
     def contents(self, schema_version):
         return flask.redirect(
@@ -53,31 +315,144 @@ class DatabasesView(FlaskView):
         )
 
     @classmethod
-    def _build_database_contents_response(cls, content):
-        response = flask.make_response(content)
+    def _get_accepted_encodings(cls):
+        accept_encodings = flask.request.accept_encodings
 
-        headers = cls._build_extra_content_headers(content)
+        encodings = [
+            x for x in service.ContentEncoders.ENCODINGS
+            if accept_encodings[x] > 0
+        ]
+
+        # Sorting is stable so server preference breaks quality ties
+        return sorted(encodings, key=lambda x: accept_encodings[x],
+                      reverse=True)
+
+    @classmethod
+    def _build_database_contents_response(cls, info, chunks):
+        response = flask.Response(chunks)
+        response.content_length = info.encoded_size
+        response.set_etag(cls._make_content_etag(info))
+        response.last_modified = info.published_at
+
+        headers = cls._build_extra_content_headers(info)
         for name, value in headers.items():
             response.headers[name] = value
 
         return response
 
     @classmethod
-    def _build_extra_content_headers(cls, contents):
-        return {
+    def _build_blob_response(cls, info, blob):
+        sendfile = config.Config.get().blob_sendfile
+
+        # Front servers take the file from the disk themselves and the
+        # worker is released as soon as headers are sent
+        if sendfile == config.Config.BLOB_SENDFILE_X_SENDFILE:
+            blob.file.close()
+            response = flask.Response()
+            response.headers[cls.HEADER_X_SENDFILE] = (
+                os.path.abspath(blob.path)
+            )
+        elif sendfile == config.Config.BLOB_SENDFILE_X_ACCEL_REDIRECT:
+            blob.file.close()
+            response = flask.Response()
+            response.headers[cls.HEADER_X_ACCEL_REDIRECT] = (
+                config.Config.get().blob_accel_redirect_prefix +
+                blob.relative_path
+            )
+        else:
+            response = flask.Response(
+                werkzeug.wsgi.wrap_file(
+                    flask.request.environ, blob.file,
+                    buffer_size=service.ContentChunks.CHUNK_SIZE
+                ),
+                direct_passthrough=True
+            )
+
+        response.content_length = info.encoded_size
+        response.set_etag(cls._make_content_etag(info))
+        response.last_modified = info.published_at
+
+        headers = cls._build_extra_content_headers(info)
+        for name, value in headers.items():
+            response.headers[name] = value
+
+        return response
+
+    @classmethod
+    def _build_partial_content_response(cls, info, ranges, slices):
+        parts = [slices.iterate_range(start, stop) for start, stop in ranges]
+
+        if len(ranges) == 1:
+            body = parts[0]
+            start, stop = ranges[0]
+            content_length = stop - start
+            content_range = web_util.make_content_range(
+                start, stop, info.size
+            )
+            content_type = cls.CONTENT_TYPE_OCTET_STREAM
+        else:
+            multipart = web_util.MultipartByteRanges(
+                cls.CONTENT_TYPE_OCTET_STREAM, info.size
+            )
+            body = multipart.iterate(ranges, parts)
+            content_length = multipart.get_length(ranges)
+            content_range = None
+            content_type = multipart.content_type
+
+        # Slices are released once the response is sent or abandoned
+        response = flask.Response(
+            werkzeug.wsgi.ClosingIterator(body, slices.close),
+            HTTPStatus.PARTIAL_CONTENT
+        )
+        response.content_length = content_length
+        response.content_range = content_range
+        response.set_etag(cls._make_content_etag(info))
+        response.last_modified = info.published_at
+
+        headers = cls._build_extra_content_headers(info)
+        headers[cls.HEADER_CONTENT_TYPE] = content_type
+        for name, value in headers.items():
+            response.headers[name] = value
+
+        return response
+
+    @classmethod
+    def _build_extra_content_headers(cls, info):
+        headers = {
             cls.HEADER_CONTENT_TYPE: cls.CONTENT_TYPE_OCTET_STREAM,
             cls.HEADER_CONTENT_DISPOSITION: cls.CONTENT_DISPOSITION_DB_FILE,
-            cls.HEADER_X_CONTENT_SHA256: service.Sha256().make_hash(contents)
+            cls.HEADER_X_CONTENT_SHA256: info.digest,
+            cls.HEADER_ACCEPT_RANGES: cls.ACCEPT_RANGES_BYTES
+        }
+        headers.update(cls._build_vary_headers())
+
+        if info.encoding != service.ContentEncoder.IDENTITY_ENCODING:
+            headers[cls.HEADER_CONTENT_ENCODING] = info.encoding
+
+        return headers
+
+    @classmethod
+    def _build_vary_headers(cls):
+        return {
+            cls.HEADER_VARY: cls.VARY_ACCEPT_ENCODING
         }
 
     @route('/', methods=['POST'])
     def deploy(self):
-        if flask.request.content_length > self.MAX_UPDATE_CONTENT_LENGTH:
+        if (flask.request.mimetype ==
+                service.BinaryDatabaseUpdateContent.CONTENT_TYPE):
+            update_content_class = service.BinaryDatabaseUpdateContent
+            max_content_length = self.MAX_BINARY_UPDATE_CONTENT_LENGTH
+        else:
+            update_content_class = service.DatabaseUpdateContent
+            max_content_length = self.MAX_UPDATE_CONTENT_LENGTH
+
+        if (flask.request.content_length or 0) > max_content_length:
             web_util.abort(HTTPStatus.BAD_REQUEST)
             return
 
         try:
-            update_content = self._deploy()
+            update_content = self._deploy(update_content_class)
 
             response = flask.jsonify(version=update_content.version)
             response.status_code = HTTPStatus.CREATED
@@ -89,15 +464,23 @@ class DatabasesView(FlaskView):
             )
         except service.InvalidUpdateContentError:
             web_util.abort(HTTPStatus.BAD_REQUEST)
+        except service.OutdatedBaseVersionError:
+            web_util.abort(HTTPStatus.CONFLICT)
 
-    def _deploy(self):
+    def _deploy(self, update_content_class):
         signature_text = flask.request.headers.get(
             self.HEADER_X_CONTENT_SIGNATURE, None
         )
-        json_data = flask.request.get_data(as_text=True)
+        key_id = flask.request.headers.get(self.HEADER_X_CONTENT_KEY_ID, None)
+        # Body is streamed rather than read in full
+        body_chunks = werkzeug.wsgi.FileWrapper(
+            flask.request.stream, service.ContentChunks.CHUNK_SIZE
+        )
 
         update = service.DatabaseUpdate()
-        update_content = update.get_update_content(json_data, signature_text)
+        update_content = update.get_update_content(
+            body_chunks, signature_text, key_id, update_content_class
+        )
         update.apply_update(update_content)
 
         return update_content
@@ -0,0 +1,428 @@
+# coding: utf-8
+
+
+import base64
+import json
+import struct
+
+from cryptography.hazmat.backends import default_backend as crypto_backend
+from cryptography.hazmat.primitives import hashes as crypto_hashes
+from cryptography.hazmat.primitives.asymmetric import padding as crypto_padding
+from cryptography.hazmat.primitives.asymmetric import rsa as crypto_rsa
+import sqlalchemy as sa
+
+from backend import config, db, delta, service, server, views
+from backend.service_test import (
+    BaseDbAwareTest, BaseKeyAwareTest, SqliteDbConfig
+)
+
+
+class TestDatabasesViewQueries(BaseDbAwareTest):
+    def _count_statements(self, path, method='GET', **kwargs):
+        return self._count_events(
+            'before_cursor_execute', path, method, **kwargs
+        )
+
+    def _count_checkouts(self, path, method='GET', **kwargs):
+        return self._count_events('checkout', path, method, **kwargs)
+
+    def _count_events(self, name, path, method, **kwargs):
+        events = []
+
+        def on_event(*args):
+            events.append(args)
+
+        engine = db.Engine.get()
+        sa.event.listen(engine, name, on_event)
+        try:
+            response = server.app.test_client().open(
+                path, method=method, **kwargs
+            )
+            response.get_data()
+        finally:
+            sa.event.remove(engine, name, on_event)
+
+        return len(events)
+
+    def test_info_issues_single_statement(self):
+        self.init_filled_database()
+
+        assert self._count_statements('/databases/1/') == 1
+
+    def test_content_issues_single_statement(self):
+        self.init_filled_database()
+
+        assert self._count_statements('/databases/1/content/') == 1
+
+    def test_content_checks_out_single_connection(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        monkeypatch.setattr(service.ContentCache.get(), '_max_size', 0)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+
+        assert self._count_statements('/databases/1/content/') == 3
+        assert self._count_checkouts('/databases/1/content/') == 1
+
+    def test_range_checks_out_single_connection(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 4)
+        self.init_database([
+            db.Database(schema_version=1, version='1',
+                        blob=db.Blob(content=b'0123456789'))
+        ])
+        headers = {'Range': 'bytes=1-'}
+
+        assert self._count_statements(
+            '/databases/1/content/', headers=headers
+        ) == 4
+        assert self._count_checkouts(
+            '/databases/1/content/', headers=headers
+        ) == 1
+
+    def test_not_modified_content_issues_single_statement(self):
+        self.init_filled_database()
+        digest = service.Sha256().make_hash(bytes(1))
+
+        assert self._count_statements(
+            '/databases/1/content/',
+            headers={'If-None-Match': '"{0}"'.format(digest)}
+        ) == 1
+
+    def test_cached_content_issues_single_statement(self):
+        self.init_filled_database()
+        self._count_statements('/databases/1/content/')
+
+        assert self._count_statements('/databases/1/content/') == 1
+
+    def test_manifest_issues_single_statement(self):
+        self.init_filled_database()
+        manifest_request = json.dumps(dict(schema_versions=[
+            dict(schema_version=x)
+            for x in range(self.MIN_VERSION, self.MAX_VERSION + 1)
+        ]))
+
+        assert self._count_statements(
+            '/databases/manifest/', method='POST', data=manifest_request,
+            content_type='application/json'
+        ) == 1
+
+    def test_request_checks_out_single_connection(self):
+        self.init_filled_database()
+
+        assert self._count_statements('/databases/1/?wait=2&timeout=0') == 2
+        assert self._count_checkouts('/databases/1/?wait=2&timeout=0') == 1
+
+
+class TestDatabasesViewContent(BaseDbAwareTest):
+    HASH_SIZE = 40
+    CONTENT = bytes(range(256)) * 16
+
+    def _init_content(self):
+        self.init_database([
+            db.Database(
+                schema_version=1, version='1',
+                blob=db.Blob(content=self.CONTENT)
+            )
+        ])
+
+    def _get(self, path='/databases/1/content/', **kwargs):
+        return server.app.test_client().get(path, **kwargs)
+
+    def _make_version(self, index):
+        return str(index) * self.HASH_SIZE
+
+    def _publish(self, index, content):
+        service.DatabaseUpdate().apply_update(
+            service.DatabaseUpdateContent(json.dumps(dict(
+                version=self._make_version(index),
+                schema_versions=[dict(
+                    schema_version=1,
+                    content=service.Base64.binary_to_base64_str(content)
+                )]
+            )))
+        )
+
+    def test_content_succeeds(self):
+        self._init_content()
+
+        response = self._get()
+
+        assert response.status_code == 200
+        assert response.get_data() == self.CONTENT
+        assert response.headers['ETag'] == '"{0}"'.format(
+            service.Sha256().make_hash(self.CONTENT)
+        )
+        assert response.headers['Accept-Ranges'] == 'bytes'
+
+    def test_matching_etag_is_not_modified(self):
+        self._init_content()
+        etag = self._get().headers['ETag']
+
+        response = self._get(headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+        assert response.get_data() == b''
+
+    def test_other_etag_is_modified(self):
+        self._init_content()
+
+        response = self._get(headers={'If-None-Match': '"other"'})
+
+        assert response.status_code == 200
+        assert response.get_data() == self.CONTENT
+
+    def test_single_range_succeeds(self):
+        self._init_content()
+
+        response = self._get(headers={'Range': 'bytes=100-299'})
+
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == 'bytes 100-299/4096'
+        assert response.get_data() == self.CONTENT[100:300]
+
+    def test_open_range_is_sent_in_windows(self, monkeypatch):
+        monkeypatch.setattr(service.ContentChunks, 'CHUNK_SIZE', 1024)
+        self._init_content()
+
+        response = self._get(
+            headers={'Range': 'bytes=100-'}, buffered=False
+        )
+        chunks = list(response.response)
+        response.close()
+
+        assert response.status_code == 206
+        assert response.content_length == 3996
+        assert [len(x) for x in chunks] == [1024, 1024, 1024, 924]
+        assert b''.join(chunks) == self.CONTENT[100:]
+
+    def test_multiple_ranges_succeed(self):
+        self._init_content()
+
+        response = self._get(headers={'Range': 'bytes=0-9,-10'})
+
+        assert response.status_code == 206
+        assert response.mimetype == 'multipart/byteranges'
+        body = response.get_data()
+        assert response.content_length == len(body)
+        assert b'Content-Range: bytes 0-9/4096\r\n' in body
+        assert b'Content-Range: bytes 4086-4095/4096\r\n' in body
+        assert self.CONTENT[:10] in body
+        assert self.CONTENT[-10:] in body
+
+    def test_unsatisfiable_range_fails(self):
+        self._init_content()
+
+        response = self._get(headers={'Range': 'bytes=5000-6000'})
+
+        assert response.status_code == 416
+        assert response.headers['Content-Range'] == 'bytes */4096'
+
+    def test_range_with_outdated_if_range_sends_content(self):
+        self._init_content()
+
+        response = self._get(
+            headers={'Range': 'bytes=0-9', 'If-Range': '"other"'}
+        )
+
+        assert response.status_code == 200
+        assert response.get_data() == self.CONTENT
+
+    def test_delta_from_known_version_succeeds(self):
+        self.init_database([])
+        first_content = b'0' * 8192
+        second_content = b'0' * 4096 + b'1' * 4096
+        self._publish(1, first_content)
+        self._publish(2, second_content)
+
+        response = self._get(
+            '/databases/1/content/?from={0}'.format(self._make_version(1))
+        )
+
+        assert response.status_code == 200
+        assert response.headers['X-Content-Delta-Base'] == (
+            self._make_version(1)
+        )
+        assert response.headers['X-Content-SHA256'] == (
+            service.Sha256().make_hash(second_content)
+        )
+        assert delta.PageDelta().apply(
+            first_content, response.get_data()
+        ) == second_content
+
+    def test_delta_from_unknown_version_sends_content(self):
+        self._init_content()
+
+        response = self._get('/databases/1/content/?from=unknown')
+
+        assert response.status_code == 200
+        assert 'X-Content-Delta-Base' not in response.headers
+        assert response.get_data() == self.CONTENT
+
+    def test_version_content_is_immutable(self):
+        self._init_content()
+
+        response = self._get('/databases/1/content/1/')
+
+        assert response.status_code == 200
+        assert response.get_data() == self.CONTENT
+        assert response.headers['Cache-Control'] == (
+            'public, max-age=31536000, immutable'
+        )
+
+    def test_latest_content_is_not_immutable(self):
+        self._init_content()
+
+        assert 'Cache-Control' not in self._get().headers
+
+    def test_unknown_version_content_fails(self):
+        self._init_content()
+
+        assert self._get('/databases/1/content/2/').status_code == 404
+
+
+class TestDatabasesViewDeploy(BaseDbAwareTest, BaseKeyAwareTest):
+    HASH_SIZE = 40
+    BINARY_CONTENT_TYPE = service.BinaryDatabaseUpdateContent.CONTENT_TYPE
+
+    def _init_keys(self, monkeypatch, temp_dir):
+        self.init_database([])
+        private_key = self._write_key(temp_dir, 'publisher.pub')
+        monkeypatch.setattr(
+            SqliteDbConfig, 'key_source',
+            property(lambda x: config.DirectoryKeyBinarySource(temp_dir))
+        )
+
+        return private_key
+
+    def _deploy(self, private_key, body, content_type='application/json'):
+        signature = private_key.sign(
+            body, crypto_padding.PKCS1v15(), crypto_hashes.SHA512()
+        )
+
+        return server.app.test_client().post(
+            '/databases/', data=body, content_type=content_type,
+            headers={
+                'X-Content-Signature': base64.b64encode(signature).decode()
+            }
+        )
+
+    def _make_version(self, index):
+        return str(index) * self.HASH_SIZE
+
+    def _make_json_body(self, index, content, base_index=None):
+        schema_version = dict(schema_version=1)
+        if base_index is None:
+            schema_version.update(
+                content=service.Base64.binary_to_base64_str(content)
+            )
+        else:
+            schema_version.update(
+                base_version=self._make_version(base_index),
+                digest=service.Sha256().make_hash(content[1]),
+                delta=service.Base64.binary_to_base64_str(
+                    delta.PageDelta().make(content[0], content[1])
+                )
+            )
+
+        return json.dumps(dict(
+            version=self._make_version(index),
+            schema_versions=[schema_version]
+        )).encode()
+
+    def _make_binary_body(self, index, content):
+        version = self._make_version(index).encode()
+        return b''.join([
+            struct.pack('>4sH', b'BTPU', len(version)), version,
+            struct.pack('>IHQ', 1, 0, len(content)), content
+        ])
+
+    def _get_content(self):
+        return server.app.test_client().get(
+            '/databases/1/content/'
+        ).get_data()
+
+    def test_json_deploy_succeeds(self, monkeypatch, temp_dir):
+        private_key = self._init_keys(monkeypatch, temp_dir)
+
+        response = self._deploy(
+            private_key, self._make_json_body(1, b'0' * 8192)
+        )
+
+        assert response.status_code == 201
+        assert json.loads(response.get_data(as_text=True)) == dict(
+            version=self._make_version(1)
+        )
+        assert self._get_content() == b'0' * 8192
+
+    def test_binary_deploy_succeeds(self, monkeypatch, temp_dir):
+        private_key = self._init_keys(monkeypatch, temp_dir)
+
+        response = self._deploy(
+            private_key, self._make_binary_body(1, b'0' * 8192),
+            self.BINARY_CONTENT_TYPE
+        )
+
+        assert response.status_code == 201
+        assert self._get_content() == b'0' * 8192
+
+    def test_deploy_format_follows_content_type(self, monkeypatch,
+                                                temp_dir):
+        private_key = self._init_keys(monkeypatch, temp_dir)
+
+        assert self._deploy(
+            private_key, self._make_binary_body(1, b'0' * 8192)
+        ).status_code == 400
+        assert self._deploy(
+            private_key, self._make_json_body(1, b'0' * 8192),
+            self.BINARY_CONTENT_TYPE
+        ).status_code == 400
+
+    def test_deploy_with_invalid_signature_fails(self, monkeypatch,
+                                                 temp_dir):
+        self._init_keys(monkeypatch, temp_dir)
+        other_key = crypto_rsa.generate_private_key(
+            self.PUBLIC_EXPONENT, self.KEY_SIZE, crypto_backend()
+        )
+
+        response = self._deploy(
+            other_key, self._make_json_body(1, b'0' * 8192)
+        )
+
+        assert response.status_code == 401
+        assert 'WWW-Authenticate' in response.headers
+
+    def test_delta_deploy_of_outdated_version_conflicts(self, monkeypatch,
+                                                        temp_dir):
+        private_key = self._init_keys(monkeypatch, temp_dir)
+        first_content = b'0' * 8192
+        second_content = b'0' * 4096 + b'1' * 4096
+        for index in [1, 2]:
+            self._deploy(
+                private_key, self._make_json_body(index, first_content)
+            )
+
+        response = self._deploy(private_key, self._make_json_body(
+            3, (first_content, second_content), base_index=1
+        ))
+
+        assert response.status_code == 409
+        assert self._get_content() == first_content
+
+    def test_too_large_deploy_fails(self, monkeypatch, temp_dir):
+        private_key = self._init_keys(monkeypatch, temp_dir)
+        body = self._make_json_body(
+            1, bytes(views.DatabasesView.MAX_UPDATE_CONTENT_LENGTH)
+        )
+
+        assert self._deploy(private_key, body).status_code == 400
+
+    def test_route_limits_fit_application_limit(self):
+        view_limits = [
+            views.DatabasesView.MAX_UPDATE_CONTENT_LENGTH,
+            views.DatabasesView.MAX_BINARY_UPDATE_CONTENT_LENGTH,
+            views.DatabasesView.MAX_MANIFEST_CONTENT_LENGTH
+        ]
+
+        assert max(view_limits) == server.app.config['MAX_CONTENT_LENGTH']
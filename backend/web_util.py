@@ -1,10 +1,13 @@
 # coding: utf-8
 
 
+import datetime
+import uuid
 from http import HTTPStatus
 
 
 import flask
+import werkzeug.datastructures as datastructures
 import werkzeug.exceptions as http_exceptions
 
 
@@ -41,6 +44,12 @@ class JsonHttpExceptionHandler:
                 code, JsonHttpExceptionHandler._make_error_response
             )
 
+        # Handlers are looked up by the class code, which is not set for
+        # exceptions raised by abort
+        app.register_error_handler(
+            JsonHttpException, JsonHttpExceptionHandler._make_error_response
+        )
+
     @classmethod
     def _make_error_response(cls, ex):
         if isinstance(ex, JsonHttpException):
@@ -66,3 +75,215 @@ class JsonHttpExceptionHandler:
             default_exception.description
         )
 
+
+class HttpDate:
+    @classmethod
+    def normalize(cls, value):
+        # HTTP dates are in UTC and have a precision of one second
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+
+        return value.replace(tzinfo=None, microsecond=0)
+
+
+class ConditionalRequest:
+    HEADER_IF_NONE_MATCH = 'If-None-Match'
+    HEADER_IF_MODIFIED_SINCE = 'If-Modified-Since'
+
+    def __init__(self, request):
+        self._request = request
+
+    def is_requested(self):
+        return (
+            self.HEADER_IF_NONE_MATCH in self._request.headers or
+            self.HEADER_IF_MODIFIED_SINCE in self._request.headers
+        )
+
+    def is_not_modified(self, etag, last_modified):
+        # If-Modified-Since is ignored when If-None-Match is present,
+        # see section 6 of RFC 7232
+        if self.HEADER_IF_NONE_MATCH in self._request.headers:
+            return self._request.if_none_match.contains_weak(etag)
+
+        if_modified_since = self._request.if_modified_since
+        if if_modified_since and last_modified:
+            return (
+                HttpDate.normalize(last_modified) <=
+                HttpDate.normalize(if_modified_since)
+            )
+
+        return False
+
+
+class RangeRequest:
+    HEADER_IF_RANGE = 'If-Range'
+    HEADER_CONTENT_RANGE = 'Content-Range'
+
+    BYTES_UNIT = 'bytes'
+    UNSATISFIED_CONTENT_RANGE = 'bytes */{0}'
+
+    # Many small or overlapping ranges make a cheap amplification attack,
+    # such requests are answered with the whole content instead
+    MAX_RANGE_COUNT = 16
+
+    def __init__(self, request):
+        self._request = request
+
+    def is_requested(self):
+        return self._request.range is not None
+
+    def get_ranges(self, length, etag, last_modified):
+        range_header = self._request.range
+
+        if not range_header or range_header.units != self.BYTES_UNIT:
+            return None
+
+        if len(range_header.ranges) > self.MAX_RANGE_COUNT:
+            return None
+
+        if not self._is_if_range_satisfied(etag, last_modified):
+            return None
+
+        ranges = [
+            x for x in (
+                self._resolve_range(start, stop, length)
+                for start, stop in range_header.ranges
+            )
+            if x
+        ]
+
+        if not ranges:
+            abort(
+                HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={
+                    self.HEADER_CONTENT_RANGE:
+                        self.UNSATISFIED_CONTENT_RANGE.format(length)
+                }
+            )
+
+        return ranges
+
+    def _is_if_range_satisfied(self, etag, last_modified):
+        if self.HEADER_IF_RANGE not in self._request.headers:
+            return True
+
+        if_range = self._request.if_range
+
+        if if_range.etag:
+            return if_range.etag == etag
+
+        if if_range.date and last_modified:
+            return (
+                HttpDate.normalize(last_modified) ==
+                HttpDate.normalize(if_range.date)
+            )
+
+        return False
+
+    def _resolve_range(self, start, stop, length):
+        if start < 0:
+            start = max(0, length + start)
+            stop = length
+        else:
+            stop = length if stop is None else min(stop, length)
+
+        if start >= stop:
+            return None
+
+        return start, stop
+
+
+class MultipartByteRanges:
+    CONTENT_TYPE = 'multipart/byteranges; boundary={0}'
+    CRLF = b'\r\n'
+    PART_HEADERS = 'Content-Type: {0}\r\nContent-Range: {1}\r\n\r\n'
+    ASCII_ENCODING = 'ascii'
+
+    def __init__(self, content_type, length):
+        self._content_type = content_type
+        self._length = length
+        self._boundary = uuid.uuid4().hex
+
+    @property
+    def content_type(self):
+        return self.CONTENT_TYPE.format(self._boundary)
+
+    def iterate(self, ranges, parts):
+        # Parts are iterables of chunks and are sent on as they are read
+        for (start, stop), part in zip(ranges, parts):
+            yield self._build_part_head(start, stop)
+            for chunk in part:
+                yield chunk
+            yield self.CRLF
+        yield self._build_tail()
+
+    def get_length(self, ranges):
+        return sum(
+            len(self._build_part_head(start, stop)) + stop - start +
+            len(self.CRLF)
+            for start, stop in ranges
+        ) + len(self._build_tail())
+
+    def _build_part_head(self, start, stop):
+        return (
+            self._build_delimiter() + self.CRLF +
+            self._build_part_headers(start, stop)
+        )
+
+    def _build_tail(self):
+        return self._build_delimiter() + b'--' + self.CRLF
+
+    def _build_delimiter(self):
+        return b'--' + self._boundary.encode(self.ASCII_ENCODING)
+
+    def _build_part_headers(self, start, stop):
+        content_range = make_content_range(start, stop, self._length)
+        headers = self.PART_HEADERS.format(
+            self._content_type, content_range.to_header()
+        )
+        return headers.encode(self.ASCII_ENCODING)
+
+
+class ServerSentEvents:
+    CONTENT_TYPE = 'text/event-stream'
+    HEADERS = {
+        'Cache-Control': 'no-cache',
+        # Events are not to be held in buffers of front servers
+        'X-Accel-Buffering': 'no'
+    }
+    KEEPALIVE = ': keepalive\n\n'
+
+    def make_event(self, event, data, event_id=None):
+        lines = []
+        if event_id is not None:
+            lines.append('id: {0}'.format(event_id))
+        lines.append('event: {0}'.format(event))
+        lines.extend('data: {0}'.format(x) for x in data.split('\n'))
+
+        return '\n'.join(lines) + '\n\n'
+
+    def make_response(self, events):
+        response = flask.Response(events, mimetype=self.CONTENT_TYPE)
+
+        for name, value in self.HEADERS.items():
+            response.headers[name] = value
+
+        return response
+
+
+def make_content_range(start, stop, length):
+    return datastructures.ContentRange(
+        RangeRequest.BYTES_UNIT, start, stop, length
+    )
+
+
+def make_not_modified_response(etag, last_modified, headers=None):
+    response = flask.make_response('', HTTPStatus.NOT_MODIFIED)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+
+    if headers:
+        for name, value in headers.items():
+            response.headers[name] = value
+
+    return response
@@ -0,0 +1,146 @@
+# coding: utf-8
+
+
+import datetime
+
+import flask
+import pytest
+import werkzeug.exceptions as http_exceptions
+
+from backend import web_util
+
+
+class TestConditionalRequest:
+    LAST_MODIFIED = datetime.datetime(2016, 3, 15, 20, 5, 54, 5547)
+
+    def _is_not_modified(self, headers, etag='abc'):
+        app = flask.Flask(__name__)
+
+        with app.test_request_context(headers=headers):
+            return web_util.ConditionalRequest(
+                flask.request
+            ).is_not_modified(etag, self.LAST_MODIFIED)
+
+    def test_unconditional_is_modified(self):
+        assert not self._is_not_modified({})
+
+    def test_matching_etag_is_not_modified(self):
+        assert self._is_not_modified({'If-None-Match': '"xyz", "abc"'})
+
+    def test_weak_matching_etag_is_not_modified(self):
+        assert self._is_not_modified({'If-None-Match': 'W/"abc"'})
+
+    def test_star_etag_is_not_modified(self):
+        assert self._is_not_modified({'If-None-Match': '*'})
+
+    def test_other_etag_is_modified(self):
+        assert not self._is_not_modified({'If-None-Match': '"xyz"'})
+
+    def test_same_date_is_not_modified(self):
+        headers = {'If-Modified-Since': 'Tue, 15 Mar 2016 20:05:54 GMT'}
+        assert self._is_not_modified(headers)
+
+    def test_earlier_date_is_modified(self):
+        headers = {'If-Modified-Since': 'Tue, 15 Mar 2016 20:05:53 GMT'}
+        assert not self._is_not_modified(headers)
+
+    def test_etag_takes_precedence_over_date(self):
+        headers = {
+            'If-None-Match': '"xyz"',
+            'If-Modified-Since': 'Tue, 15 Mar 2016 20:05:54 GMT'
+        }
+        assert not self._is_not_modified(headers)
+
+
+class TestRangeRequest:
+    ETAG = 'abc'
+    LAST_MODIFIED = datetime.datetime(2016, 3, 15, 20, 5, 54)
+    LENGTH = 100
+
+    def _get_ranges(self, headers):
+        app = flask.Flask(__name__)
+
+        with app.test_request_context(headers=headers):
+            return web_util.RangeRequest(flask.request).get_ranges(
+                self.LENGTH, self.ETAG, self.LAST_MODIFIED
+            )
+
+    def test_no_range_yields_none(self):
+        assert self._get_ranges({}) is None
+
+    def test_single_range_succeeds(self):
+        assert self._get_ranges({'Range': 'bytes=0-9'}) == [(0, 10)]
+
+    def test_open_range_succeeds(self):
+        assert self._get_ranges({'Range': 'bytes=90-'}) == [(90, 100)]
+
+    def test_suffix_range_succeeds(self):
+        assert self._get_ranges({'Range': 'bytes=-5'}) == [(95, 100)]
+
+    def test_multiple_ranges_succeed(self):
+        ranges = self._get_ranges({'Range': 'bytes=0-1,10-19'})
+        assert ranges == [(0, 2), (10, 20)]
+
+    def test_range_is_clipped_to_length(self):
+        assert self._get_ranges({'Range': 'bytes=50-500'}) == [(50, 100)]
+
+    def test_unsatisfiable_range_fails(self):
+        with pytest.raises(http_exceptions.HTTPException) as ex_info:
+            self._get_ranges({'Range': 'bytes=100-'})
+        assert ex_info.value.code == 416
+
+    def test_too_many_ranges_yield_none(self):
+        header = 'bytes=' + ','.join('{0}-{0}'.format(x) for x in range(20))
+        assert self._get_ranges({'Range': header}) is None
+
+    def test_matching_if_range_etag_succeeds(self):
+        headers = {'Range': 'bytes=0-9', 'If-Range': '"abc"'}
+        assert self._get_ranges(headers) == [(0, 10)]
+
+    def test_other_if_range_etag_yields_none(self):
+        headers = {'Range': 'bytes=0-9', 'If-Range': '"xyz"'}
+        assert self._get_ranges(headers) is None
+
+    def test_matching_if_range_date_succeeds(self):
+        headers = {
+            'Range': 'bytes=0-9',
+            'If-Range': 'Tue, 15 Mar 2016 20:05:54 GMT'
+        }
+        assert self._get_ranges(headers) == [(0, 10)]
+
+
+class TestMultipartByteRanges:
+    def test_iterate_succeeds(self):
+        multipart = web_util.MultipartByteRanges('text/plain', 10)
+        boundary = multipart.content_type.split('boundary=')[1]
+        ranges = [(0, 2), (8, 10)]
+
+        body = b''.join(multipart.iterate(ranges, [[b'0', b'1'], [b'89']]))
+
+        expected = (
+            '--{0}\r\n'
+            'Content-Type: text/plain\r\n'
+            'Content-Range: bytes 0-1/10\r\n\r\n'
+            '01\r\n'
+            '--{0}\r\n'
+            'Content-Type: text/plain\r\n'
+            'Content-Range: bytes 8-9/10\r\n\r\n'
+            '89\r\n'
+            '--{0}--\r\n'
+        ).format(boundary)
+        assert body == expected.encode('ascii')
+        assert multipart.get_length(ranges) == len(body)
+
+
+class TestServerSentEvents:
+    def test_make_event_succeeds(self):
+        event = web_util.ServerSentEvents().make_event(
+            'version', '{"version": "1"}', event_id='1'
+        )
+
+        assert event == 'id: 1\nevent: version\ndata: {"version": "1"}\n\n'
+
+    def test_make_multiline_event_succeeds(self):
+        event = web_util.ServerSentEvents().make_event('version', '1\n2')
+
+        assert event == 'event: version\ndata: 1\ndata: 2\n\n'
@@ -0,0 +1,15 @@
+# coding: utf-8
+
+
+# Long-polling and event stream clients stay connected for a long time,
+# cooperative workers keep them from occupying a process each; CPU-heavy
+# publication work is moved to native threads of the gevent hub
+worker_class = 'gevent'
+worker_connections = 1000
+
+
+def post_fork(server, worker):
+    from psycogreen import gevent as psycogreen_gevent
+
+    # Database calls have to yield to other connections as well
+    psycogreen_gevent.patch_psycopg()